@@ -2,11 +2,13 @@ import os
 import json
 import shutil
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from typing import List
 
-from . import models, schemas, database, scheduler, engine
+from . import models, schemas, database, scheduler, engine, dedup, logstore, events, volumes, archive_index, catalog, dispatcher, throttle, notify, browse, watcher, snapshot
 
 router = APIRouter()
 
@@ -20,72 +22,39 @@ def get_db():
 
 # --- System Utilities ---
 @router.get("/system/browse")
-def browse_filesystem(path: str = "/"):
+def browse_filesystem(path: str = "/", cursor: str = None, limit: int = browse.PAGE_SIZE, q: str = None, refresh: bool = False):
     """
-    List directories and files in the given path.
+    List directories and files in the given path (cached, paginated).
     Used for the frontend file picker.
     """
-    if not os.path.exists(path):
+    path = os.path.abspath(path or "/")
+    if not os.path.isdir(path):
         raise HTTPException(status_code=404, detail="Path not found")
-    
-    # 获取实时挂载信息
-    active_mounts = engine.get_container_mounts() if hasattr(engine, 'get_container_mounts') else set()
-    if not active_mounts:
-        # Fallback logic if engine doesn't have it or we need local implementation
-        active_mounts = set()
-        try:
-            if os.path.exists('/proc/mounts'):
-                with open('/proc/mounts', 'r') as f:
-                    for line in f:
-                        parts = line.split()
-                        if len(parts) >= 2:
-                            if parts[1] not in {'/', '/proc', '/sys', '/dev'} and not parts[1].startswith(('/proc/', '/sys/', '/dev/')):
-                                active_mounts.add(parts[1])
-        except: pass
-
-    items = []
     try:
-        if path != "/":
-            parent = os.path.dirname(path)
-            items.append({"name": "..", "path": parent, "is_dir": True, "size": None, "is_mount": False})
-
-        with os.scandir(path) as it:
-            for entry in it:
-                try:
-                    is_dir = entry.is_dir()
-                    item_path = entry.path
-                    is_mount = is_dir and item_path in active_mounts
-                    size = None
-                    if not is_dir:
-                        try: size = entry.stat().st_size
-                        except: pass
-                        
-                    items.append({
-                        "name": entry.name,
-                        "path": item_path,
-                        "is_dir": is_dir,
-                        "size": size,
-                        "is_mount": is_mount
-                    })
-                except (OSError, PermissionError):
-                    continue
+        return browse.browse(path, cursor, max(1, min(limit, 1000)), q, refresh)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except PermissionError:
         raise HTTPException(status_code=403, detail="Permission denied")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    items.sort(key=lambda x: (not x.get('is_mount', False), not x['is_dir'], x['name'].lower()))
-    return items
+@router.post("/system/browse/stat")
+def browse_stat(request: schemas.BrowseStatRequest):
+    """大目录的文件大小按需获取 (只 stat 前端当前显示的条目)"""
+    path = os.path.abspath(request.path)
+    try:
+        return browse.stat_sizes(browse.get_listing(path), request.names[:browse.PAGE_SIZE])
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Path not found")
 
 # --- Projects ---
 
 @router.post("/projects/{project_id}/restore")
 def restore_backup(project_id: int, request: schemas.RestoreRequest):
-    scheduler.scheduler.add_job(
-        engine.run_restore_task,
-        args=[project_id, request.file_name, request.restore_mode]
-    )
-    return {"status": "Restore job submitted"}
+    job = dispatcher.enqueue_restore(project_id, request.file_name, request.restore_mode, request.paths)
+    if not job: raise HTTPException(status_code=404, detail="Project not found")
+    return {"status": "Restore job submitted", "job_id": job.id}
 
 @router.post("/projects/", response_model=schemas.Project)
 def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)):
@@ -93,25 +62,58 @@ def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)
     db.add(db_project)
     db.commit()
     db.refresh(db_project)
+    watcher.service.configure(db_project)
     return db_project
 
+# 列表接口只取摘要字段，log_message 等大文本不加载 (完整日志走 /history/{id}/log)
+LATEST_HISTORY_FIELDS = ("id", "project_id", "task_type", "status", "progress", "start_time", "end_time", "file_size_bytes", "file_name", "remark",
+                         "bytes_copied", "bytes_skipped", "files_added", "files_updated", "files_renamed", "files_deleted", "files_skipped")
+
+def latest_history_map(db: Session, project_ids: list) -> dict:
+    """每个项目最近一次运行，窗口函数单次查询"""
+    if not project_ids: return {}
+    H = models.BackupHistory
+    rn = func.row_number().over(partition_by=H.project_id, order_by=(H.start_time.desc(), H.id.desc())).label("rn")
+    sub = select(*[getattr(H, f) for f in LATEST_HISTORY_FIELDS], rn).where(H.project_id.in_(project_ids)).subquery()
+    rows = db.execute(select(sub).where(sub.c.rn == 1)).mappings()
+    return {r["project_id"]: {f: r[f] for f in LATEST_HISTORY_FIELDS} for r in rows}
+
+def schedule_map(db: Session, project_ids: list) -> dict:
+    schedules = {}
+    if not project_ids: return schedules
+    for s in db.query(models.BackupSchedule).filter(models.BackupSchedule.project_id.in_(project_ids)).order_by(models.BackupSchedule.id):
+        schedules.setdefault(s.project_id, s)
+    return schedules
+
+def next_run_map() -> dict:
+    # 一次读取全部作业，避免逐个 get_job 访问作业存储
+    return {job.id: job.next_run_time for job in scheduler.scheduler.get_jobs()}
+
 @router.get("/projects/", response_model=List[schemas.Project])
 def read_projects(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    projects = db.query(models.BackupProject).offset(skip).limit(limit).all()
+    projects = db.query(models.BackupProject).order_by(models.BackupProject.id).offset(skip).limit(limit).all()
+    ids = [p.id for p in projects]
+    latest, schedules, next_runs = latest_history_map(db, ids), schedule_map(db, ids), next_run_map()
     for p in projects:
-        latest = (
-            db.query(models.BackupHistory)
-            .filter(models.BackupHistory.project_id == p.id)
-            .order_by(models.BackupHistory.start_time.desc())
-            .first()
-        )
-        p.latest_history = latest
-        db_schedule = db.query(models.BackupSchedule).filter(models.BackupSchedule.project_id == p.id).first()
-        p.schedule = db_schedule
-        job = scheduler.scheduler.get_job(f"backup_project_{p.id}")
-        p.next_run_time = job.next_run_time if job else None
+        p.latest_history = latest.get(p.id)
+        p.schedule = schedules.get(p.id)
+        p.next_run_time = next_runs.get(f"backup_project_{p.id}")
     return projects
 
+@router.get("/projects/summary", response_model=List[schemas.ProjectSummary])
+def read_projects_summary(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    """仪表盘轻量列表: 只查询展示所需的列"""
+    P = models.BackupProject
+    rows = db.execute(select(P.id, P.name, P.archive_format, P.destination_type).order_by(P.id).offset(skip).limit(limit)).all()
+    ids = [r.id for r in rows]
+    latest, schedules, next_runs = latest_history_map(db, ids), schedule_map(db, ids), next_run_map()
+    return [{
+        "id": r.id, "name": r.name, "archive_format": r.archive_format, "destination_type": r.destination_type,
+        "latest_history": latest.get(r.id),
+        "schedule_active": bool(schedules.get(r.id) and schedules[r.id].is_active),
+        "next_run_time": next_runs.get(f"backup_project_{r.id}"),
+    } for r in rows]
+
 @router.post("/projects/{project_id}/duplicate", response_model=schemas.Project)
 def duplicate_project(project_id: int, db: Session = Depends(get_db)):
     original = db.query(models.BackupProject).filter(models.BackupProject.id == project_id).first()
@@ -132,10 +134,23 @@ def duplicate_project(project_id: int, db: Session = Depends(get_db)):
         archive_format=original.archive_format,
         use_compression=original.use_compression,
         compression_level=original.compression_level,
+        compress_threads=original.compress_threads,
         exclude_patterns=original.exclude_patterns,
         sync_threads=original.sync_threads,
+        upload_threads=original.upload_threads,
+        volume_size_mb=original.volume_size_mb,
+        read_limit_mb=original.read_limit_mb,
+        write_limit_mb=original.write_limit_mb,
+        throttle_schedule=original.throttle_schedule,
+        pipeline_mode=original.pipeline_mode,
         sync_mode=original.sync_mode,
-        keep_versions=original.keep_versions
+        sync_verify_days=original.sync_verify_days,
+        watch_source=original.watch_source,
+        keep_versions=original.keep_versions,
+        keep_hourly=original.keep_hourly,
+        keep_daily=original.keep_daily,
+        keep_weekly=original.keep_weekly,
+        keep_monthly=original.keep_monthly
     )
     db.add(new_project)
     db.commit()
@@ -152,6 +167,7 @@ def duplicate_project(project_id: int, db: Session = Depends(get_db)):
         )
         db.add(new_sched)
         db.commit()
+    watcher.service.configure(new_project)
     return new_project
 
 @router.delete("/projects/{project_id}")
@@ -160,6 +176,8 @@ def delete_project(project_id: int, db: Session = Depends(get_db)):
     if not project: raise HTTPException(status_code=404, detail="Project not found")
     try: scheduler.scheduler.remove_job(f"backup_project_{project_id}")
     except: pass
+    dispatcher.dispatcher.cancel_project(project_id)
+    watcher.service.remove(project_id)
     db.delete(project)
     db.commit()
     return {"status": "deleted"}
@@ -171,6 +189,8 @@ def update_project(project_id: int, project_update: schemas.ProjectCreate, db: S
     for key, value in project_update.dict().items(): setattr(db_project, key, value)
     db.commit()
     db.refresh(db_project)
+    throttle.reconfigure(db_project)
+    watcher.service.configure(db_project)
     return db_project
 
 @router.put("/projects/{project_id}/schedule", response_model=schemas.Schedule)
@@ -194,10 +214,10 @@ def update_schedule(project_id: int, schedule: schemas.ScheduleCreate, db: Sessi
             elif schedule.interval_unit == 'days': trigger_args['days'] = schedule.interval_value
             elif schedule.interval_unit == 'weeks': trigger_args['weeks'] = schedule.interval_value
             else: trigger_args['seconds'] = schedule.interval_value
-            scheduler.scheduler.add_job(engine.run_backup_task, 'interval', args=[project_id], id=job_id, replace_existing=True, **trigger_args)
+            scheduler.scheduler.add_job(dispatcher.run_scheduled_backup, 'interval', args=[project_id], id=job_id, replace_existing=True, **trigger_args)
         elif schedule.schedule_type == "cron":
             parts = schedule.cron_expression.split()
-            if len(parts) >= 5: scheduler.scheduler.add_job(engine.run_backup_task, 'cron', minute=parts[0], hour=parts[1], day=parts[2], month=parts[3], day_of_week=parts[4], args=[project_id], id=job_id, replace_existing=True)
+            if len(parts) >= 5: scheduler.scheduler.add_job(dispatcher.run_scheduled_backup, 'cron', minute=parts[0], hour=parts[1], day=parts[2], month=parts[3], day_of_week=parts[4], args=[project_id], id=job_id, replace_existing=True)
     return db_schedule
 
 @router.post("/projects/{project_id}/schedule/", response_model=schemas.Schedule)
@@ -217,13 +237,52 @@ def read_schedule(project_id: int, db: Session = Depends(get_db)):
 @router.post("/projects/{project_id}/run")
 def run_backup_now(project_id: int, request: schemas.RunRequest = None):
     remark = request.remark if request else None
-    scheduler.scheduler.add_job(engine.run_backup_task, args=[project_id, None, remark])
-    return {"status": "Job submitted"}
+    job = dispatcher.enqueue_backup(project_id, remark)
+    if not job: raise HTTPException(status_code=404, detail="Project not found")
+    return {"status": "Job submitted", "job_id": job.id}
+
+@router.post("/projects/{project_id}/prune")
+def prune_versions_now(project_id: int):
+    """按当前保留策略清理旧版本 (修改策略后可手动触发，否则在下次备份成功后执行)"""
+    job = dispatcher.enqueue_prune(project_id)
+    if not job: raise HTTPException(status_code=404, detail="Project not found")
+    return {"status": "Job submitted", "job_id": job.id}
 
 @router.post("/projects/{project_id}/stop")
 def stop_backup_task(project_id: int):
-    engine.stop_signals[project_id] = True
-    return {"status": "Stop signal sent"}
+    # 排队中的任务直接移出队列; 只有正在运行时才发送停止信号，避免误伤之后的任务
+    cancelled = dispatcher.dispatcher.cancel_project(project_id)
+    if dispatcher.dispatcher.is_running(project_id): engine.stop_signals[project_id] = True
+    return {"status": "Stop signal sent", "cancelled": cancelled}
+
+# --- Job Queue ---
+
+@router.get("/queue")
+def read_queue():
+    return dispatcher.dispatcher.snapshot()
+
+@router.get("/throughput")
+def read_throughput():
+    return throttle.all_stats()
+
+@router.delete("/queue/{job_id}")
+def cancel_queued_job(job_id: int):
+    if not dispatcher.dispatcher.cancel(job_id): raise HTTPException(status_code=404, detail="Job not queued")
+    return {"status": "Job cancelled"}
+
+# --- Live Events (SSE) ---
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@router.get("/events")
+def stream_events(request: Request):
+    """全局任务状态推送 (Server-Sent Events)"""
+    return StreamingResponse(events.sse_stream(request), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/projects/{project_id}/events")
+def stream_project_events(project_id: int, request: Request):
+    """单个项目的状态与日志增量推送"""
+    return StreamingResponse(events.sse_stream(request, project_id), media_type="text/event-stream", headers=SSE_HEADERS)
 
 # --- History & Backups ---
 
@@ -251,10 +310,13 @@ def discover_project_backups(project_id: int, db: Session = Depends(get_db)):
     prefix = project.name.replace(' ', '_') + "_"
     try:
         for entry in os.scandir(dest_path):
-            if entry.name.startswith(prefix):
+            # .part 为写入/上传中的文件、分卷目录或快照，.idx 为归档索引，.deleting 为删除中的快照
+            if entry.name.startswith(prefix) and not entry.name.endswith((".part", archive_index.INDEX_EXT, snapshot.TRASH_EXT)):
                 h_record = history_map.get(entry.name)
                 db_size = h_record.file_size_bytes if h_record else 0
-                final_size = db_size if db_size > 0 else entry.stat().st_size
+                # 分卷备份是一个目录，整体作为一份备份 (硬链接快照不遍历统计，以历史记录为准)
+                if db_size > 0 or entry.name.endswith(snapshot.SNAP_EXT): final_size = db_size
+                else: final_size = volumes.set_size(entry.path) if entry.is_dir() else entry.stat().st_size
                 
                 backups.append({
                     "id": h_record.id if h_record else None,
@@ -265,21 +327,94 @@ def discover_project_backups(project_id: int, db: Session = Depends(get_db)):
                     "log_message": h_record.log_message if h_record else "物理发现的文件 (数据库日志已清除)"
                 })
     except: pass
+
+    # 去重仓库中的快照
+    snapshots_dir = os.path.join(dedup.repo_path_for(project), "snapshots")
+    if os.path.isdir(snapshots_dir):
+        try:
+            for entry in os.scandir(snapshots_dir):
+                if not entry.name.endswith(dedup.SNAPSHOT_EXT): continue
+                h_record = history_map.get(entry.name)
+                backups.append({
+                    "id": h_record.id if h_record else None,
+                    "file_name": entry.name,
+                    "status": h_record.status if h_record else "success",
+                    "start_time": h_record.start_time if h_record else datetime.fromtimestamp(entry.stat().st_mtime),
+                    "file_size_bytes": h_record.file_size_bytes if h_record else entry.stat().st_size,
+                    "log_message": h_record.log_message if h_record else "物理发现的快照 (数据库日志已清除)"
+                })
+        except: pass
     backups.sort(key=lambda x: x['start_time'], reverse=True)
     return backups
 
+@router.get("/projects/{project_id}/backups/{file_name}/entries")
+def list_backup_entries(project_id: int, file_name: str, prefix: str = "", limit: int = 1000, db: Session = Depends(get_db)):
+    """按归档索引列出备份中的文件，用于选择部分还原的路径"""
+    project = db.query(models.BackupProject).filter(models.BackupProject.id == project_id).first()
+    if not project: raise HTTPException(status_code=404, detail="Project not found")
+    archive_path = os.path.join(project.destination_path, file_name)
+    if file_name.endswith(snapshot.SNAP_EXT):
+        if not os.path.isdir(archive_path): raise HTTPException(status_code=404, detail="快照不存在")
+        entries = list(snapshot.iter_files(archive_path, prefix))
+        return {"total": len(entries), "entries": [{"path": rp, "size": st.st_size, "mtime": int(st.st_mtime)} for rp, st in entries[:limit]]}
+    try: index = archive_index.load_index(archive_path, project.encryption_password)
+    except Exception as e: raise HTTPException(status_code=400, detail=f"索引读取失败: {e}")
+    if not index: raise HTTPException(status_code=404, detail="该备份没有归档索引")
+    members = archive_index.select_members(index["members"], [prefix])
+    return {
+        "total": len(members),
+        "entries": [{"path": m[0], "size": m[2], "mtime": m[3]} for m in members[:limit]],
+    }
+
+# --- Backup Catalog ---
+
+@router.get("/projects/{project_id}/catalog/versions")
+def catalog_versions(project_id: int):
+    with catalog.Catalog(project_id) as c: return c.versions()
+
+@router.get("/projects/{project_id}/catalog/{history_id}/tree")
+def catalog_tree(project_id: int, history_id: int, path: str = ""):
+    with catalog.Catalog(project_id) as c:
+        if not c.has_version(history_id): raise HTTPException(status_code=404, detail="该备份没有文件目录")
+        return c.tree(history_id, path)
+
+@router.get("/projects/{project_id}/catalog/search")
+def catalog_search(project_id: int, q: str = "", path: str = None, limit: int = 100):
+    """path 精确查找某个文件的所有版本，q 按子串搜索路径"""
+    with catalog.Catalog(project_id) as c:
+        if path: return c.lookup(path)
+        if not q: raise HTTPException(status_code=400, detail="缺少搜索条件")
+        return c.search(q, min(limit, 1000))
+
+@router.get("/projects/{project_id}/catalog/diff")
+def catalog_diff(project_id: int, old: int, new: int):
+    with catalog.Catalog(project_id) as c:
+        if not (c.has_version(old) and c.has_version(new)): raise HTTPException(status_code=404, detail="版本不存在")
+        return c.diff(old, new)
+
 @router.delete("/projects/{project_id}/history")
 def clear_project_history(project_id: int, clean_files: bool = False, file_name: str = None, db: Session = Depends(get_db)):
     project = db.query(models.BackupProject).filter(models.BackupProject.id == project_id).first()
     if not project: raise HTTPException(status_code=404, detail="Project not found")
     if file_name:
         file_path = os.path.join(project.destination_path, file_name)
-        if os.path.exists(file_path):
+        if file_name.endswith(dedup.SNAPSHOT_EXT):
+            try: dedup.delete_snapshots(dedup.repo_path_for(project), [file_name], project.encryption_password)
+            except: pass
+        elif file_name.endswith(snapshot.SNAP_EXT):
+            try: snapshot.delete_snapshot(file_path)
+            except: pass
+        elif os.path.exists(file_path):
+            archive_index.remove_index(file_path)
             try:
                 if os.path.isdir(file_path): shutil.rmtree(file_path)
                 else: os.remove(file_path)
             except: pass
-        db.query(models.BackupHistory).filter(models.BackupHistory.project_id == project_id, models.BackupHistory.file_name == file_name).delete()
+        query = db.query(models.BackupHistory).filter(models.BackupHistory.project_id == project_id, models.BackupHistory.file_name == file_name)
+        ids = [h.id for h in query.with_entities(models.BackupHistory.id)]
+        logstore.delete_logs(ids)
+        catalog.delete_versions(project_id, ids)
+        query.delete()
         db.commit()
         return {"status": "deleted"}
     
@@ -294,9 +429,13 @@ def clear_project_history(project_id: int, clean_files: bool = False, file_name:
                             else: os.remove(entry.path)
                         except: pass
             except: pass
+        dedup.remove_repository(dedup.repo_path_for(project))
 
-    db.query(models.BackupHistory).filter(models.BackupHistory.project_id == project_id).delete()
+    query = db.query(models.BackupHistory).filter(models.BackupHistory.project_id == project_id)
+    logstore.delete_logs([h.id for h in query.with_entities(models.BackupHistory.id)])
+    query.delete()
     db.commit()
+    catalog.remove_catalog(project_id)
     return {"status": "cleared"}
 
 # --- Import & Export ---
@@ -348,6 +487,7 @@ def import_projects(data: List[dict], db: Session = Depends(get_db)):
             else: new_sched = models.BackupSchedule(project_id=db_project.id, is_active=False)
             db.add(new_sched)
             db.commit()
+            watcher.service.configure(db_project)
             imported_count += 1
         except: continue
     return {"status": "success", "imported_count": imported_count}
@@ -356,29 +496,43 @@ def import_projects(data: List[dict], db: Session = Depends(get_db)):
 def read_global_history(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return db.query(models.BackupHistory).order_by(models.BackupHistory.start_time.desc()).offset(skip).limit(limit).all()
 
+@router.get("/history/{history_id}/log")
+def read_history_log(history_id: int, offset: int = 0, limit: int = logstore.READ_LIMIT, db: Session = Depends(get_db)):
+    """
+    增量读取任务日志: 客户端保存 next_offset，下次只拉取新增的行。
+    """
+    result = logstore.read_log(history_id, max(0, offset), max(1, min(limit, 4 * logstore.READ_LIMIT)))
+    if result is None:
+        # 旧记录没有日志文件，退回数据库中的 log_message
+        h = db.query(models.BackupHistory).filter(models.BackupHistory.id == history_id).first()
+        if not h: raise HTTPException(status_code=404, detail="History not found")
+        text = (h.log_message or "") if offset == 0 else ""
+        return {"text": text, "next_offset": offset + len(text.encode("utf-8")), "finished": h.status != "running"}
+    return result
+
 @router.delete("/history/")
 def clear_all_history(db: Session = Depends(get_db)):
+    logstore.delete_logs([h.id for h in db.query(models.BackupHistory.id)])
     db.query(models.BackupHistory).delete()
     db.commit()
+    for (pid,) in db.query(models.BackupProject.id): catalog.remove_catalog(pid)
     return {"status": "all history cleared"}
 
 # --- Settings ---
-from .config_loader import load_settings, save_settings
+from .config_loader import load_settings, set_setting_value
 
 @router.get("/settings/", response_model=List[schemas.Setting])
 def read_settings():
-    data = load_settings()
-    save_settings(data)
-    return [schemas.Setting(key=k, value=v) for k, v in data.items()]
+    return [schemas.Setting(key=k, value=v) for k, v in load_settings().items()]
 
 @router.post("/settings/", response_model=schemas.Setting)
 def update_setting(setting: schemas.Setting):
-    data = load_settings()
-    data[setting.key] = setting.value
-    save_settings(data)
+    try: set_setting_value(setting.key, setting.value)
+    except Exception as e: raise HTTPException(status_code=500, detail=f"设置保存失败: {e}")
     return setting
 
 @router.post("/settings/test-notification")
-def test_notification(db: Session = Depends(get_db)):
-    engine.send_notification("🔔 测试通知", "这是一条来自备份系统的测试消息。", db)
+def test_notification():
+    try: notify.notifier.send_now("🔔 测试通知", "这是一条来自备份系统的测试消息。")
+    except Exception as e: raise HTTPException(status_code=502, detail=f"通知发送失败: {e}")
     return {"status": "sent"}
\ No newline at end of file
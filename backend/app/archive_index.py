@@ -0,0 +1,285 @@
+import os
+import io
+import json
+import gzip
+import zlib
+import bisect
+import shutil
+import tarfile
+from . import volumes
+from .crypto import EncryptingWriter, DecryptingReader, open_seekable
+
+# 归档索引: tar/tgz 备份旁生成 <归档>.idx (分卷备份放在分卷目录内)，记录
+#   - 每个成员的路径、类型、大小、属性以及数据在 tar 流中的偏移
+#   - tgz 的重启点 (原始偏移 -> gzip 流内偏移)，可从重启点直接 raw inflate
+# 加密归档 (格式见 crypto.py) 可随机读取: 分块格式按块解密并校验，旧格式以 AES-CTR 从任意位置解密 (无法校验 tag)。
+# 索引内容为 gzip 压缩的 JSON，项目设置了密码时与归档使用相同格式加密。
+INDEX_EXT = ".idx"
+INDEX_VERSION = 1
+RESTART_BLOCKS = 4          # tgz 每 4 个压缩块 (4 MB) 一个重启点
+READ_SIZE = 256 * 1024
+
+
+def index_path_for(archive_path: str) -> str:
+    if os.path.isdir(archive_path): return os.path.join(archive_path, os.path.basename(archive_path) + INDEX_EXT)
+    return archive_path + INDEX_EXT
+
+def remove_index(archive_path: str):
+    try: os.remove(index_path_for(archive_path))
+    except OSError: pass
+
+
+class IndexedTarFile(tarfile.TarFile):
+    """写入时记录每个成员在 tar 流中的偏移"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index_entries = []
+        self.wrap_source = None  # 可选: 包装源文件读取 (限速)
+
+    def addfile(self, tarinfo, fileobj=None, *args, **kwargs):
+        if fileobj is not None and self.wrap_source: fileobj = self.wrap_source(fileobj)
+        super().addfile(tarinfo, fileobj, *args, **kwargs)
+        data_offset = self.offset - (-(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE) if tarinfo.isreg() else None
+        self.index_entries.append([tarinfo.name, tarinfo.type.decode(), tarinfo.size, int(tarinfo.mtime), tarinfo.mode, data_offset, tarinfo.linkname or None])
+
+
+def build_index(tar: IndexedTarFile, gzip_writer=None, encrypted: bool = False) -> dict:
+    return {
+        "version": INDEX_VERSION,
+        "compression": "gzip" if gzip_writer else None,
+        "encrypted": encrypted,
+        "restart_points": [list(p) for p in gzip_writer.restart_points] if gzip_writer else [],
+        "members": tar.index_entries,
+    }
+
+def save_index(archive_path: str, index: dict, password: str = None, salt: bytes = None):
+    path = index_path_for(archive_path)
+    data = gzip.compress(json.dumps(index, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+    with open(path + ".tmp", "wb") as f:
+        if password:
+            with EncryptingWriter(f, password, salt=salt) as enc: enc.write(data)
+        else:
+            f.write(data)
+    os.replace(path + ".tmp", path)
+
+def load_index(archive_path: str, password: str = None):
+    """读取索引，不存在时返回 None (旧版本备份)"""
+    path = index_path_for(archive_path)
+    if not os.path.exists(path): return None
+    with open(path, "rb") as f:
+        raw = DecryptingReader(f, password).read() if password else f.read()
+    index = json.loads(gzip.decompress(raw))
+    return index if index.get("version") == INDEX_VERSION else None
+
+
+def path_filter(paths: list):
+    """返回判断相对路径是否被选中的函数: 路径相同，或位于该目录 (子树) 之下; 未指定路径时返回 None"""
+    prefixes = [p.strip().strip("/") for p in paths or [] if p and p.strip()]
+    if not prefixes or "" in prefixes or "." in prefixes: return None
+    exact = set(prefixes)
+    dirs = tuple(p + "/" for p in prefixes)
+    return lambda name: name in exact or name.startswith(dirs)
+
+def select_members(members: list, paths: list) -> list:
+    selected = path_filter(paths)
+    return [m for m in members if selected is None or selected(m[0])]
+
+
+def _open_source(archive_path: str):
+    if os.path.isdir(archive_path): return SeekableVolumes(volumes.set_volumes(archive_path))
+    return open(archive_path, "rb")
+
+
+class ThrottledSeekable(io.RawIOBase):
+    """可随机读取的限速视图"""
+
+    def __init__(self, raw, throttle):
+        self.raw = raw
+        self.throttle = throttle
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def readinto(self, b) -> int:
+        n = self.raw.readinto(b)
+        self.throttle.on_read(n or 0)
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class SeekableVolumes(io.RawIOBase):
+    """分卷集合的随机读取视图"""
+
+    def __init__(self, paths: list):
+        self.paths = paths
+        self.starts, total = [], 0
+        for p in paths:
+            self.starts.append(total)
+            total += os.path.getsize(p)
+        self.length = total
+        self.pos = 0
+        self.current, self.current_idx = None, -1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.pos = offset if whence == io.SEEK_SET else (self.pos + offset if whence == io.SEEK_CUR else self.length + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readinto(self, b) -> int:
+        if self.pos >= self.length: return 0
+        idx = bisect.bisect_right(self.starts, self.pos) - 1
+        if idx != self.current_idx:
+            if self.current: self.current.close()
+            self.current, self.current_idx = open(self.paths[idx], "rb"), idx
+        self.current.seek(self.pos - self.starts[idx])
+        n = self.current.readinto(b)
+        self.pos += n
+        return n
+
+    def close(self):
+        if self.current: self.current.close()
+        super().close()
+
+
+class IndexedArchive:
+    """按 tar 流偏移随机读取成员数据"""
+
+    def __init__(self, archive_path: str, index: dict, password: str = None, throttle=None):
+        self.index = index
+        source = _open_source(archive_path)
+        if throttle: source = ThrottledSeekable(source, throttle)
+        self.stream = open_seekable(source, password) if index.get("encrypted") else source
+        points = index.get("restart_points") or []
+        self.raw_points = [p[0] for p in points]
+        self.comp_points = [p[1] for p in points]
+        # 向前跳读不超过两个重启间隔时继续解压，否则重新定位
+        self.skip_limit = (self.raw_points[1] - self.raw_points[0]) * 2 if len(points) > 1 else 0
+        self.inflater, self.pos, self.out = None, 0, bytearray()
+
+    def _seek(self, offset: int):
+        if not self.raw_points:
+            self.stream.seek(offset)
+            self.pos = offset
+            return
+        if self.inflater is None or not (self.pos <= offset <= self.pos + self.skip_limit):
+            i = bisect.bisect_right(self.raw_points, offset) - 1
+            self.stream.seek(self.comp_points[i])
+            self.inflater, self.pos, self.out = zlib.decompressobj(-zlib.MAX_WBITS), self.raw_points[i], bytearray()
+        while self.pos < offset:
+            skipped = self._take(min(offset - self.pos, READ_SIZE))
+            # 归档被截断 (云端未同步完整) 或索引偏移超出数据流
+            if not skipped: raise Exception("归档数据不完整")
+            self.pos += len(skipped)
+
+    def _take(self, n: int) -> bytes:
+        if not self.raw_points:
+            data = self.stream.read(n)
+            self.pos += len(data)
+            return data
+        while len(self.out) < n and not self.inflater.eof:
+            data = self.stream.read(READ_SIZE)
+            if not data: break
+            self.out += self.inflater.decompress(data)
+        chunk = bytes(self.out[:n])
+        del self.out[:n]
+        return chunk
+
+    def read_range(self, offset: int, size: int):
+        """逐块产出 [offset, offset + size) 的数据"""
+        self._seek(offset)
+        while size > 0:
+            chunk = self._take(min(size, READ_SIZE))
+            if not chunk: raise Exception("归档数据不完整")
+            if self.raw_points: self.pos += len(chunk)
+            size -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.stream.close()
+
+
+def _write_range(archive: IndexedArchive, data_offset: int, size: int, dst: str, throttle=None):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with open(dst, "wb") as f:
+        for chunk in archive.read_range(data_offset, size):
+            if throttle: throttle.on_write(len(chunk))
+            f.write(chunk)
+
+def restore_members(archive: IndexedArchive, members: list, target: str, on_progress=None, check_stop=None, throttle=None,
+                    all_members: list = None, log_buffer=None) -> int:
+    """
+    按数据偏移顺序还原选中的成员，返回还原数量。
+    硬链接成员没有数据偏移: 目标已在本次还原中写出时直接链接 (失败则复制)，否则按 all_members (完整索引) 中目标的偏移读取数据。
+    无法还原的成员写入 log_buffer 警告。
+    """
+    regular = sorted((m for m in members if m[5] is not None), key=lambda m: m[5])
+    others = [m for m in members if m[5] is None]
+    by_name = {m[0]: m for m in (all_members or members)}
+    restored = set()
+    total, count = len(members), 0
+
+    def skip(name: str, reason: str):
+        if log_buffer: log_buffer.write(f"[WARN] {reason}，已跳过: {name}\n")
+
+    for name, mtype, size, mtime, mode, data_offset, linkname in regular + others:
+        if check_stop: check_stop()
+        count += 1
+        if name.startswith("/") or ".." in name:
+            skip(name, "不安全的路径")
+            continue
+        dst = os.path.join(target, name)
+        if mtype == tarfile.DIRTYPE.decode():
+            os.makedirs(dst, exist_ok=True)
+        elif mtype == tarfile.SYMTYPE.decode():
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.lexists(dst): os.remove(dst)
+            os.symlink(linkname, dst)
+            continue
+        elif data_offset is not None:
+            _write_range(archive, data_offset, size, dst, throttle)
+            restored.add(name)
+        elif mtype == tarfile.LNKTYPE.decode():
+            source = by_name.get(linkname)
+            if linkname in restored:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if os.path.lexists(dst): os.remove(dst)
+                try: os.link(os.path.join(target, linkname), dst)
+                except OSError: shutil.copy2(os.path.join(target, linkname), dst)
+            elif source and source[5] is not None:
+                # 链接目标未选中: 从目标成员的数据偏移读取
+                _write_range(archive, source[5], source[2], dst, throttle)
+                mode, mtime = source[4], source[3]
+            else:
+                skip(name, f"硬链接目标 {linkname} 不在归档索引中")
+                continue
+            restored.add(name)
+        else:
+            skip(name, f"不支持的成员类型 ({mtype})")
+            continue
+        try:
+            os.chmod(dst, mode)
+            os.utime(dst, (mtime, mtime))
+        except OSError: pass
+        if on_progress: on_progress(count, total, name)
+    return count
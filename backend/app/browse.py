@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+import base64
+import bisect
+import select
+import threading
+import collections
+
+# 文件浏览 (路径选择器、存储浏览器):
+#   - 挂载表只解析一次，/proc/self/mounts 变化时内核会对打开的文件描述符发出 POLLPRI，收到后才重新解析
+#   - 目录列表缓存 CACHE_TTL 秒，期间目录 mtime 变化 (本地磁盘) 也会失效; 网盘挂载的目录 mtime 不可靠，依赖 TTL 与手动刷新
+#   - 列表只用 scandir 的 d_type 判断类型，不逐个 stat; 文件大小按页获取，大目录的大小由前端显示后再单独请求
+#   - 游标分页 (游标为上一页最后一项的排序键，目录内容变化时不会重复或跳过未变化的条目) 与服务端名称过滤
+CACHE_TTL = 60
+CACHE_DIRS = 64
+PAGE_SIZE = 200
+DEFER_STAT_THRESHOLD = 1000   # 超过该条目数的目录不在列表请求中 stat
+MOUNTS_FILE = "/proc/self/mounts"
+MOUNTS_POLL_FALLBACK = 30     # 不支持 poll 时的挂载表刷新间隔
+HIDDEN_MOUNTS = {'/', '/proc', '/sys', '/dev'}
+
+
+class MountTable:
+    def __init__(self, path: str = MOUNTS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mounts, self.fd, self.poller, self.loaded = frozenset(), None, None, 0.0
+        try:
+            self.fd = os.open(path, os.O_RDONLY)
+            self.poller = select.poll()
+            self.poller.register(self.fd, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            self.poller = None
+
+    def _changed(self) -> bool:
+        if not self.loaded: return True
+        if self.poller is None: return time.monotonic() - self.loaded >= MOUNTS_POLL_FALLBACK
+        try: return bool(self.poller.poll(0))
+        except OSError: return True
+
+    def _read(self) -> str:
+        if self.fd is None:
+            with open(self.path) as f: return f.read()
+        # 重新读取会清除 POLLPRI 事件
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        chunks = []
+        while data := os.read(self.fd, 65536): chunks.append(data)
+        return b"".join(chunks).decode(errors="replace")
+
+    def get(self) -> frozenset:
+        with self.lock:
+            if self._changed():
+                mounts = set()
+                try:
+                    for line in self._read().splitlines():
+                        parts = line.split()
+                        if len(parts) < 2: continue
+                        # /proc/mounts 中空格、制表符、反斜杠以八进制转义 (\040)
+                        point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), parts[1])
+                        if point not in HIDDEN_MOUNTS and not point.startswith(('/proc/', '/sys/', '/dev/')): mounts.add(point)
+                except OSError: pass
+                self.mounts, self.loaded = frozenset(mounts), time.monotonic()
+            return self.mounts
+
+
+class Listing:
+    """一个目录的缓存列表，按 (非挂载点, 非目录, 小写名称, 名称) 排序"""
+
+    def __init__(self, path: str, mtime_ns: int, entries: list):
+        self.path, self.mtime_ns, self.created = path, mtime_ns, time.monotonic()
+        self.entries = entries                     # [(排序键, {name, path, is_dir, is_mount})]
+        self.keys = [e[0] for e in entries]
+        self.sizes = {}                            # name -> size，按需填充
+        self.lock = threading.Lock()
+
+
+mount_table = MountTable()
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _sort_key(name: str, is_dir: bool, is_mount: bool) -> tuple:
+    return (not is_mount, not is_dir, name.lower(), name)
+
+def _scan(path: str, mtime_ns: int) -> Listing:
+    mounts, entries = mount_table.get(), []
+    with os.scandir(path) as it:
+        for entry in it:
+            try: is_dir = entry.is_dir()
+            except OSError: continue
+            is_mount = is_dir and entry.path in mounts
+            item = {"name": entry.name, "path": entry.path, "is_dir": is_dir, "is_mount": is_mount}
+            entries.append((_sort_key(entry.name, is_dir, is_mount), item))
+    entries.sort(key=lambda e: e[0])
+    return Listing(path, mtime_ns, entries)
+
+def get_listing(path: str, refresh: bool = False) -> Listing:
+    mtime_ns = os.stat(path).st_mtime_ns
+    with _cache_lock:
+        listing = _cache.get(path)
+        if listing and not refresh and listing.mtime_ns == mtime_ns and time.monotonic() - listing.created < CACHE_TTL:
+            _cache.move_to_end(path)
+            return listing
+    listing = _scan(path, mtime_ns)
+    with _cache_lock:
+        _cache[path] = listing
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_DIRS: _cache.popitem(last=False)
+    return listing
+
+def invalidate(path: str = None):
+    with _cache_lock:
+        if path is None: _cache.clear()
+        else: _cache.pop(path, None)
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """游标须与 _sort_key 的形状一致 (bool, bool, str, str)，否则在 bisect 比较时才出错"""
+    try: key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError): raise ValueError("无效的分页游标")
+    if not isinstance(key, list) or len(key) != 4 or not all(isinstance(v, t) for v, t in zip(key, (bool, bool, str, str))):
+        raise ValueError("无效的分页游标")
+    return tuple(key)
+
+def stat_sizes(listing: Listing, names: list) -> dict:
+    """返回文件大小 (目录为 None)，结果缓存在列表中"""
+    by_name = {item["name"]: item for _, item in listing.entries}
+    result = {}
+    for name in names:
+        item = by_name.get(name)
+        if item is None or item["is_dir"]: continue
+        with listing.lock: cached = listing.sizes.get(name, -1)
+        if cached == -1:
+            try: cached = os.stat(item["path"]).st_size
+            except OSError: cached = None
+            with listing.lock: listing.sizes[name] = cached
+        result[name] = cached
+    return result
+
+def browse(path: str, cursor: str = None, limit: int = PAGE_SIZE, query: str = None, refresh: bool = False) -> dict:
+    listing = get_listing(path, refresh)
+    entries, keys = listing.entries, listing.keys
+    if query:
+        q = query.lower()
+        entries = [e for e in entries if q in e[0][2]]
+        keys = [e[0] for e in entries]
+    start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+    page = entries[start:start + limit]
+    deferred = len(listing.entries) > DEFER_STAT_THRESHOLD
+    sizes = {} if deferred else stat_sizes(listing, [item["name"] for _, item in page if not item["is_dir"]])
+    items = [{**item, "size": sizes.get(item["name"]) if not deferred else listing.sizes.get(item["name"])} for _, item in page]
+    more = start + limit < len(entries)
+    return {
+        "path": path,
+        "parent": os.path.dirname(path) if path != "/" else None,
+        "items": items,
+        "total": len(entries),
+        "next_cursor": encode_cursor(page[-1][0]) if more and page else None,
+        "sizes_deferred": deferred,
+    }
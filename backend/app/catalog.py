@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+
+from .file_index import INDEX_DIR
+
+# 备份文件目录 (每个项目一个 SQLite 文件 catalog_<id>.db)
+# 每次成功备份写入一份清单 (路径、大小、修改时间、可选哈希)，按历史记录 id 区分版本。
+# 路径只存一次 (paths 字典表)，各版本的条目只引用 path_id，30 个版本也只占一份路径文本。
+# 浏览目录、跨版本搜索、版本对比均直接查询索引，不需要打开归档。
+DIFF_LIMIT = 5000
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def catalog_path(project_id: int) -> str:
+    return os.path.join(INDEX_DIR, f"catalog_{project_id}.db")
+
+def _lock_for(project_id: int) -> threading.Lock:
+    with _locks_guard: return _locks.setdefault(project_id, threading.Lock())
+
+
+class Catalog:
+    def __init__(self, project_id: int):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        self.project_id = project_id
+        self.conn = sqlite3.connect(catalog_path(project_id), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS versions (history_id INTEGER PRIMARY KEY, start_time TEXT, file_count INTEGER, total_size INTEGER);
+            CREATE TABLE IF NOT EXISTS entries (
+                history_id INTEGER NOT NULL, path_id INTEGER NOT NULL, size INTEGER, mtime INTEGER, hash TEXT,
+                PRIMARY KEY (history_id, path_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_entries_path ON entries (path_id, history_id);
+        """)
+        self.conn.commit()
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- 写入 ---
+    def add_version(self, history_id: int, start_time, entries):
+        """entries: [(path, size, mtime, hash)]，mtime 为秒"""
+        entries = list(entries)
+        with _lock_for(self.project_id):
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM entries WHERE history_id = ?", (history_id,))
+            cur.executemany("INSERT OR IGNORE INTO paths (path) VALUES (?)", ((e[0],) for e in entries))
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS incoming (path TEXT, size INTEGER, mtime INTEGER, hash TEXT)")
+            cur.execute("DELETE FROM incoming")
+            cur.executemany("INSERT INTO incoming VALUES (?, ?, ?, ?)", entries)
+            cur.execute("""INSERT OR REPLACE INTO entries (history_id, path_id, size, mtime, hash)
+                           SELECT ?, p.id, i.size, i.mtime, i.hash FROM incoming i JOIN paths p ON p.path = i.path""", (history_id,))
+            cur.execute("DELETE FROM incoming")
+            cur.execute("INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)",
+                        (history_id, str(start_time) if start_time else None, len(entries), sum(e[1] or 0 for e in entries)))
+            self.conn.commit()
+
+    def delete_versions(self, history_ids):
+        ids = [(i,) for i in history_ids]
+        if not ids: return
+        with _lock_for(self.project_id):
+            self.conn.executemany("DELETE FROM entries WHERE history_id = ?", ids)
+            self.conn.executemany("DELETE FROM versions WHERE history_id = ?", ids)
+            # 清理不再被任何版本引用的路径
+            self.conn.execute("DELETE FROM paths WHERE NOT EXISTS (SELECT 1 FROM entries e WHERE e.path_id = paths.id)")
+            self.conn.commit()
+
+    # --- 查询 ---
+    def versions(self) -> list:
+        rows = self.conn.execute("SELECT history_id, start_time, file_count, total_size FROM versions ORDER BY history_id DESC")
+        return [{"history_id": r[0], "start_time": r[1], "file_count": r[2], "total_size": r[3]} for r in rows]
+
+    def has_version(self, history_id: int) -> bool:
+        return self.conn.execute("SELECT 1 FROM versions WHERE history_id = ?", (history_id,)).fetchone() is not None
+
+    def tree(self, history_id: int, directory: str = "") -> list:
+        """列出某版本中 directory 的直接子项，子目录汇总文件数与大小"""
+        directory = directory.strip("/")
+        prefix = directory + "/" if directory else ""
+        # 前缀范围查询可使用 paths.path 上的唯一索引 ('/' 的下一个字符是 '0')
+        if prefix:
+            rows = self.conn.execute("""SELECT p.path, e.size, e.mtime FROM paths p JOIN entries e ON e.path_id = p.id AND e.history_id = ?
+                                        WHERE p.path >= ? AND p.path < ?""", (history_id, prefix, prefix[:-1] + "0"))
+        else:
+            rows = self.conn.execute("SELECT p.path, e.size, e.mtime FROM entries e JOIN paths p ON p.id = e.path_id WHERE e.history_id = ?", (history_id,))
+        children = {}
+        for path, size, mtime in rows:
+            name, sep, _ = path[len(prefix):].partition("/")
+            node = children.get(name)
+            if node is None:
+                node = children[name] = {"name": name, "path": prefix + name, "is_dir": bool(sep), "size": 0, "mtime": mtime, "file_count": 0}
+            node["size"] += size or 0
+            node["file_count"] += 1
+            if mtime and (node["mtime"] or 0) < mtime: node["mtime"] = mtime
+        return sorted(children.values(), key=lambda n: (not n["is_dir"], n["name"]))
+
+    def search(self, query: str, limit: int = 100) -> list:
+        """按路径搜索 (子串匹配，不区分大小写)，返回每个路径在各版本中的大小与修改时间"""
+        rows = self.conn.execute("SELECT id, path FROM paths WHERE path LIKE ? ESCAPE '\\' ORDER BY path LIMIT ?",
+                                 ("%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%", limit)).fetchall()
+        return self._with_versions(rows)
+
+    def lookup(self, path: str) -> list:
+        return self._with_versions(self.conn.execute("SELECT id, path FROM paths WHERE path = ?", (path.strip("/"),)).fetchall())
+
+    def _with_versions(self, rows) -> list:
+        result = []
+        for path_id, path in rows:
+            found = self.conn.execute("""SELECT e.history_id, v.start_time, e.size, e.mtime, e.hash FROM entries e
+                                         JOIN versions v ON v.history_id = e.history_id
+                                         WHERE e.path_id = ? ORDER BY e.history_id DESC""", (path_id,))
+            result.append({"path": path, "versions": [{"history_id": r[0], "start_time": r[1], "size": r[2], "mtime": r[3], "hash": r[4]} for r in found]})
+        return result
+
+    def diff(self, old_id: int, new_id: int, limit: int = DIFF_LIMIT) -> dict:
+        """对比两个版本: 新增、删除、修改 (大小、修改时间或哈希不同)"""
+        added = self.conn.execute("""SELECT p.path, n.size FROM entries n JOIN paths p ON p.id = n.path_id
+                                     WHERE n.history_id = ? AND NOT EXISTS (SELECT 1 FROM entries o WHERE o.history_id = ? AND o.path_id = n.path_id)
+                                     ORDER BY p.path LIMIT ?""", (new_id, old_id, limit)).fetchall()
+        removed = self.conn.execute("""SELECT p.path, o.size FROM entries o JOIN paths p ON p.id = o.path_id
+                                       WHERE o.history_id = ? AND NOT EXISTS (SELECT 1 FROM entries n WHERE n.history_id = ? AND n.path_id = o.path_id)
+                                       ORDER BY p.path LIMIT ?""", (old_id, new_id, limit)).fetchall()
+        modified = self.conn.execute("""SELECT p.path, o.size, n.size FROM entries o JOIN entries n ON n.path_id = o.path_id AND n.history_id = ?
+                                        JOIN paths p ON p.id = o.path_id
+                                        WHERE o.history_id = ? AND (o.size IS NOT n.size OR o.mtime IS NOT n.mtime OR o.hash IS NOT n.hash)
+                                        ORDER BY p.path LIMIT ?""", (new_id, old_id, limit)).fetchall()
+        return {
+            "added": [{"path": r[0], "size": r[1]} for r in added],
+            "removed": [{"path": r[0], "size": r[1]} for r in removed],
+            "modified": [{"path": r[0], "old_size": r[1], "new_size": r[2]} for r in modified],
+        }
+
+
+def record_version(project_id: int, history_id: int, start_time, entries):
+    with Catalog(project_id) as c: c.add_version(history_id, start_time, entries)
+
+def delete_versions(project_id: int, history_ids):
+    if not os.path.exists(catalog_path(project_id)): return
+    with Catalog(project_id) as c: c.delete_versions(history_ids)
+
+def remove_catalog(project_id: int):
+    for suffix in ("", "-wal", "-shm"):
+        try: os.remove(catalog_path(project_id) + suffix)
+        except OSError: pass
+
+def stat_entries(source_path: str, include_list: list):
+    """没有现成元数据时 (7z) 逐个 stat 生成清单条目"""
+    for rp in include_list:
+        try: st = os.lstat(os.path.join(source_path, rp))
+        except OSError: continue
+        yield (rp, st.st_size, int(st.st_mtime), None)
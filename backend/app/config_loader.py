@@ -1,67 +1,135 @@
 import json
 import os
+import threading
 
 SETTINGS_FILE = os.getenv("SETTINGS_FILE", "/data/settings.json")
 
+# 设置服务: 首次使用时读取 settings.json，之后从内存返回。
+# 每次读取只 stat 一次文件，修改时间、inode 或大小变化 (外部编辑、其他进程写入) 时重新加载。
+# 写入串行化，先写临时文件再 rename，读取方不会看到写了一半的文件。
+# subscribe() 注册的回调在设置项变化时收到 {键: 新值} (包括外部修改)，用于刷新缓存的配置。
+DEFAULT_RULES = [
+    "__pycache__", "*.pyc", ".git", "node_modules", "target",
+    ".vscode", ".idea", "dist", "build", "*.log", ".DS_Store"
+]
+
+
+def _with_defaults(data: dict) -> dict:
+    data = dict(data)
+    if "recommended_patterns" not in data:
+        data["recommended_patterns"] = json.dumps(DEFAULT_RULES)
+    else:
+        # 合并新增的默认规则 (只在内存中合并，下次保存时写入文件)
+        try:
+            current = json.loads(data["recommended_patterns"])
+            if isinstance(current, list) and any(rule not in current for rule in DEFAULT_RULES):
+                data["recommended_patterns"] = json.dumps(current + [rule for rule in DEFAULT_RULES if rule not in current])
+        except: pass
+    return data
+
+
+class SettingsStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.data, self.signature = None, None
+        self.subscribers = []
+
+    def _stat(self):
+        try: st = os.stat(self.path)
+        except OSError: return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path): return _with_defaults({})
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: return _with_defaults(json.load(f))
+        except Exception as e:
+            print(f"Error loading settings from {self.path}: {e}")
+            # 文件损坏时保留上一次成功读取的内容
+            return self.data if self.data is not None else _with_defaults({})
+
+    def _current(self) -> dict:
+        """返回内存中的设置，文件有变化时重新加载; 需持有锁"""
+        signature = self._stat()
+        if self.data is None or signature != self.signature:
+            old, self.data, self.signature = self.data, self._load(), signature
+            if old is not None: return self.data, _changes(old, self.data)
+        return self.data, {}
+
+    def snapshot(self) -> dict:
+        with self.lock: data, changed = self._current()
+        self._notify(changed)
+        return dict(data)
+
+    def get(self, key: str, default=None):
+        with self.lock: data, changed = self._current()
+        self._notify(changed)
+        return data.get(key, default)
+
+    def update(self, values: dict, replace: bool = False):
+        """写入设置项 (replace=True 时以 values 替换全部设置)"""
+        with self.lock:
+            data, changed = self._current()
+            new = _with_defaults(values) if replace else {**data, **values}
+            self._write(new)
+            changed.update(_changes(data, new))
+            self.data, self.signature = new, self._stat()
+        self._notify(changed)
+
+    def _write(self, data: dict):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except Exception:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+
+    def subscribe(self, callback, keys=None):
+        """callback({键: 新值})，keys 为 None 时接收全部变化"""
+        with self.lock: self.subscribers.append((callback, set(keys) if keys else None))
+
+    def _notify(self, changed: dict):
+        if not changed: return
+        with self.lock: subscribers = list(self.subscribers)
+        for callback, keys in subscribers:
+            relevant = {k: v for k, v in changed.items() if keys is None or k in keys}
+            if not relevant: continue
+            try: callback(relevant)
+            except Exception as e: print(f"Settings subscriber error: {e}")
+
+
+def _changes(old: dict, new: dict) -> dict:
+    return {k: new.get(k) for k in set(old) | set(new) if old.get(k) != new.get(k)}
+
+
+store = SettingsStore(SETTINGS_FILE)
+
 def load_settings():
-    default_rules = [
-        "__pycache__", "*.pyc", ".git", "node_modules", "target", 
-        ".vscode", ".idea", "dist", "build", "*.log", ".DS_Store"
-    ]
-    defaults = {
-        "recommended_patterns": json.dumps(default_rules)
-    }
-    
-    if not os.path.exists(SETTINGS_FILE):
-        return defaults
-        
-    try:
-        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-            # --- Auto-Merge Missing Defaults ---
-            # 1. Ensure recommended_patterns key exists
-            if "recommended_patterns" not in data:
-                data["recommended_patterns"] = defaults["recommended_patterns"]
-            else:
-                # 2. Merge missing individual patterns into existing list
-                try:
-                    current_list = json.loads(data["recommended_patterns"])
-                    if isinstance(current_list, list):
-                        updated = False
-                        for rule in default_rules:
-                            if rule not in current_list:
-                                current_list.append(rule)
-                                updated = True
-                        if updated:
-                            data["recommended_patterns"] = json.dumps(current_list)
-                            # Save back immediately to persist merged defaults
-                            save_settings(data)
-                except:
-                    pass # Fallback if JSON is malformed
-            
-            # Ensure other top-level defaults exist
-            for k, v in defaults.items():
-                if k not in data:
-                    data[k] = v
-            return data
-    except Exception as e:
-        print(f"Error loading settings from {SETTINGS_FILE}: {e}")
-        return defaults
+    return store.snapshot()
 
 def save_settings(settings_data):
     try:
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(settings_data, f, indent=2, ensure_ascii=False)
+        store.update(settings_data, replace=True)
         print(f"Settings saved to {SETTINGS_FILE}")
     except Exception as e:
         print(f"Error saving settings to {SETTINGS_FILE}: {e}")
 
+def set_setting_value(key: str, value):
+    store.update({key: value})
+
 def get_setting_value(key: str, default=None):
     """
     Helper to get a single setting value directly.
     """
-    data = load_settings()
-    return data.get(key, default)
+    return store.get(key, default)
+
+def subscribe(callback, keys=None):
+    store.subscribe(callback, keys)
@@ -0,0 +1,297 @@
+import io
+import os
+import struct
+import secrets
+import functools
+import concurrent.futures
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives import hashes
+from cryptography.exceptions import InvalidTag
+
+# .enc 加密格式
+# v2 (分块): header | chunk 0 | chunk 1 | ... | 末块
+#   header = MAGIC(5) | 版本(1) | 块大小(4) | salt(16) | nonce 前缀(8)
+#   每块独立 AES-GCM: nonce = 前缀 | 块序号(4)，AAD = header | 块序号(8) | 末块标志(1)，块 = 密文 | tag(16)
+#   除末块外每块明文长度均为块大小; 末块必然存在 (可为空)，截断、重排、拼接都会导致校验失败。
+#   各块可并行加解密，可从任意块开始解密，损坏在读到该块时即被发现。
+# v1 (旧格式，只读): salt(16) | iv(12) | 整个文件一个 GCM 流 | tag(16)
+MAGIC = b"SBENC"
+VERSION = 2
+CHUNK_SIZE = 1024 * 1024
+HEADER_SIZE = len(MAGIC) + 1 + 4 + 16 + 8
+TAG_SIZE = 16
+V1_HEADER = 28
+CRYPTO_THREADS = int(os.getenv("CRYPTO_THREADS", str(min(4, os.cpu_count() or 1))))
+
+
+@functools.lru_cache(maxsize=32)
+def derive_key(password: str, salt: bytes) -> bytes:
+    """PBKDF2 派生密钥; 同一任务内相同 (密码, salt) 只计算一次"""
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=100000, backend=default_backend())
+    return kdf.derive(password.encode())
+
+def new_salt() -> bytes:
+    return secrets.token_bytes(16)
+
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index & 0xFFFFFFFF)
+
+def _aad(header: bytes, index: int, final: bool) -> bytes:
+    return header + struct.pack(">QB", index, 1 if final else 0)
+
+def _parse_header(header: bytes):
+    """返回 (块大小, salt, nonce 前缀)"""
+    if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC: raise Exception("加密文件格式错误")
+    if header[len(MAGIC)] != VERSION: raise Exception(f"不支持的加密格式版本: {header[len(MAGIC)]}")
+    chunk_size = struct.unpack(">I", header[6:10])[0]
+    return chunk_size, header[10:26], header[26:34]
+
+def _read_exact(fileobj, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        data = fileobj.read(n - len(buf))
+        if not data: break
+        buf += data
+    return bytes(buf)
+
+
+class _Pool:
+    """按提交顺序产出结果的有界线程池; 单线程时直接在调用线程执行"""
+
+    def __init__(self, threads: int):
+        self.threads = max(1, threads)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+        self.pending = []
+
+    def submit(self, fn, *args):
+        if self.pool: self.pending.append(self.pool.submit(fn, *args))
+        else: self.pending.append(fn(*args))
+
+    def full(self) -> bool:
+        return len(self.pending) >= self.threads * 2
+
+    def pop(self):
+        item = self.pending.pop(0)
+        return item.result() if self.pool else item
+
+    def shutdown(self):
+        if self.pool: self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class EncryptingWriter(io.RawIOBase):
+    """流式分块加密写入 (v2 格式)，块在线程池中并行加密、按顺序写出"""
+
+    def __init__(self, fileobj, password: str, check_stop=None, salt: bytes = None, threads: int = CRYPTO_THREADS, chunk_size: int = CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.check_stop = check_stop
+        self.chunk_size = chunk_size
+        salt = salt or new_salt()
+        self.header = MAGIC + bytes([VERSION]) + struct.pack(">I", chunk_size) + salt + secrets.token_bytes(8)
+        self.aead = AESGCM(derive_key(password, salt))
+        self.prefix = self.header[26:34]
+        self.index = 0
+        self.buf = bytearray()
+        self.pool = _Pool(threads)
+        self.fileobj.write(self.header)
+
+    def writable(self):
+        return True
+
+    def _encrypt(self, index: int, data: bytes, final: bool) -> bytes:
+        return self.aead.encrypt(_nonce(self.prefix, index), data, _aad(self.header, index, final))
+
+    def _submit(self, data: bytes, final: bool):
+        self.pool.submit(self._encrypt, self.index, data, final)
+        self.index += 1
+        while self.pool.full() or (final and self.pool.pending): self.fileobj.write(self.pool.pop())
+
+    def write(self, data) -> int:
+        if self.check_stop: self.check_stop()
+        view, pos = memoryview(data).cast("B"), 0
+        # 保留至少一个字节不加密: 末块必须在 close 时带末块标志写出
+        while len(self.buf) + len(view) - pos > self.chunk_size:
+            take = self.chunk_size - len(self.buf)
+            self._submit(bytes(self.buf) + bytes(view[pos:pos + take]) if self.buf else bytes(view[pos:pos + take]), False)
+            self.buf, pos = bytearray(), pos + take
+        self.buf += view[pos:]
+        return len(view)
+
+    def close(self):
+        if self.closed: return
+        try:
+            self._submit(bytes(self.buf), True)
+            self.buf = bytearray()
+            self.fileobj.flush()
+        finally:
+            self.pool.shutdown()
+            super().close()
+
+
+class DecryptingReader(io.RawIOBase):
+    """流式解密，自动识别 v2 分块格式与 v1 旧格式; 校验失败抛出异常"""
+
+    def __init__(self, fileobj, password: str, check_stop=None, threads: int = CRYPTO_THREADS):
+        self.fileobj = fileobj
+        self.check_stop = check_stop
+        self.out, self.offset, self.eof = b"", 0, False
+        head = _read_exact(fileobj, len(MAGIC) + 1)
+        if head[:len(MAGIC)] == MAGIC:
+            self.header = head + _read_exact(fileobj, HEADER_SIZE - len(head))
+            self.chunk_size, salt, self.prefix = _parse_header(self.header)
+            self.aead = AESGCM(derive_key(password, salt))
+            self.pool = _Pool(threads)
+            self.index = 0
+            self.next_raw = _read_exact(fileobj, self.chunk_size + TAG_SIZE)
+            self.legacy = None
+        else:
+            header = head + _read_exact(fileobj, V1_HEADER - len(head))
+            if len(header) < V1_HEADER: raise Exception("加密文件格式错误")
+            self.legacy = Cipher(algorithms.AES(derive_key(password, header[:16])), modes.GCM(header[16:]), backend=default_backend()).decryptor()
+            self.tail = b""
+
+    def readable(self):
+        return True
+
+    def _decrypt(self, index: int, raw: bytes, final: bool) -> bytes:
+        try: return self.aead.decrypt(_nonce(self.prefix, index), raw, _aad(self.header, index, final))
+        except InvalidTag: raise Exception(f"解密校验失败: 密码错误或文件已损坏 (数据块 {index})")
+
+    def _fill_v2(self):
+        # 预读一块以判断当前块是否为末块，并保持线程池中有足够的待解密块
+        while not self.eof and not self.pool.full() and self.next_raw is not None:
+            raw = self.next_raw
+            if len(raw) < TAG_SIZE: raise Exception("加密文件不完整")
+            self.next_raw = _read_exact(self.fileobj, self.chunk_size + TAG_SIZE) if len(raw) == self.chunk_size + TAG_SIZE else b""
+            final = not self.next_raw
+            self.pool.submit(self._decrypt, self.index, raw, final)
+            self.index += 1
+            if final: self.next_raw = None
+        if self.pool.pending: self.out, self.offset = self.pool.pop(), 0
+        elif self.next_raw is None: self.eof = True
+
+    def _fill_v1(self):
+        chunk = self.fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            if len(self.tail) < TAG_SIZE: raise Exception("加密文件不完整")
+            try: self.out, self.offset = self.legacy.finalize_with_tag(self.tail), 0
+            except InvalidTag: raise Exception("解密校验失败: 密码错误或文件已损坏")
+            return
+        data = self.tail + chunk
+        self.tail, self.out, self.offset = data[-TAG_SIZE:], self.legacy.update(data[:-TAG_SIZE]), 0
+
+    def readinto(self, b) -> int:
+        while self.offset >= len(self.out) and not self.eof:
+            if self.check_stop: self.check_stop()
+            if self.legacy: self._fill_v1()
+            else: self._fill_v2()
+        n = min(len(b), len(self.out) - self.offset)
+        b[:n] = memoryview(self.out)[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+    def close(self):
+        if not self.legacy and hasattr(self, "pool"): self.pool.shutdown()
+        super().close()
+
+
+class ChunkedSeekReader(io.RawIOBase):
+    """v2 格式的随机读取视图: 定位到所在块，整块解密校验后返回"""
+
+    def __init__(self, fileobj, password: str, header: bytes):
+        self.fileobj = fileobj
+        self.header = header
+        self.chunk_size, salt, self.prefix = _parse_header(header)
+        self.aead = AESGCM(derive_key(password, salt))
+        size = fileobj.seek(0, io.SEEK_END) - HEADER_SIZE
+        stride = self.chunk_size + TAG_SIZE
+        self.chunks = max(1, -(-size // stride))
+        self.length = size - self.chunks * TAG_SIZE
+        if self.length < 0: raise Exception("加密文件不完整")
+        self.pos, self.cached_index, self.cached = 0, -1, b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.pos = offset if whence == io.SEEK_SET else (self.pos + offset if whence == io.SEEK_CUR else self.length + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def _chunk(self, index: int) -> bytes:
+        if index != self.cached_index:
+            self.fileobj.seek(HEADER_SIZE + index * (self.chunk_size + TAG_SIZE))
+            raw = _read_exact(self.fileobj, self.chunk_size + TAG_SIZE)
+            try: self.cached = self.aead.decrypt(_nonce(self.prefix, index), raw, _aad(self.header, index, index == self.chunks - 1))
+            except InvalidTag: raise Exception(f"解密校验失败: 密码错误或文件已损坏 (数据块 {index})")
+            self.cached_index = index
+        return self.cached
+
+    def readinto(self, b) -> int:
+        if self.pos >= self.length: return 0
+        index, offset = divmod(self.pos, self.chunk_size)
+        data = self._chunk(index)[offset:offset + len(b)]
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+
+class CtrReader(io.RawIOBase):
+    """v1 格式的随机读取视图: GCM 的密钥流即 AES-CTR (计数器从 iv || 2 开始)，部分读取无法校验 tag"""
+
+    def __init__(self, fileobj, password: str, header: bytes):
+        self.fileobj = fileobj
+        if len(header) < V1_HEADER: raise Exception("加密文件格式错误")
+        self.key, self.iv = derive_key(password, header[:16]), header[16:V1_HEADER]
+        self.length = fileobj.seek(0, io.SEEK_END) - V1_HEADER - TAG_SIZE
+        self.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.pos = offset if whence == io.SEEK_SET else (self.pos + offset if whence == io.SEEK_CUR else self.length + offset)
+        counter = 2 + self.pos // 16
+        self.decryptor = Cipher(algorithms.AES(self.key), modes.CTR(self.iv + counter.to_bytes(4, "big")), backend=default_backend()).decryptor()
+        self.decryptor.update(bytes(self.pos % 16))
+        self.fileobj.seek(V1_HEADER + self.pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.length - self.pos)
+        if n <= 0: return 0
+        data = self.fileobj.read(n)
+        b[:len(data)] = self.decryptor.update(data)
+        self.pos += len(data)
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+
+def open_seekable(fileobj, password: str):
+    """按格式返回可随机读取的解密视图"""
+    fileobj.seek(0)
+    header = _read_exact(fileobj, max(HEADER_SIZE, V1_HEADER))
+    if header[:len(MAGIC)] == MAGIC: return ChunkedSeekReader(fileobj, password, header[:HEADER_SIZE])
+    return CtrReader(fileobj, password, header[:V1_HEADER])
@@ -1,15 +1,39 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # Use environment variable for Docker compatibility, default to local file for dev
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./backup_system.db")
 
+# SQLite 并发设置:
+#   - WAL: 读不阻塞写、写不阻塞读，API 查询不会排在任务写入之后
+#   - busy_timeout: 写锁被占用时等待而不是立即报 "database is locked"
+#   - 连接池: 每个运行中的任务与 API 请求各自持有连接，池大小需覆盖并发任务数
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+
+is_sqlite = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+in_memory = is_sqlite and (SQLALCHEMY_DATABASE_URL in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in SQLALCHEMY_DATABASE_URL)
+
 # connect_args={"check_same_thread": False} is needed for SQLite
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT} if is_sqlite else {},
+    **({} if in_memory else {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": 60}),
 )
+
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        if not in_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")  # WAL 下断电只会丢失最近的提交，不会损坏数据库
+        cursor.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
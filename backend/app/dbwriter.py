@@ -0,0 +1,109 @@
+import time
+import threading
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+
+from .database import engine
+from .models import BackupHistory
+from .events import bus, history_state, STATE_FIELDS
+
+# 任务进度的批量写入: 各任务线程只把进度/日志摘要交给这里 (同一记录只保留最新值)，
+# 由单个写线程每 WRITE_INTERVAL 秒在一个事务中写入，写入后推送状态事件。
+# 创建记录与最终状态仍由任务自己的 Session 提交; 提交前调用 finish(): 写完该记录排队中的进度并关闭该记录，
+# 之后到达的更新全部丢弃，最终状态提交后不会再有批量写入或 running 状态事件; 提交后调用 release() 释放该记录。
+# 写入失败 (数据库繁忙超时) 时重试 WRITE_ATTEMPTS 次，仍失败则丢弃该批 (进度只是中间状态)。
+WRITE_INTERVAL = 0.5
+WRITE_ATTEMPTS = 3
+
+
+class HistoryWriter:
+    def __init__(self, interval: float = WRITE_INTERVAL):
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()  # 同一时刻只有一个批次在写
+        self.pending = {}  # history_id -> [状态事件, 待写字段, 已失败次数]
+        self.closed = set()  # 已调用 finish()、尚未 release() 的记录
+        self.thread = None
+        self.stopping = False
+
+    def update(self, record: BackupHistory, **fields):
+        """record 为任务线程持有的历史记录，只在调用线程读取其状态字段"""
+        state = history_state(record)
+        state.update((k, v) for k, v in fields.items() if k in STATE_FIELDS)
+        with self.cond:
+            if record.id in self.closed: return
+            entry = self.pending.setdefault(record.id, [state, {}, 0])
+            entry[0] = state
+            entry[1].update(fields)
+            if not self.thread or not self.thread.is_alive():
+                self.stopping = False
+                self.thread = threading.Thread(target=self._loop, name="history-writer", daemon=True)
+                self.thread.start()
+
+    def finish(self, history_id: int):
+        """任务提交最终状态之前调用: 等待进行中的批次，同步写入该记录排队中的字段，并丢弃之后的更新"""
+        with self.flush_lock:
+            with self.cond:
+                self.closed.add(history_id)
+                entry = self.pending.pop(history_id, None)
+            if entry: self._write_now({history_id: entry})
+
+    def release(self, history_id: int):
+        """最终状态提交后调用，该记录不再需要丢弃迟到的更新 (任务的工作线程此时均已结束)"""
+        with self.cond: self.closed.discard(history_id)
+
+    def sync(self):
+        """同步写入全部排队中的字段 (停止服务时调用)"""
+        with self.flush_lock:
+            with self.cond: batch, self.pending = self.pending, {}
+            self._write_now(batch)
+
+    def shutdown(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.thread: self.thread.join(timeout=5)
+        self.sync()
+
+    def _commit(self, batch: dict):
+        with engine.begin() as conn:
+            for hid, (_, fields, _) in batch.items():
+                conn.execute(update(BackupHistory).where(BackupHistory.id == hid).values(**fields))
+        for state, _, _ in batch.values(): bus.publish_state(state)
+
+    def _write_now(self, batch: dict):
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            if not batch: return
+            try: return self._commit(batch)
+            except OperationalError as e:
+                if attempt == WRITE_ATTEMPTS: print(f"[WARN] 任务进度写入失败，已丢弃 {len(batch)} 条: {e}")
+                else: time.sleep(self.interval * attempt)
+
+    def _write(self, batch: dict):
+        """后台批次: 失败时放回队列 (新的更新优先)，由下个周期重试，超过次数后丢弃"""
+        if not batch: return
+        try: self._commit(batch)
+        except OperationalError as e:
+            with self.cond:
+                dropped = 0
+                for hid, (state, fields, failures) in batch.items():
+                    if hid in self.closed or failures + 1 >= WRITE_ATTEMPTS:
+                        dropped += 1
+                        continue
+                    entry = self.pending.setdefault(hid, [state, {}, 0])
+                    entry[1] = {**fields, **entry[1]}
+                    entry[2] = max(entry[2], failures + 1)
+            print(f"[WARN] 任务进度写入失败{f'，已丢弃 {dropped} 条' if dropped else '，稍后重试'}: {e}")
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                if self.stopping: return
+                self.cond.wait(timeout=self.interval)
+            with self.flush_lock:
+                with self.cond: batch, self.pending = self.pending, {}
+                self._write(batch)
+
+
+writer = HistoryWriter()
@@ -0,0 +1,242 @@
+import os
+import time
+import itertools
+import threading
+from datetime import datetime
+
+from .database import SessionLocal
+from .models import BackupProject
+from .config_loader import get_setting_value
+from .events import bus
+from . import throttle
+
+# 任务调度: 备份与还原不直接交给 APScheduler 线程池运行，而是进入调度队列，按资源占用决定何时开始:
+#   - 源设备: 源目录所在挂载点上同时运行的任务数
+#   - 目标挂载点: 多个项目同时写同一个云盘挂载会互相拖慢，默认逐个执行
+#   - CPU: 压缩/加密任务按压缩线程数占用核心
+# 队列顺序: 还原 > 手动备份 > 定时备份 > 清理旧版本; 同一优先级内按项目轮转，最近开始过任务的项目排在后面。
+# 被阻塞的高优先级任务会预留它需要的设备/挂载点，低优先级任务不能插队占用，避免饿死。
+PRIORITY_RESTORE, PRIORITY_MANUAL, PRIORITY_SCHEDULED, PRIORITY_PRUNE = 0, 1, 2, 3
+PRIORITY_LABELS = {PRIORITY_RESTORE: "还原", PRIORITY_MANUAL: "手动备份", PRIORITY_SCHEDULED: "定时备份", PRIORITY_PRUNE: "清理旧版本"}
+RESOURCE_LABELS = {"source": "源设备", "dest": "目标挂载点", "cpu": "CPU"}
+
+# 并发上限 (可在设置中修改，键名为 dispatch_<名称>)
+DEFAULT_LIMITS = {"max_jobs": 4, "source_limit": 1, "dest_limit": 1, "cpu_limit": os.cpu_count() or 2}
+
+_ids = itertools.count(1)
+
+
+def mount_point(path: str) -> str:
+    path = os.path.realpath(path or "/")
+    while not os.path.exists(path): path = os.path.dirname(path)
+    while not os.path.ismount(path): path = os.path.dirname(path)
+    return path
+
+def job_resources(project, kind: str) -> dict:
+    """任务占用的资源: {(类型, 名称): 数量}"""
+    # 清理旧版本只删除目标目录中的文件
+    if kind == "prune": return {("dest", mount_point(project.destination_path)): 1}
+    fmt = project.archive_format or "tgz"
+    cpu = 0
+    if kind == "backup":
+        if fmt in ("tgz", "7z"): cpu = project.compress_threads or 1
+        elif fmt == "dedup": cpu = 1
+        if project.encryption_password and fmt != "sync": cpu += 1
+    elif fmt != "sync" and (fmt != "tar" or project.encryption_password):
+        cpu = 1
+    resources = {("source", mount_point(project.source_path)): 1, ("dest", mount_point(project.destination_path)): 1}
+    if cpu: resources[("cpu", "")] = cpu
+    return resources
+
+def current_limits() -> dict:
+    limits = {}
+    for key, default in DEFAULT_LIMITS.items():
+        try: limits[key] = max(1, int(get_setting_value(f"dispatch_{key}", default)))
+        except (TypeError, ValueError): limits[key] = default
+    return limits
+
+
+class QueuedJob:
+    def __init__(self, kind: str, project_id: int, project_name: str, priority: int, func, args: list, kwargs: dict, resources: dict):
+        self.id = next(_ids)
+        self.kind = kind
+        self.project_id, self.project_name = project_id, project_name
+        self.priority = priority
+        self.func, self.args, self.kwargs = func, args, kwargs or {}
+        self.resources = resources
+        self.reason = "等待调度"
+        self.enqueued_at, self.started_at = datetime.now(), None
+
+    def demand(self, limits: dict) -> dict:
+        # 需要的核心数超过上限时按上限计
+        return {key: min(amount, limits["cpu_limit"]) if key[0] == "cpu" else amount for key, amount in self.resources.items()}
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "kind": self.kind, "project_id": self.project_id, "project_name": self.project_name,
+            "priority": PRIORITY_LABELS[self.priority], "reason": self.reason,
+            "resources": [{"type": RESOURCE_LABELS[t], "name": n, "amount": a} for (t, n), a in self.resources.items()],
+            "enqueued_at": self.enqueued_at.isoformat(), "started_at": self.started_at.isoformat() if self.started_at else None,
+            "throughput": throttle.job_stats(self.project_id) if self.started_at else None,
+        }
+
+
+class Dispatcher:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.running = {}    # job id -> QueuedJob
+        self.last_start = {} # project_id -> 最近开始时间，用于项目间轮转
+        self.published = {}  # project_id -> 已推送的排队情况
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        with self.cond:
+            if self.thread and self.thread.is_alive(): return
+            self.stopping = False
+            self.thread = threading.Thread(target=self._loop, name="dispatcher", daemon=True)
+            self.thread.start()
+
+    def shutdown(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+
+    def wake(self):
+        """并发上限等配置变化后重新调度"""
+        with self.cond: self.cond.notify_all()
+
+    def submit(self, job: QueuedJob) -> QueuedJob:
+        with self.cond:
+            # 定时备份触发时该项目已有备份在排队或运行，本次触发合并到已有任务; 清理任务同理
+            if job.priority in (PRIORITY_SCHEDULED, PRIORITY_PRUNE):
+                for other in self.queue + list(self.running.values()):
+                    if other.project_id == job.project_id and other.kind == job.kind: return other
+            self.queue.append(job)
+            self.cond.notify_all()
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        with self.cond:
+            found = [j for j in self.queue if j.id == job_id]
+            for j in found: self.queue.remove(j)
+            self.cond.notify_all()
+        return bool(found)
+
+    def cancel_project(self, project_id: int) -> int:
+        with self.cond:
+            found = [j for j in self.queue if j.project_id == project_id]
+            for j in found: self.queue.remove(j)
+            self.cond.notify_all()
+        return len(found)
+
+    def is_running(self, project_id: int) -> bool:
+        with self.cond: return any(j.project_id == project_id for j in self.running.values())
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return {
+                "limits": current_limits(),
+                "running": [j.to_dict() for j in sorted(self.running.values(), key=lambda j: j.started_at)],
+                "queued": [j.to_dict() for j in sorted(self.queue, key=self._order)],
+            }
+
+    def _order(self, job: QueuedJob):
+        return (job.priority, self.last_start.get(job.project_id, 0), job.id)
+
+    def _blocked_reason(self, job: QueuedJob, limits: dict, usage: dict, reserved: dict):
+        """返回 (原因, 是否预留资源); 可以开始时原因为 None"""
+        if any(j.project_id == job.project_id for j in self.running.values()): return "同一项目已有任务在运行", False
+        if len(self.running) >= limits["max_jobs"]: return f"已达到最大并发任务数 ({limits['max_jobs']})", False
+        for key, amount in job.demand(limits).items():
+            rtype, name = key
+            label, limit = RESOURCE_LABELS[rtype], limits[f"{rtype}_limit"]
+            used, held = usage.get(key, 0), reserved.get(key, (0, None))
+            if used + amount > limit:
+                if rtype == "cpu": return f"等待 CPU (已占用 {used}/{limit} 核，需要 {amount} 核)", True
+                return f"等待{label} {name} (运行中 {used}/{limit})", True
+            if used + held[0] + amount > limit: return f"等待{label} {name} (已预留给排在前面的任务: {held[1]})", True
+        return None, False
+
+    def _dispatch(self) -> list:
+        """在锁内选出可以开始的任务; 因资源不足等待的任务按顺序预留资源，排在后面的任务不能占用"""
+        limits = current_limits()
+        usage, reserved, started = {}, {}, []
+        for j in self.running.values():
+            for key, amount in j.demand(limits).items(): usage[key] = usage.get(key, 0) + amount
+        for job in sorted(self.queue, key=self._order):
+            job.reason, reserve = self._blocked_reason(job, limits, usage, reserved)
+            if job.reason:
+                if reserve:
+                    for key, amount in job.demand(limits).items():
+                        held = reserved.get(key, (0, job.project_name))
+                        reserved[key] = (held[0] + amount, held[1])
+                continue
+            self.queue.remove(job)
+            job.started_at = datetime.now()
+            self.running[job.id] = job
+            self.last_start[job.project_id] = time.monotonic()
+            for key, amount in job.demand(limits).items(): usage[key] = usage.get(key, 0) + amount
+            started.append(job)
+        return started
+
+    def _queue_changes(self) -> list:
+        current = {}
+        for job in sorted(self.queue, key=self._order):
+            current.setdefault(job.project_id, []).append({"id": job.id, "kind": job.kind, "priority": PRIORITY_LABELS[job.priority], "reason": job.reason})
+        changes = [(pid, entries) for pid, entries in current.items() if self.published.get(pid) != entries]
+        changes += [(pid, []) for pid in self.published if pid not in current]
+        self.published = current
+        return changes
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                if self.stopping: return
+                started = self._dispatch()
+                changes = self._queue_changes()
+            for pid, entries in changes: bus.publish_queue(pid, entries)
+            for job in started: threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True).start()
+            with self.cond:
+                if not self.stopping: self.cond.wait(timeout=30)
+
+    def _run(self, job: QueuedJob):
+        try:
+            job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind} project {job.project_id}) failed: {e}")
+        finally:
+            with self.cond:
+                self.running.pop(job.id, None)
+                self.cond.notify_all()
+
+
+dispatcher = Dispatcher()
+
+
+def _project_job(kind: str, project_id: int, priority: int, func, args: list, kwargs: dict = None):
+    db = SessionLocal()
+    try:
+        project = db.query(BackupProject).filter(BackupProject.id == project_id).first()
+        if not project: return None
+        job = QueuedJob(kind, project.id, project.name, priority, func, args, kwargs, job_resources(project, kind))
+    finally:
+        db.close()
+    return dispatcher.submit(job)
+
+def enqueue_backup(project_id: int, remark: str = None, scheduled: bool = False):
+    from .engine import run_backup_task
+    return _project_job("backup", project_id, PRIORITY_SCHEDULED if scheduled else PRIORITY_MANUAL, run_backup_task, [project_id, None, remark])
+
+def enqueue_restore(project_id: int, file_name: str, restore_mode: str, paths: list = None):
+    from .engine import run_restore_task
+    return _project_job("restore", project_id, PRIORITY_RESTORE, run_restore_task, [project_id, file_name, restore_mode], {"paths": paths} if paths else None)
+
+def enqueue_prune(project_id: int):
+    from .retention import run_prune_task
+    return _project_job("prune", project_id, PRIORITY_PRUNE, run_prune_task, [project_id])
+
+def run_scheduled_backup(project_id: int, db=None, remark: str = None):
+    """APScheduler 定时任务入口: 只负责排队，立即返回 (参数与 engine.run_backup_task 兼容)"""
+    enqueue_backup(project_id, remark, scheduled=True)
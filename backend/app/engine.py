@@ -3,169 +3,187 @@ import shutil
 import os
 import tarfile
 import hashlib
-import secrets
-import fnmatch
 import subprocess
 import io
+import json
+import contextlib
 import concurrent.futures
-import apprise
 from datetime import datetime
 from sqlalchemy.orm import Session
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
 
 from .models import BackupProject, BackupHistory
 from .database import SessionLocal
-from .config_loader import get_setting_value
+from . import dedup, upload, volumes, extract, archive_index, catalog, throttle, notify, mirror, watcher, snapshot, retention, dispatcher
+from .dbwriter import writer
+from .file_index import FileIndex, state_of
+from .parallel_gzip import ParallelGzipWriter
+from .matcher import ExcludeMatcher
+from .logstore import RunLog
+from .events import log_publisher
+from .crypto import EncryptingWriter, DecryptingReader, new_salt
 
 # 全局停止信号
 stop_signals = {}
 
-def check_stop(project_id: int, log_buffer: io.StringIO = None):
+def check_stop(project_id: int, log_buffer: io.TextIOBase = None):
     if stop_signals.get(project_id):
         msg = "!!! 任务被用户强制终止 !!!"
         if log_buffer: log_buffer.write(f"\n[ERROR] {msg}\n")
         raise Exception(msg)
 
-def derive_key(password: str, salt: bytes) -> bytes:
-    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=100000, backend=default_backend())
-    return kdf.derive(password.encode())
+def _stopper(project_id: int):
+    return (lambda: check_stop(project_id)) if project_id else None
 
-def encrypt_file(input_file: str, output_file: str, password: str, project_id: int = None):
-    salt = secrets.token_bytes(16)
-    key = derive_key(password, salt)
-    iv = secrets.token_bytes(12)
-    encryptor = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend()).encryptor()
+def encrypt_file(input_file: str, output_file: str, password: str, project_id: int = None, job_throttle=None, salt: bytes = None):
     with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
-        f_out.write(salt)
-        f_out.write(iv)
-        while chunk := f_in.read(1024 * 1024):
-            if project_id: check_stop(project_id)
-            f_out.write(encryptor.update(chunk))
-        f_out.write(encryptor.finalize())
-        f_out.write(encryptor.tag)
-
-def decrypt_file(input_file: str, output_file: str, password: str, project_id: int = None):
-    with open(input_file, 'rb') as f_in:
-        salt = f_in.read(16)
-        iv = f_in.read(12)
-        key = derive_key(password, salt)
-        f_in.seek(-16, os.SEEK_END)
-        tag = f_in.read(16)
-        f_in.seek(28, os.SEEK_SET)
-        decryptor = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend()).decryptor()
-        file_size = os.fstat(f_in.fileno()).st_size
-        data_len = file_size - 16 - 12 - 16
-        with open(output_file, 'wb') as f_out:
-            bytes_read = 0
-            while bytes_read < data_len:
-                if project_id: check_stop(project_id)
-                chunk = f_in.read(min(1024 * 1024, data_len - bytes_read))
-                if not chunk: break
-                f_out.write(decryptor.update(chunk))
-                bytes_read += len(chunk)
-            decryptor.finalize()
-
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(5), retry=retry_if_exception_type(IOError))
-def perform_safe_move(source_path: str, dest_path: str):
-    shutil.move(source_path, dest_path)
-
-def generate_manifest(source_path: str, patterns: list, log_buffer: io.StringIO):
-    """生成清单，带有格式化前缀"""
+        src, dst = (job_throttle.reader(f_in), job_throttle.writer(f_out)) if job_throttle else (f_in, f_out)
+        with EncryptingWriter(dst, password, _stopper(project_id), salt) as enc:
+            while chunk := src.read(1024 * 1024): enc.write(chunk)
+
+def decrypt_file(input_file: str, output_file: str, password: str, project_id: int = None, job_throttle=None):
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        src, dst = (job_throttle.reader(f_in), job_throttle.writer(f_out)) if job_throttle else (f_in, f_out)
+        shutil.copyfileobj(DecryptingReader(src, password, _stopper(project_id)), dst, 1024 * 1024)
+
+def _scan_dir(source_path: str, rel_root: str, matcher: ExcludeMatcher, log_buffer: io.TextIOBase):
+    """列出一层目录，返回 (文件名, 子目录名, 排除数); 目录无法读取时抛出 OSError"""
+    with os.scandir(os.path.join(source_path, rel_root) if rel_root else source_path) as it:
+        entries = list(it)
+    files, dirs, excluded = [], [], 0
+    for entry in entries:
+        name = entry.name
+        rel_path = f"{rel_root}/{name}" if rel_root else name
+        try: is_dir = entry.is_dir()
+        except OSError: is_dir = False
+        if is_dir:
+            # 与 os.walk 一致: 不进入指向目录的符号链接
+            if entry.is_symlink(): continue
+            if matcher.matches(name, rel_path):
+                log_buffer.write(f"[SKIP] 排除目录: {rel_path}\n")
+                excluded += 1
+            else:
+                dirs.append(name)
+        elif matcher.matches(name, rel_path):
+            log_buffer.write(f"[SKIP] 排除文件: {rel_path}\n")
+            excluded += 1
+        else:
+            files.append(name)
+            log_buffer.write(f"[ADD]  包含文件: {rel_path}\n")
+    return files, dirs, excluded
+
+def _walk(source_path: str, rel_root: str, matcher: ExcludeMatcher, log_buffer: io.TextIOBase, include_list: list, rows: list = None) -> int:
+    """基于 os.scandir 的深度优先遍历: 依赖 d_type 判断类型，不对每个条目 stat。
+    rows 不为 None 时同时记录 (上级目录, 名称, 是否目录)，返回排除数"""
+    stack, excluded = [rel_root], 0
+    while stack:
+        rel = stack.pop()
+        try: files, dirs, count = _scan_dir(source_path, rel, matcher, log_buffer)
+        except OSError: continue
+        excluded += count
+        include_list.extend(watcher.join(rel, name) for name in files)
+        if rows is not None:
+            rows.extend((rel, name, 0) for name in files)
+            rows.extend((rel, name, 1) for name in dirs)
+        stack.extend(watcher.join(rel, name) for name in reversed(dirs))
+    return excluded
+
+def _rescan_dirty(journal, source_path: str, matcher: ExcludeMatcher, dirty: list, log_buffer: io.TextIOBase):
+    """在上次的目录树上重新列出脏目录，新出现的子目录整体扫描; 返回 (重新扫描的目录数, 排除数)"""
+    covered, rescanned, excluded = set(), 0, 0
+    # 由浅到深处理，已整体扫描或删除的目录下的脏目录跳过
+    for rel in sorted(set(dirty), key=lambda p: (p.count("/") if p else -1, p)):
+        parent, skip = rel, False
+        while parent:
+            if parent in covered: skip = True
+            parent = os.path.dirname(parent)
+        # 不在目录树中 (已被排除，或随上级目录一起处理)
+        if skip or (rel and not journal.is_dir(rel)): continue
+        old = journal.children(rel)
+        try: files, dirs, count = _scan_dir(source_path, rel, matcher, log_buffer)
+        except OSError:
+            journal.remove_tree(rel)
+            if rel: journal.remove_entry(rel)
+            covered.add(rel)
+            continue
+        rescanned += 1
+        excluded += count
+        rows = [(rel, name, 0) for name in files] + [(rel, name, 1) for name in dirs]
+        current = set(dirs)
+        for name, is_dir in old.items():
+            if is_dir and name not in current:
+                journal.remove_tree(watcher.join(rel, name))
+                covered.add(watcher.join(rel, name))
+        for name in dirs:
+            if old.get(name) != 1:
+                sub = watcher.join(rel, name)
+                excluded += _walk(source_path, sub, matcher, log_buffer, [], rows)
+                covered.add(sub)
+        journal.replace_children(rel, rows)
+    return rescanned, excluded
+
+def generate_manifest(source_path: str, patterns: list, log_buffer: io.TextIOBase, project_id: int = None):
+    """生成清单，带有格式化前缀; 项目开启源目录监控时复用上次的目录树，只重新扫描有变化的目录"""
     include_list = []
-    exclude_count = 0
+    matcher = ExcludeMatcher(patterns)
     log_buffer.write(f"[INFO] 正在扫描源目录并应用过滤规则...\n")
-    for root, dirs, files in os.walk(source_path):
-        rel_root = os.path.relpath(root, source_path)
-        if rel_root == ".": rel_root = ""
-        
-        is_dir_excluded = False
-        if rel_root:
-            for p in patterns:
-                if fnmatch.fnmatch(rel_root, p) or any(fnmatch.fnmatch(part, p) for part in rel_root.split('/')):
-                    is_dir_excluded = True
-                    break
-        
-        if is_dir_excluded:
-            log_buffer.write(f"[SKIP] 排除目录: {rel_root}\n")
-            exclude_count += 1
-            dirs[:] = []
-            continue
-            
-        for name in files:
-            rel_path = os.path.join(rel_root, name) if rel_root else name
-            is_file_excluded = False
-            for p in patterns:
-                if fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p):
-                    is_file_excluded = True
-                    break
-            
-            if is_file_excluded:
-                log_buffer.write(f"[SKIP] 排除文件: {rel_path}\n")
-                exclude_count += 1
+    session = watcher.service.session(project_id) if project_id else None
+    # 监控线程可能还有尚未写入日志的变更 (轮询模式最长 POLL_INTERVAL 后才发现)，先让其立即检查并写入
+    if session and not watcher.service.flush(project_id):
+        log_buffer.write("[WARN] 源目录监控未确认写入最新变更，执行完整扫描...\n")
+        session = None
+    if not session:
+        exclude_count = _walk(source_path, "", matcher, log_buffer, include_list)
+        log_buffer.write(f"[INFO] 扫描完成: 包含 {len(include_list)} 个文件, 排除 {exclude_count} 个对象。\n\n")
+        return include_list
+
+    key = json.dumps([source_path, patterns])
+    journal = watcher.Journal(project_id)
+    try:
+        dirty = journal.begin(session, key)
+        with journal.conn:
+            if dirty is None:
+                log_buffer.write("[INFO] 变更日志不可用 (首次扫描、监控重启或事件溢出)，执行完整扫描...\n")
+                rows = []
+                exclude_count = _walk(source_path, "", matcher, log_buffer, include_list, rows)
+                journal.replace_all(rows)
             else:
-                include_list.append(rel_path)
-                log_buffer.write(f"[ADD]  包含文件: {rel_path}\n")
-                
+                rescanned, exclude_count = _rescan_dirty(journal, source_path, matcher, dirty, log_buffer)
+                include_list = journal.files()
+                log_buffer.write(f"[INFO] 变更日志: 复用上次的目录树，重新扫描 {rescanned} 个有变化的目录\n")
+        journal.finish(session, key)
+    finally:
+        journal.close()
     log_buffer.write(f"[INFO] 扫描完成: 包含 {len(include_list)} 个文件, 排除 {exclude_count} 个对象。\n\n")
     return include_list
 
-def send_notification(title: str, body: str, db: Session):
-    try:
-        proxy_val = get_setting_value("http_proxy")
-        token_val = get_setting_value("telegram_bot_token")
-        chat_id_val = get_setting_value("telegram_chat_id")
-        use_proxy_for_tg_val = get_setting_value("proxy_enabled_for_telegram")
-        
-        if not token_val or not chat_id_val: return
+# 同步任务的传输统计列 (BackupHistory)
+SYNC_TOTAL_FIELDS = ("bytes_copied", "bytes_skipped", "files_added", "files_updated", "files_renamed", "files_deleted", "files_skipped")
 
-        if proxy_val and use_proxy_for_tg_val == 'true':
-            os.environ['http_proxy'] = proxy_val
-            os.environ['https_proxy'] = proxy_val
-        else:
-            os.environ.pop('http_proxy', None)
-            os.environ.pop('https_proxy', None)
+def send_notification(title: str, body: str, db: Session = None):
+    """放入通知队列后立即返回，由后台线程发送 (见 notify.py)"""
+    notify.notify(title, body)
 
-        apobj = apprise.Apprise()
-        apobj.add(f"tgram://{token_val}/{chat_id_val}")
-        apobj.notify(title=title, body=body)
-    except Exception as e:
-        print(f"Notification Error: {e}")
-
-def apply_retention_policy(project, db: Session):
-    if not project.keep_versions or project.keep_versions <= 0: return
-    history = db.query(BackupHistory).filter(
-        BackupHistory.project_id == project.id,
-        BackupHistory.status == 'success'
-    ).order_by(BackupHistory.start_time.desc()).all()
-    
-    if len(history) <= project.keep_versions: return
-    to_delete = history[project.keep_versions:]
-    for record in to_delete:
-        if record.file_name:
-            file_path = os.path.join(project.destination_path, record.file_name)
-            if os.path.exists(file_path):
-                try:
-                    if os.path.isdir(file_path): shutil.rmtree(file_path)
-                    else: os.remove(file_path)
-                except: pass
-        db.delete(record)
-    db.commit()
+def schedule_prune(project, log_buffer: io.TextIOBase):
+    """按保留策略排入后台清理任务 (见 retention.py)，不在备份任务内删除旧版本"""
+    if not retention.enabled(project): return
+    dispatcher.enqueue_prune(project.id)
+    log_buffer.write(f"[INFO] 已排入后台清理旧版本 (保留: {retention.describe(project)})\n")
 
 def run_backup_task(project_id: int, db: Session = None, remark: str = None):
     local_db = db or SessionLocal()
     history_record, working_path, final_encrypted_path, list_file_path = None, None, None, None
+    keep_staged = False
+    volume_part_dir, volume_stage, uploader = None, None, None
+    job_throttle, sync_totals = None, None
     dest_type = "cloud" 
-    log_buffer = io.StringIO()
+    log_buffer = RunLog()
     log_buffer.write(f"================================================\n")
     log_buffer.write(f"🚀 备份任务启动: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     log_buffer.write(f"================================================\n")
     try:
         project = local_db.query(BackupProject).filter(BackupProject.id == project_id).first()
         if not project: return
+        job_throttle = throttle.start_job(project, "backup", lambda: check_stop(project_id, log_buffer))
         
         dest_type = project.destination_type or "cloud"
         log_buffer.write(f"[INFO] 项目名称: {project.name}\n")
@@ -174,12 +192,13 @@ def run_backup_task(project_id: int, db: Session = None, remark: str = None):
         if remark: log_buffer.write(f"[INFO] 任务备注: {remark}\n")
         log_buffer.write(f"------------------------------------------------\n")
         
-        history_record = BackupHistory(project_id=project.id, status="running", start_time=datetime.now(), log_message="正在初始化...", progress=0, remark=remark)
+        history_record = BackupHistory(project_id=project.id, task_type="backup", status="running", start_time=datetime.now(), log_message="正在初始化...", progress=0, remark=remark)
         local_db.add(history_record)
         local_db.commit()
+        log_buffer.attach(history_record.id, log_publisher(project.id))
 
         patterns = [p.strip() for p in (project.exclude_patterns or "").split(',') if p.strip()]
-        include_list = generate_manifest(project.source_path, patterns, log_buffer)
+        include_list = generate_manifest(project.source_path, patterns, log_buffer, project.id)
         if not include_list: raise Exception("清单为空，没有需要备份的文件。")
 
         total_files = len(include_list)
@@ -193,9 +212,7 @@ def run_backup_task(project_id: int, db: Session = None, remark: str = None):
                 pct = int((processed_count / total_files) * 100)
                 if pct > last_progress:
                     last_progress = pct
-                    history_record.progress = min(99, pct)
-                    history_record.log_message = log_buffer.getvalue()
-                    local_db.commit()
+                    writer.update(history_record, progress=min(99, pct), log_message=log_buffer.tail())
 
         timestamp, fmt, level = datetime.now().strftime("%Y%m%d_%H%M%S"), project.archive_format or "tgz", project.compression_level or 1
         
@@ -213,102 +230,299 @@ def run_backup_task(project_id: int, db: Session = None, remark: str = None):
                         else: os.remove(item_path)
                     except: pass
             
-            def sync_copy(rp):
-                check_stop(project_id, log_buffer)
-                src, dst = os.path.join(project.source_path, rp), os.path.join(sync_dest, rp)
-                if mode_str == 'incremental' and os.path.exists(dst):
-                    try:
-                        s_stat, d_stat = os.stat(src), os.stat(dst)
-                        if s_stat.st_size == d_stat.st_size and int(s_stat.st_mtime) <= int(d_stat.st_mtime): return
-                    except: pass 
-                os.makedirs(os.path.dirname(dst), exist_ok=True)
-                shutil.copy2(src, dst)
-                log_buffer.write(f"[SYNC] {rp}\n")
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=project.sync_threads or 2) as ex:
-                for _ in ex.map(sync_copy, include_list): update_prog()
-                
+            # 本次同步的传输统计，任务中断时也写入历史记录
+            totals = sync_totals = dict.fromkeys(SYNC_TOTAL_FIELDS, 0)
+            # 文件状态索引: 源文件与上次成功同步时一致则直接跳过，不访问目标端
+            index = FileIndex(project.id, sync_dest)
+            if mode_str == 'mirror':
+                # 切换到镜像模式后首次运行需对比目标端 (其他模式下目标端可能有索引外的文件)
+                deep_verify = index.get_meta("mode") != 'mirror' or index.needs_deep_verify(project.sync_verify_days or 0)
+                if deep_verify: log_buffer.write("[INFO] 正在扫描目标目录...\n")
+                dest_state = mirror.scan_destination(sync_dest) if deep_verify else index.load_states()
+                if not deep_verify: log_buffer.write(f"[INFO] 已加载文件索引: {len(dest_state)} 条记录\n")
+                plan = mirror.plan_mirror(project.source_path, sync_dest, include_list, dest_state, not deep_verify,
+                                          job_throttle, lambda: check_stop(project_id, log_buffer))
+                sync_stats = plan.stats()
+                log_buffer.write(f"[INFO] 差异: {mirror.format_stats(sync_stats)}\n")
+                update_prog(len(plan.unchanged))
+                totals["files_skipped"], totals["bytes_skipped"] = sync_stats["unchanged"]
+                changed = []
+                try:
+                    mirror.apply_mirror(plan, project.source_path, sync_dest, project.sync_threads or 2, job_throttle, log_buffer, changed, totals,
+                                        on_file=update_prog, check_stop=lambda: check_stop(project_id, log_buffer))
+                    if deep_verify:
+                        index.clear()
+                        index.mark_deep_verified()
+                    else:
+                        index.remove([rp for rp, _ in plan.deleted] + [r[0] for r in plan.renamed])
+                    index.set_meta("mode", mode_str)
+                finally:
+                    index.update(changed + (plan.unchanged if deep_verify else []))
+                    index.close()
+                states = {st[0]: (st[1], st[2]) for st in plan.unchanged + changed}
+            else:
+                deep_verify = mode_str != 'incremental' or index.needs_deep_verify(project.sync_verify_days or 0)
+                known = {} if deep_verify else index.load()
+                if deep_verify: index.clear()
+                if mode_str == 'incremental':
+                    if deep_verify: log_buffer.write("[INFO] 正在执行深度校验 (对比目标端并重建索引)...\n")
+                    else: log_buffer.write(f"[INFO] 已加载文件索引: {len(known)} 条记录\n")
+
+                def sync_copy(rp):
+                    """返回 (文件状态, 统计类别); 索引命中时状态为 None"""
+                    check_stop(project_id, log_buffer)
+                    src, dst = os.path.join(project.source_path, rp), os.path.join(sync_dest, rp)
+                    s_stat = os.stat(src)
+                    exists = False
+                    if mode_str == 'incremental':
+                        if known.get(rp) == (s_stat.st_size, s_stat.st_mtime_ns, s_stat.st_ino): return None, "skipped", s_stat.st_size
+                        if os.path.exists(dst):
+                            exists = True
+                            try:
+                                d_stat = os.stat(dst)
+                                if s_stat.st_size == d_stat.st_size and int(s_stat.st_mtime) <= int(d_stat.st_mtime): return state_of(rp, s_stat), "skipped", s_stat.st_size
+                            except: pass
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    job_throttle.copy_file(src, dst, s_stat.st_size)
+                    log_buffer.write(f"[SYNC] {rp}\n")
+                    return state_of(rp, s_stat), "updated" if exists else "added", s_stat.st_size
+
+                changed = []
+                try:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=project.sync_threads or 2) as ex:
+                        for state, kind, size in ex.map(sync_copy, include_list):
+                            if state: changed.append(state)
+                            totals[f"files_{kind}"] += 1
+                            totals["bytes_skipped" if kind == "skipped" else "bytes_copied"] += size
+                            update_prog()
+                    index.remove(set(known) - set(include_list))
+                    if deep_verify: index.mark_deep_verified()
+                    index.set_meta("mode", mode_str)
+                finally:
+                    # 已确认写入目标端的文件即使任务中断也记入索引
+                    index.update(changed)
+                    index.close()
+                states = {p: (s[0], s[1]) for p, s in known.items()}
+                states.update({s[0]: (s[1], s[2]) for s in changed})
+
             history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
-            total_size = 0
-            for dirpath, _, filenames in os.walk(sync_dest):
-                for f in filenames: total_size += os.path.getsize(os.path.join(dirpath, f))
+            # 镜像容量按源清单计算，不再遍历目标端
+            total_size = sum(states[rp][0] for rp in include_list if rp in states)
             history_record.file_size_bytes, history_record.file_name = total_size, "(Directory Sync)"
-            log_buffer.write(f"\n[INFO] 同步成功。总容量: {total_size} bytes\n")
-            history_record.log_message = log_buffer.getvalue()
-            send_notification("✅ 备份成功", f"项目: {project.name}\n模式: 同步", local_db)
+            record_catalog(project, history_record, ((rp, states[rp][0], states[rp][1] // 1_000_000_000, None) for rp in include_list if rp in states), log_buffer)
+            log_buffer.write(f"\n[INFO] 同步成功。总容量: {total_size} bytes，传输 {totals['bytes_copied']} bytes (新增 {totals['files_added']}，更新 {totals['files_updated']}，"
+                             f"重命名 {totals['files_renamed']}，删除 {totals['files_deleted']}，跳过 {totals['files_skipped']})\n")
+            log_buffer.write(job_throttle.summary())
+            history_record.log_message = log_buffer.tail()
+            detail = f"\n{mirror.format_stats(sync_stats)}" if mode_str == 'mirror' else ""
+            send_notification("✅ 备份成功", f"项目: {project.name}\n模式: 同步 ({mode_str}){detail}", local_db)
+            return
+
+        if fmt == "dedup":
+            repo_path = dedup.repo_path_for(project)
+            snapshot_name = f"{project.name.replace(' ','_')}_{timestamp}{dedup.SNAPSHOT_EXT}"
+            log_buffer.write("[INFO] 模式: 去重仓库模式\n")
+            os.makedirs(repo_path, exist_ok=True)
+            with dedup.repo_lock(repo_path):
+                repo = dedup.Repository(repo_path, project.encryption_password, level)
+                stats = dedup.backup_to_repository(repo, project.source_path, include_list, snapshot_name, log_buffer,
+                                                   on_file=update_prog, check_stop=lambda: check_stop(project_id, log_buffer), throttle=job_throttle)
+            history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
+            history_record.file_name, history_record.file_size_bytes = snapshot_name, stats["stored_bytes"]
+            log_buffer.write(f"\n[INFO] 快照完成: {snapshot_name}\n")
+            record_catalog(project, history_record, stats["manifest"], log_buffer)
+            log_buffer.write(f"[INFO] 源数据 {stats['logical_bytes']} bytes, 新增存储 {stats['stored_bytes']} bytes ({stats['new_chunks']} 个新块, {stats['reused_files']} 个文件未变化)\n")
+            log_buffer.write(job_throttle.summary())
+            schedule_prune(project, log_buffer)
+            history_record.log_message = log_buffer.tail()
+            send_notification("✅ 备份成功", f"项目: {project.name}\n快照: {snapshot_name}", local_db)
+            return
+
+        if fmt == "snapshot":
+            if dest_type != "local": raise Exception("硬链接快照仅支持本地目标")
+            snap_name = snapshot.snapshot_name(project, timestamp)
+            log_buffer.write("[INFO] 模式: 硬链接快照\n")
+            if project.encryption_password: log_buffer.write("[WARN] 快照为普通目录，不支持加密，已忽略访问密码\n")
+            os.makedirs(project.destination_path, exist_ok=True)
+            totals = sync_totals = dict.fromkeys(SYNC_TOTAL_FIELDS, 0)
+            states = snapshot.create_snapshot(project.source_path, project.destination_path, snapshot.prefix_for(project), snap_name, include_list,
+                                              project.sync_threads or 2, job_throttle, log_buffer, totals,
+                                              on_file=update_prog, check_stop=lambda: check_stop(project_id, log_buffer))
+            history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
+            history_record.file_name, history_record.file_size_bytes = snap_name, sum(s[0] for s in states.values())
+            record_catalog(project, history_record, ((rp, s[0], s[1] // 1_000_000_000, None) for rp, s in states.items()), log_buffer)
+            log_buffer.write(f"\n[INFO] 快照完成: {snap_name}\n[INFO] 总容量: {history_record.file_size_bytes} bytes，复制 {totals['bytes_copied']} bytes "
+                             f"(新增 {totals['files_added']}，更新 {totals['files_updated']})，硬链接 {totals['files_skipped']} 个未变化文件\n")
+            log_buffer.write(job_throttle.summary())
+            schedule_prune(project, log_buffer)
+            history_record.log_message = log_buffer.tail()
+            send_notification("✅ 备份成功", f"项目: {project.name}\n快照: {snap_name}", local_db)
             return
 
         ext = ".7z" if fmt == "7z" else (".tar.gz" if fmt == "tgz" else ".tar")
         archive_name = f"{project.name.replace(' ','_')}_{timestamp}{ext}"
+        # 归档与索引共用一个 salt，PBKDF2 每个任务只派生一次
+        job_salt = new_salt()
+        # 流式模式: 打包 -> 压缩 -> 加密 直接写入目标目录，不产生中间文件 (7z 不支持，仍走暂存流程)
+        stream_mode = (project.pipeline_mode or "staged") == "stream" and fmt != "7z"
+        # 分卷模式: 输出为目录，分卷写满即上传，压缩与上传并行
+        volume_size = (project.volume_size_mb or 0) * 1024 * 1024
+        volume_mode = volume_size > 0
+        if volume_mode: stream_mode = False
         
-        if dest_type == "local":
+        if volume_mode:
+            set_name = archive_name + (".enc" if project.encryption_password and fmt != "7z" else "")
+            volume_part_dir = os.path.join(project.destination_path, set_name + ".part")
+            os.makedirs(volume_part_dir, exist_ok=True)
+            if dest_type == "local":
+                volume_stage = volume_part_dir
+            else:
+                volume_stage = project.cache_dir or "/data/cache"
+                os.makedirs(volume_stage, exist_ok=True)
+                uploader = volumes.VolumeUploader(volume_part_dir, project.upload_threads or 1, log_buffer,
+                                                  check_stop=lambda: check_stop(project_id, log_buffer), throttle=job_throttle)
+            working_path = os.path.join(volume_stage, set_name)
+            log_buffer.write(f"[INFO] 模式: 压缩模式 ({fmt}, 分卷 {project.volume_size_mb} MB)\n[INFO] 分卷暂存: {volume_stage}\n")
+        elif stream_mode:
+            os.makedirs(project.destination_path, exist_ok=True)
+            stream_name = archive_name + (".enc" if project.encryption_password else "")
+            working_path = os.path.join(project.destination_path, stream_name + ".part")
+            log_buffer.write(f"[INFO] 模式: 压缩模式 ({fmt}, 流式写入)\n[INFO] 输出: {working_path}\n")
+        elif dest_type == "local":
             os.makedirs(project.destination_path, exist_ok=True)
             working_path = os.path.join(project.destination_path, archive_name)
             log_buffer.write(f"[INFO] 模式: 压缩模式 ({fmt})\n[INFO] 输出: {working_path}\n")
         else:
             cache_dir = project.cache_dir or "/data/cache"
             os.makedirs(cache_dir, exist_ok=True)
+            resume_pending_uploads(project, cache_dir, local_db, log_buffer, job_throttle)
             working_path = os.path.join(cache_dir, archive_name)
             log_buffer.write(f"[INFO] 模式: 压缩模式 ({fmt})\n[INFO] 缓存: {working_path}\n")
 
-        history_record.log_message = log_buffer.getvalue()
-        local_db.commit()
+        writer.update(history_record, log_message=log_buffer.tail())
 
+        archive_idx = None
         if fmt == "7z":
             list_file_path = working_path + ".list"
             with open(list_file_path, "w", encoding="utf-8") as f:
                 for p in include_list: f.write(p + "\n")
             cmd = ["7z", "a", working_path, f"@{list_file_path}", f"-mx={level}", "-m0=lzma2", "-mf=off", "-bb1"]
             if project.encryption_password: cmd.extend([f"-p{project.encryption_password}", "-mhe=on"])
+            if volume_mode: cmd.append(f"-v{project.volume_size_mb}m")
             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=project.source_path, bufsize=1)
+            last_sync = last_scan = time.monotonic()
+            submitted = 0
             for line in proc.stdout:
                 log_buffer.write(line)
+                if uploader and time.monotonic() - last_scan >= volumes.SCAN_INTERVAL:
+                    # 下一个分卷出现即表示前一个分卷已写完; 上传积压时暂停读取输出，7z 随之阻塞。
+                    # 第一个分卷在压缩结束时还会回写文件头，留到最后上传。按间隔扫描，剩余分卷在结束后统一提交
+                    last_scan = time.monotonic()
+                    done = volumes.list_volumes(volume_stage, set_name)[1:-1]
+                    for p in done[submitted:]: uploader.submit(p)
+                    submitted = max(submitted, len(done))
                 if line.strip().startswith("+ "): update_prog()
-                else: 
-                    history_record.log_message = log_buffer.getvalue()
-                    local_db.commit()
+                elif time.monotonic() - last_sync >= 1:
+                    last_sync = time.monotonic()
+                    writer.update(history_record, log_message=log_buffer.tail())
                 if stop_signals.get(project_id): proc.terminate(); raise Exception("用户强制终止")
             proc.wait()
             if proc.returncode != 0: raise Exception("7z 压缩失败")
+            if uploader:
+                rest = volumes.list_volumes(volume_stage, set_name)
+                for p in rest[1:][submitted:] + rest[:1]: uploader.submit(p)
         else:
-            mode = "w:gz" if fmt == "tgz" else "w"
-            with tarfile.open(working_path, mode, compresslevel=level if fmt=="tgz" else None) as tar:
+            with contextlib.ExitStack() as stack:
+                if volume_mode:
+                    out = stack.enter_context(volumes.VolumeWriter(volume_stage, set_name, volume_size, uploader.submit if uploader else None))
+                else:
+                    out = stack.enter_context(open(working_path, "wb"))
+                # 写入限速作用于目标端; 云端暂存模式写的是本地缓存，限速在上传阶段进行
+                if dest_type == "local" or stream_mode: out = stack.enter_context(job_throttle.writer(out))
+                if (stream_mode or volume_mode) and project.encryption_password:
+                    log_buffer.write("[INFO] AES 加密: 流式\n")
+                    out = stack.enter_context(EncryptingWriter(out, project.encryption_password, _stopper(project_id), job_salt))
+                gz = None
+                if fmt == "tgz":
+                    threads = project.compress_threads or 1
+                    log_buffer.write(f"[INFO] 并行压缩: {threads} 线程\n")
+                    # 定期设置重启点，配合索引实现单文件还原
+                    out = gz = stack.enter_context(ParallelGzipWriter(out, level, threads, restart_interval=archive_index.RESTART_BLOCKS))
+                tar = stack.enter_context(archive_index.IndexedTarFile.open(fileobj=out, mode="w|"))
+                tar.wrap_source = job_throttle.reader
                 for rp in include_list:
                     check_stop(project_id, log_buffer)
                     log_buffer.write(f"[PACK] {rp}\n")
                     tar.add(os.path.join(project.source_path, rp), arcname=rp)
                     update_prog()
+            archive_idx = archive_index.build_index(tar, gz, bool(project.encryption_password))
 
         file_ready = working_path
-        if fmt != "7z" and project.encryption_password:
+        if fmt != "7z" and project.encryption_password and not (stream_mode or volume_mode):
             log_buffer.write("[INFO] 正在执行 AES 私有加密...\n")
             final_encrypted_path = working_path + ".enc"
-            encrypt_file(working_path, final_encrypted_path, project.encryption_password, project_id)
+            encrypt_file(working_path, final_encrypted_path, project.encryption_password, project_id, job_throttle if dest_type == "local" else None, job_salt)
             if os.path.exists(working_path): os.remove(working_path)
             file_ready = final_encrypted_path
 
-        if dest_type == "cloud":
+        if volume_mode:
+            if uploader:
+                log_buffer.write("[INFO] 等待剩余分卷上传完成...\n")
+                uploader.finish()
+            final_stats_path = os.path.join(project.destination_path, set_name)
+            os.replace(volume_part_dir, final_stats_path)
+            volume_part_dir = None
+        elif stream_mode:
+            final_stats_path = os.path.join(project.destination_path, stream_name)
+            os.replace(working_path, final_stats_path)
+        elif dest_type == "cloud":
             log_buffer.write(f"[INFO] 正在上传至云端...\n")
             final_dest = os.path.join(project.destination_path, os.path.basename(file_ready))
-            perform_safe_move(file_ready, final_dest)
+            try:
+                upload.upload_file(file_ready, final_dest, project.upload_threads or 1, log_buffer,
+                                   check_stop=lambda: check_stop(project_id, log_buffer),
+                                   extra={"project_id": project.id, "history_id": history_record.id}, throttle=job_throttle)
+            except Exception:
+                # 上传中断 (非用户终止) 时保留缓存文件与断点，下次运行续传
+                if not stop_signals.get(project_id):
+                    keep_staged = True
+                    log_buffer.write("[WARN] 上传未完成，已保留缓存文件与断点，下次运行时将自动续传\n")
+                else:
+                    upload.SegmentedUpload(file_ready, final_dest).discard()
+                raise
             final_stats_path = final_dest
         else:
             final_stats_path = file_ready
 
+        if archive_idx:
+            try: archive_index.save_index(final_stats_path, archive_idx, project.encryption_password, job_salt)
+            except Exception as e: log_buffer.write(f"[WARN] 归档索引写入失败: {e}\n")
+
         history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
-        history_record.file_name, history_record.file_size_bytes = os.path.basename(final_stats_path), os.stat(final_stats_path).st_size
+        history_record.file_name = os.path.basename(final_stats_path)
+        history_record.file_size_bytes = volumes.set_size(final_stats_path) if volume_mode else os.stat(final_stats_path).st_size
+        if volume_mode: log_buffer.write(f"[INFO] 分卷数: {len(volumes.set_volumes(final_stats_path))}\n")
+        if archive_idx: record_catalog(project, history_record, ((m[0], m[2], m[3], None) for m in archive_idx["members"] if m[5] is not None), log_buffer)
+        else: record_catalog(project, history_record, catalog.stat_entries(project.source_path, include_list), log_buffer)
         log_buffer.write(f"\n[INFO] 备份成功。文件: {history_record.file_name} ({history_record.file_size_bytes} bytes)\n")
-        history_record.log_message = log_buffer.getvalue()
+        log_buffer.write(job_throttle.summary())
+        schedule_prune(project, log_buffer)
+        history_record.log_message = log_buffer.tail()
         send_notification("✅ 备份成功", f"项目: {project.name}\n文件: {history_record.file_name}", local_db)
-        apply_retention_policy(project, local_db)
     except Exception as e:
         log_buffer.write(f"\n[ERROR] 任务失败: {str(e)}\n")
         if history_record:
             history_record.status, history_record.end_time = "failed", datetime.now()
-            history_record.log_message = log_buffer.getvalue()
+            history_record.log_message = log_buffer.tail()
         send_notification("❌ 备份失败", f"项目: {project.name}\n原因: {str(e)}", local_db)
     finally:
+        if history_record and sync_totals:
+            for key, value in sync_totals.items(): setattr(history_record, key, value)
+        # 写完排队中的进度并关闭该记录，之后的批量写入不会覆盖最终状态
+        if history_record: writer.finish(history_record.id)
         local_db.commit()
+        if history_record: writer.release(history_record.id)
+        log_buffer.finish()
         if list_file_path and os.path.exists(list_file_path):
             try: os.remove(list_file_path)
             except: pass
@@ -316,95 +530,201 @@ def run_backup_task(project_id: int, db: Session = None, remark: str = None):
         for p in [working_path, final_encrypted_path]:
             if p and os.path.exists(p):
                 if dest_type == "local" and not is_failed: continue
+                if keep_staged: continue
                 try: os.remove(p)
                 except: pass
+        if volume_stage:
+            if uploader: uploader.abort()
+            if volume_part_dir: volumes.remove_set(volume_part_dir)
+            if volume_stage != volume_part_dir: volumes.remove_cached(volume_stage, set_name)
+        if job_throttle: throttle.end_job(job_throttle)
         stop_signals.pop(project_id, None)
         if not db: local_db.close()
 
-def run_restore_task(project_id: int, backup_filename: str, restore_mode: str, db: Session = None):
+def record_catalog(project, history_record, entries, log_buffer: io.TextIOBase):
+    """写入本次备份的文件清单 entries: [(path, size, mtime 秒, hash)]"""
+    try:
+        catalog.record_version(project.id, history_record.id, history_record.start_time, entries)
+    except Exception as e:
+        log_buffer.write(f"[WARN] 文件目录写入失败: {e}\n")
+
+def resume_pending_uploads(project, cache_dir: str, db: Session, log_buffer: io.TextIOBase, job_throttle=None):
+    """续传此前中断的上传，成功后将对应的失败记录更正为成功"""
+    for source, ck in upload.pending_uploads(cache_dir, project.id):
+        name = os.path.basename(ck["dest"])
+        log_buffer.write(f"[INFO] 发现未完成的上传: {name}，正在续传...\n")
+        try:
+            upload.upload_file(source, ck["dest"], project.upload_threads or 1, log_buffer,
+                               check_stop=lambda: check_stop(project.id, log_buffer), throttle=job_throttle)
+        except Exception as e:
+            log_buffer.write(f"[WARN] 续传失败 ({e})，将在下次运行时重试\n")
+            check_stop(project.id, log_buffer)
+            continue
+        record = db.query(BackupHistory).filter(BackupHistory.id == ck.get("history_id")).first()
+        if record:
+            record.status, record.progress = "success", 100
+            record.file_name, record.file_size_bytes = name, os.stat(ck["dest"]).st_size
+            record.log_message = (record.log_message or "") + f"\n[INFO] 已于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} 续传完成\n"
+            db.commit()
+        log_buffer.write(f"[INFO] 续传完成: {name}\n")
+
+def clear_directory(path: str, log_buffer: io.TextIOBase):
+    log_buffer.write("[WARN] 正在清空源目录...\n")
+    if not os.path.exists(path): return
+    for f in os.listdir(path):
+        p = os.path.join(path, f)
+        try:
+            if os.path.isfile(p) or os.path.islink(p): os.unlink(p)
+            elif os.path.isdir(p): shutil.rmtree(p)
+        except: pass
+
+def run_restore_task(project_id: int, backup_filename: str, restore_mode: str, db: Session = None, paths: list = None):
     local_db = db or SessionLocal()
-    history_record, cache_path, decrypted_path = None, None, None
-    log_buffer = io.StringIO()
+    history_record, job_throttle = None, None
+    log_buffer = RunLog()
     log_buffer.write(f"================================================\n")
     log_buffer.write(f"♻️ 还原任务启动: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     log_buffer.write(f"================================================\n")
     try:
         project = local_db.query(BackupProject).filter(BackupProject.id == project_id).first()
         if not project: raise Exception("项目不存在")
+        job_throttle = throttle.start_job(project, "restore", lambda: check_stop(project_id, log_buffer))
         log_buffer.write(f"[INFO] 项目: {project.name}\n[INFO] 文件: {backup_filename}\n")
-        history_record = BackupHistory(project_id=project.id, status="running", start_time=datetime.now(), file_name=backup_filename, log_message="初始化还原...", progress=0)
+        history_record = BackupHistory(project_id=project.id, task_type="restore", status="running", start_time=datetime.now(), file_name=backup_filename, log_message="初始化还原...", progress=0)
         local_db.add(history_record)
         local_db.commit()
+        log_buffer.attach(history_record.id, log_publisher(project.id))
+        paths = [p for p in (paths or []) if p and p.strip()]
+        if paths:
+            log_buffer.write(f"[INFO] 部分还原: {', '.join(paths)}\n")
+            if restore_mode == 'clean':
+                log_buffer.write("[WARN] 部分还原不会清空目标目录，按覆盖模式执行\n")
+                restore_mode = 'overwrite'
+
+        progress = 0
+        def on_restored(count, total, rp):
+            nonlocal progress
+            pct = int((count / total) * 100) if total else 100
+            if pct > progress:
+                progress = pct
+                log_buffer.write(f"[UNPACK] {rp}\n")
+                writer.update(history_record, progress=pct, log_message=log_buffer.tail())
         
+        if backup_filename.endswith(dedup.SNAPSHOT_EXT):
+            if restore_mode == 'clean': clear_directory(project.source_path, log_buffer)
+            os.makedirs(project.source_path, exist_ok=True)
+            log_buffer.write(f"[INFO] 正在从去重仓库重建快照至: {project.source_path}\n")
+            repo = dedup.Repository(dedup.repo_path_for(project), project.encryption_password)
+            dedup.restore_from_repository(repo, backup_filename, project.source_path, log_buffer, on_restored, lambda: check_stop(project_id, log_buffer), paths, job_throttle)
+            history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
+            log_buffer.write("\n[INFO] 还原成功。\n")
+            history_record.log_message = log_buffer.tail()
+            send_notification("♻️ 还原成功", f"项目: {project.name}", local_db)
+            return
+
         src_file = os.path.join(project.destination_path, backup_filename)
         if not os.path.exists(src_file): raise Exception("备份文件不存在")
+        if backup_filename.endswith(snapshot.SNAP_EXT):
+            if restore_mode == 'clean': clear_directory(project.source_path, log_buffer)
+            os.makedirs(project.source_path, exist_ok=True)
+            log_buffer.write(f"[INFO] 正在从快照复制文件至: {project.source_path}\n")
+            count = snapshot.restore_snapshot(src_file, project.source_path, project.sync_threads or 2, job_throttle, on_restored, lambda: check_stop(project_id, log_buffer), paths)
+            log_buffer.write(f"[INFO] 已还原 {count} 个文件\n")
+            history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
+            log_buffer.write("\n[INFO] 还原成功。\n")
+            log_buffer.write(job_throttle.summary())
+            history_record.log_message = log_buffer.tail()
+            send_notification("♻️ 还原成功", f"项目: {project.name}", local_db)
+            return
+        volume_paths = volumes.set_volumes(src_file) if os.path.isdir(src_file) else None
+        if volume_paths is not None and not volume_paths: raise Exception("分卷目录中没有分卷文件")
         
-        cache_dir = project.cache_dir or "/data/cache"
-        os.makedirs(cache_dir, exist_ok=True)
-        cache_path = os.path.join(cache_dir, f"restore_{backup_filename}")
-        log_buffer.write(f"[INFO] 正在拉取文件至缓存: {cache_dir} ...\n")
-        shutil.copy2(src_file, cache_path)
-        
-        restore_archive = cache_path
-        if backup_filename.endswith(".enc"):
-            log_buffer.write("[INFO] 执行解密...\n")
-            decrypted_path = cache_path.replace(".enc", "")
-            decrypt_file(cache_path, decrypted_path, project.encryption_password, project_id)
-            restore_archive = decrypted_path
-            
-        if restore_mode == 'clean':
-            log_buffer.write("[WARN] 正在清空源目录...\n")
-            for f in os.listdir(project.source_path):
-                p = os.path.join(project.source_path, f)
-                try:
-                    if os.path.isfile(p) or os.path.islink(p): os.unlink(p)
-                    elif os.path.isdir(p): shutil.rmtree(p)
-                except: pass
-                
-        os.makedirs(project.source_path, exist_ok=True)
-        log_buffer.write(f"[INFO] 正在解压数据至: {project.source_path}\n")
+        if volume_paths: log_buffer.write(f"[INFO] 分卷备份: {len(volume_paths)} 个分卷\n")
+
+        index = None
+        if paths and not backup_filename.endswith(".7z"):
+            try: index = archive_index.load_index(src_file, project.encryption_password)
+            except Exception as e: log_buffer.write(f"[WARN] 归档索引读取失败: {e}\n")
+            if not index: log_buffer.write("[INFO] 没有可用的归档索引，将顺序扫描整个归档\n")
         
-        if backup_filename.endswith(".7z"):
-            cmd = ["7z", "x", restore_archive, f"-o{project.source_path}", "-y"]
+        if index:
+            # 按索引定位: 只读取所需成员所在的数据块
+            members = archive_index.select_members(index["members"], paths)
+            log_buffer.write(f"[INFO] 归档索引: 匹配 {len(members)} 个文件，正在按偏移读取...\n")
+            os.makedirs(project.source_path, exist_ok=True)
+            archive = archive_index.IndexedArchive(src_file, index, project.encryption_password, job_throttle)
+            try: archive_index.restore_members(archive, members, project.source_path, on_restored, lambda: check_stop(project_id, log_buffer), job_throttle,
+                                               all_members=index["members"], log_buffer=log_buffer)
+            finally: archive.close()
+        elif backup_filename.endswith(".7z"):
+            # 7z 需要随机访问，直接读取目标端文件 (分卷由 7z 从第一卷开始按序读取)
+            if restore_mode == 'clean': clear_directory(project.source_path, log_buffer)
+            os.makedirs(project.source_path, exist_ok=True)
+            log_buffer.write(f"[INFO] 正在解压数据至: {project.source_path}\n")
+            cmd = ["7z", "x", volume_paths[0] if volume_paths else src_file, f"-o{project.source_path}", "-y"]
             if project.encryption_password: cmd.append(f"-p{project.encryption_password}")
+            if paths: cmd.extend(["--"] + [p.strip().strip("/") for p in paths])
             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+            last_sync = time.monotonic()
             for line in proc.stdout:
                 log_buffer.write(line)
-                history_record.progress = min(99, (history_record.progress or 0) + 1)
-                history_record.log_message = log_buffer.getvalue()
-                local_db.commit()
+                if time.monotonic() - last_sync >= 1:
+                    last_sync = time.monotonic()
+                    progress = min(99, progress + 1)
+                    writer.update(history_record, progress=progress, log_message=log_buffer.tail())
             proc.wait()
             if proc.returncode != 0: raise Exception("7z 还原失败")
         else:
-            with tarfile.open(restore_archive, "r:gz" if backup_filename.endswith(".gz") else "r") as tar:
-                members = tar.getmembers()
-                total, count = len(members), 0
-                for m in members:
-                    check_stop(project_id, log_buffer)
-                    if not (m.name.startswith("/") or ".." in m.name): tar.extract(m, path=project.source_path)
-                    count += 1
-                    pct = int((count / total) * 100)
-                    if pct > (history_record.progress or 0):
-                        history_record.progress = pct
-                        log_buffer.write(f"[UNPACK] {m.name}\n")
-                        history_record.log_message = log_buffer.getvalue()
-                        local_db.commit()
+            # 流式还原: 目标端 -> 解密 -> 解压 -> 逐个成员解包，不产生缓存副本
+            total = volumes.set_size(src_file) if volume_paths else os.path.getsize(src_file)
+            with contextlib.ExitStack() as stack:
+                source = volumes.VolumeReader(volume_paths) if volume_paths else open(src_file, "rb", buffering=0)
+                counter = stack.enter_context(extract.CountingReader(job_throttle.reader(source)))
+                stream = io.BufferedReader(counter, extract.READ_BUFFER)
+                if backup_filename.endswith(".enc"):
+                    log_buffer.write("[INFO] 流式解密...\n")
+                    stream = io.BufferedReader(DecryptingReader(stream, project.encryption_password, _stopper(project_id)), extract.READ_BUFFER)
+                # 打开归档时已读取第一个成员: 密码错误或文件损坏会在清空目录之前报错
+                try: tar = stack.enter_context(tarfile.open(fileobj=stream, mode="r|*"))
+                except tarfile.ReadError as e: raise Exception(f"无法读取归档 ({e})，请检查密码或备份文件是否损坏")
+                if restore_mode == 'clean': clear_directory(project.source_path, log_buffer)
+                os.makedirs(project.source_path, exist_ok=True)
+                log_buffer.write(f"[INFO] 正在解压数据至: {project.source_path} ({extract.RESTORE_THREADS} 线程写入)\n")
+                extractor = extract.ParallelExtractor(tar, project.source_path, throttle=job_throttle)
+                selected = archive_index.path_filter(paths)
+                try:
+                    for m in tar:
+                        check_stop(project_id, log_buffer)
+                        if extract.is_safe_member(m.name) and (selected is None or selected(m.name)): extractor.extract(m)
+                        pct = min(99, int(counter.count * 100 / total)) if total else 0
+                        if pct > progress:
+                            progress = pct
+                            log_buffer.write(f"[UNPACK] {m.name}\n")
+                            writer.update(history_record, progress=pct, log_message=log_buffer.tail())
+                    extractor.finish()
+                except BaseException:
+                    extractor.abort()
+                    raise
+                for name in extractor.missing_links: log_buffer.write(f"[WARN] 硬链接目标未还原，已跳过: {name}\n")
+                # 读完剩余数据，完成 AES-GCM 校验
+                while stream.read(extract.READ_BUFFER): pass
                         
         history_record.status, history_record.end_time, history_record.progress = "success", datetime.now(), 100
         log_buffer.write(f"\n[INFO] 还原成功。\n")
-        history_record.log_message = log_buffer.getvalue()
+        log_buffer.write(job_throttle.summary())
+        history_record.log_message = log_buffer.tail()
         send_notification("♻️ 还原成功", f"项目: {project.name}", local_db)
     except Exception as e:
         log_buffer.write(f"\n[ERROR] 还原失败: {str(e)}\n")
         if history_record:
             history_record.status, history_record.end_time = "failed", datetime.now()
-            history_record.log_message = log_buffer.getvalue()
+            history_record.log_message = log_buffer.tail()
         send_notification("❌ 还原失败", f"项目: {project.name}\n原因: {str(e)}", local_db)
     finally:
+        if history_record: writer.finish(history_record.id)
         local_db.commit()
-        for p in [cache_path, decrypted_path]:
-            if p and os.path.exists(p):
-                try: os.remove(p)
-                except: pass
+        if history_record: writer.release(history_record.id)
+        log_buffer.finish()
+        if job_throttle: throttle.end_job(job_throttle)
         stop_signals.pop(project_id, None)
         if not db: local_db.close()
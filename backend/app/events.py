@@ -0,0 +1,147 @@
+import json
+import asyncio
+import threading
+from sqlalchemy import event, inspect
+
+from .models import BackupHistory
+
+# 进程内事件总线: engine 线程发布任务状态与日志增量，SSE 连接订阅。
+# 每个订阅者只保留每个项目的最新状态 (合并覆盖)，日志增量有上限，
+# 慢速客户端不会积压队列；日志被丢弃时客户端根据 offset 不连续自行回补。
+
+MAX_PENDING_LOG = 64 * 1024
+STATE_FIELDS = ("status", "progress", "task_type", "file_name", "file_size_bytes", "start_time", "end_time")
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, project_id: int = None, with_logs: bool = False):
+        self.loop = loop
+        self.project_id = project_id
+        self.with_logs = with_logs
+        self.lock = threading.Lock()
+        self.states = {}   # project_id -> 最新状态
+        self.queues = {}   # project_id -> 最新排队情况
+        self.logs = {}     # history_id -> 待发送日志增量
+        self.ready = asyncio.Event()
+
+    def wants(self, project_id: int) -> bool:
+        return self.project_id is None or self.project_id == project_id
+
+    def _wake(self):
+        try: self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError: pass  # 事件循环已关闭
+
+    def offer_state(self, state: dict):
+        with self.lock: self.states[state["project_id"]] = state
+        self._wake()
+
+    def offer_queue(self, queue: dict):
+        with self.lock: self.queues[queue["project_id"]] = queue
+        self._wake()
+
+    def offer_log(self, project_id: int, history_id: int, text: str, offset: int, next_offset: int):
+        with self.lock:
+            pending = self.logs.get(history_id)
+            if pending and pending["next_offset"] == offset and len(pending["text"]) + len(text) <= MAX_PENDING_LOG:
+                pending["text"] += text
+                pending["next_offset"] = next_offset
+            else:
+                # 新的一段或超出上限: 丢弃积压内容，客户端发现 offset 不连续后通过日志 API 回补
+                if len(text) > MAX_PENDING_LOG: text, offset = "", next_offset
+                self.logs[history_id] = {"type": "log", "project_id": project_id, "history_id": history_id,
+                                         "offset": offset, "next_offset": next_offset, "text": text}
+        self._wake()
+
+    def drain(self) -> list:
+        with self.lock:
+            batch = list(self.states.values()) + list(self.queues.values()) + list(self.logs.values())
+            self.states, self.queues, self.logs = {}, {}, {}
+            self.ready.clear()
+        return batch
+
+    async def next_batch(self, timeout: float) -> list:
+        try: await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError: pass
+        return self.drain()
+
+
+class EventBus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.latest = {}  # project_id -> 最新状态，用于新连接的初始快照
+        self.queued = {}  # project_id -> 排队中的任务 (没有排队任务的项目不保留)
+
+    def subscribe(self, loop, project_id: int = None, with_logs: bool = False) -> Subscription:
+        sub = Subscription(loop, project_id, with_logs)
+        with self.lock:
+            self.subscribers.add(sub)
+            initial = [s for pid, s in self.latest.items() if sub.wants(pid)]
+            queued = [q for pid, q in self.queued.items() if sub.wants(pid)]
+        for s in initial: sub.offer_state(s)
+        for q in queued: sub.offer_queue(q)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self.lock: self.subscribers.discard(sub)
+
+    def _targets(self, project_id: int, logs: bool = False) -> list:
+        with self.lock: return [s for s in self.subscribers if s.wants(project_id) and (s.with_logs or not logs)]
+
+    def publish_state(self, state: dict):
+        state = {"type": "state", **state}
+        with self.lock: self.latest[state["project_id"]] = state
+        for sub in self._targets(state["project_id"]): sub.offer_state(state)
+
+    def publish_queue(self, project_id: int, entries: list):
+        queue = {"type": "queue", "project_id": project_id, "entries": entries}
+        with self.lock:
+            if entries: self.queued[project_id] = queue
+            else: self.queued.pop(project_id, None)
+        for sub in self._targets(project_id): sub.offer_queue(queue)
+
+    def publish_log(self, project_id: int, history_id: int, text: str, offset: int, next_offset: int):
+        for sub in self._targets(project_id, logs=True): sub.offer_log(project_id, history_id, text, offset, next_offset)
+
+
+bus = EventBus()
+
+def history_state(h: BackupHistory) -> dict:
+    state = {"project_id": h.project_id, "history_id": h.id}
+    for f in STATE_FIELDS:
+        v = getattr(h, f, None)
+        state[f] = v.isoformat() if hasattr(v, "isoformat") else v
+    return state
+
+@event.listens_for(BackupHistory, "after_insert")
+def _history_inserted(mapper, connection, target):
+    bus.publish_state(history_state(target))
+
+@event.listens_for(BackupHistory, "after_update")
+def _history_updated(mapper, connection, target):
+    # 仅状态类字段变化时推送，单纯的日志摘要更新不产生事件
+    attrs = inspect(target).attrs
+    if any(attrs[f].history.has_changes() for f in STATE_FIELDS if f in attrs):
+        bus.publish_state(history_state(target))
+
+def log_publisher(project_id: int):
+    """供 RunLog 使用的回调: 日志刷盘时推送增量"""
+    def publish(history_id: int, text: str, offset: int, next_offset: int):
+        bus.publish_log(project_id, history_id, text, offset, next_offset)
+    return publish
+
+async def sse_stream(request, project_id: int = None, keepalive: float = 15):
+    # 全局订阅只推送状态，日志增量仅推送给单项目订阅
+    sub = bus.subscribe(asyncio.get_running_loop(), project_id, with_logs=project_id is not None)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            if await request.is_disconnected(): break
+            batch = await sub.next_batch(keepalive)
+            if not batch:
+                yield ": keepalive\n\n"
+                continue
+            for ev in batch:
+                yield f"event: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False, default=str)}\n\n"
+    finally:
+        bus.unsubscribe(sub)
@@ -0,0 +1,126 @@
+import os
+import io
+import shutil
+import threading
+import concurrent.futures
+
+# 流式解包: tar 成员按到达顺序读取，小文件的写入 (创建/写入/属性设置) 交给线程池并行执行，
+# 大文件在读取线程中边读边写。在途数据量有上限，不会因写入慢而占满内存。
+# 硬链接成员自行处理: 等待链接目标写完再 os.link (失败时复制)，不使用 tarfile 回读目标数据的做法 (流式读取无法回退)。
+RESTORE_THREADS = int(os.getenv("RESTORE_THREADS", "4"))
+SMALL_FILE = 8 * 1024 * 1024
+MAX_INFLIGHT = 64 * 1024 * 1024
+READ_BUFFER = 1024 * 1024
+
+
+class CountingReader(io.RawIOBase):
+    """统计已读取的字节数，用于按源文件读取进度计算还原进度"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        n = self.raw.readinto(b)
+        self.count += n or 0
+        return n
+
+    def close(self):
+        try: self.raw.close()
+        finally: super().close()
+
+
+def is_safe_member(name: str) -> bool:
+    return not (name.startswith("/") or ".." in name)
+
+
+class ParallelExtractor:
+    def __init__(self, tar, target: str, threads: int = RESTORE_THREADS, throttle=None):
+        self.tar = tar
+        self.target = target
+        self.throttle = throttle
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads))
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self.error = None
+        self.pending = {}        # 成员名 -> 线程池中的写入任务
+        self.missing_links = []  # 目标未还原 (未选中或不在归档中) 的硬链接
+
+    def _acquire(self, n: int):
+        with self.cond:
+            while self.inflight and self.inflight + n > MAX_INFLIGHT: self.cond.wait()
+            self.inflight += n
+
+    def _release(self, n: int):
+        with self.cond:
+            self.inflight -= n
+            self.cond.notify_all()
+
+    def _set_attrs(self, member, path: str):
+        # 与 TarFile.extract 相同的属性处理
+        self.tar.chown(member, path, False)
+        self.tar.chmod(member, path)
+        self.tar.utime(member, path)
+
+    def _write(self, member, path: str, data: bytes):
+        try:
+            if self.throttle: self.throttle.on_write(len(data))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f: f.write(data)
+            self._set_attrs(member, path)
+        except Exception as e:
+            if self.error is None: self.error = e
+        finally:
+            self._release(len(data))
+
+    def _write_large(self, member, path: str):
+        """限速时大文件在读取线程中按块写入"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        src = self.tar.extractfile(member)
+        with open(path, "wb") as f:
+            while buf := src.read(READ_BUFFER):
+                self.throttle.on_write(len(buf))
+                f.write(buf)
+        self._set_attrs(member, path)
+
+    def _link(self, member, path: str):
+        target = os.path.join(self.target, member.linkname)
+        future = self.pending.pop(member.linkname, None)
+        if future: future.result()
+        if self.error: raise self.error
+        if not is_safe_member(member.linkname) or not os.path.isfile(target):
+            self.missing_links.append(member.name)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path): os.remove(path)
+        try: os.link(target, path)
+        except OSError: shutil.copy2(target, path)
+
+    def extract(self, member):
+        if self.error: raise self.error
+        path = os.path.join(self.target, member.name)
+        if member.islnk():
+            self._link(member, path)
+            return
+        # 同名成员再次出现时先等待之前的写入，保证后到的版本生效
+        previous = self.pending.pop(member.name, None)
+        if previous: previous.result()
+        if member.isreg() and member.size <= SMALL_FILE:
+            data = self.tar.extractfile(member).read()
+            self._acquire(len(data))
+            self.pending[member.name] = self.pool.submit(self._write, member, path, data)
+            if len(self.pending) > 10000: self.pending = {k: f for k, f in self.pending.items() if not f.done()}
+        elif member.isreg() and self.throttle:
+            self._write_large(member, path)
+        else:
+            self.tar.extract(member, path=self.target)
+
+    def finish(self):
+        self.pool.shutdown(wait=True)
+        if self.error: raise self.error
+
+    def abort(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
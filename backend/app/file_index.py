@@ -0,0 +1,75 @@
+import os
+import time
+import sqlite3
+
+# 同步模式的文件状态索引 (每个项目一个独立 SQLite 文件)
+# 记录上次成功同步时源文件的 (size, mtime_ns, inode)，未变化的文件直接跳过，
+# 不再对目标端 (网盘挂载) 逐个 stat。
+INDEX_DIR = os.getenv("INDEX_DIR", "/data/index")
+
+
+class FileIndex:
+    def __init__(self, project_id: int, destination: str):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        self.path = os.path.join(INDEX_DIR, f"project_{project_id}.db")
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        # 目标路径变化后旧索引失效
+        if self.get_meta("destination") != destination:
+            self.clear()
+            self.set_meta("destination", destination)
+
+    def get_meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+        self.conn.commit()
+
+    def load(self) -> dict:
+        """path -> (size, mtime_ns, inode)"""
+        return {r[0]: (r[1], r[2], r[3]) for r in self.conn.execute("SELECT path, size, mtime_ns, inode FROM files")}
+
+    def load_states(self) -> dict:
+        """path -> (size, mtime_ns, inode, hash)"""
+        return {r[0]: tuple(r[1:]) for r in self.conn.execute("SELECT path, size, mtime_ns, inode, hash FROM files")}
+
+    def load_hashes(self) -> dict:
+        return {r[0]: r[1] for r in self.conn.execute("SELECT path, hash FROM files WHERE hash IS NOT NULL")}
+
+    def update(self, entries: list):
+        """entries: [(path, size, mtime_ns, inode, hash)]"""
+        if not entries: return
+        self.conn.executemany("INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?)", entries)
+        self.conn.commit()
+
+    def remove(self, paths):
+        paths = list(paths)
+        if not paths: return
+        self.conn.executemany("DELETE FROM files WHERE path = ?", ((p,) for p in paths))
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM files")
+        self.conn.commit()
+
+    def needs_deep_verify(self, interval_days: int) -> bool:
+        """从未校验过，或距上次深度校验超过 interval_days 天 (0 表示不启用周期校验)"""
+        last = self.get_meta("last_deep_verify")
+        if last is None: return True
+        if not interval_days or interval_days <= 0: return False
+        return time.time() - float(last) >= interval_days * 86400
+
+    def mark_deep_verified(self):
+        self.set_meta("last_deep_verify", time.time())
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
+
+def state_of(rel_path: str, st: os.stat_result, file_hash: str = None) -> tuple:
+    return (rel_path, st.st_size, st.st_mtime_ns, st.st_ino, file_hash)
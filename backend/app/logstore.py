@@ -0,0 +1,189 @@
+import os
+import io
+import json
+import gzip
+import time
+import bisect
+import threading
+import contextlib
+import collections
+
+# 任务日志存储: 每次运行一个追加写入的日志文件 (/data/logs/<history_id>.log)，
+# 任务结束后压缩为 .log.gz。数据库的 log_message 只保存 "开头 + 末尾" 摘要，
+# 完整日志通过 read_log 按偏移量增量读取。
+# .log.gz 由每 MEMBER_SIZE 字节一个的独立 gzip 成员拼接而成 (仍是标准 gzip 文件)，
+# 旁路索引 .log.gz.idx 记录各成员的 (原始偏移, 压缩偏移)，分页读取时从最近的成员开始解压，不必从头解压。
+LOG_DIR = os.getenv("LOG_DIR", "/data/logs")
+HEAD_CHARS = 2048
+TAIL_LINES = 200
+FLUSH_INTERVAL = 0.5
+READ_LIMIT = 256 * 1024
+MEMBER_SIZE = 4 * 1024 * 1024
+
+
+def log_path(history_id: int, compressed: bool = False) -> str:
+    return os.path.join(LOG_DIR, f"{history_id}.log" + (".gz" if compressed else ""))
+
+def index_path(history_id: int) -> str:
+    return log_path(history_id, True) + ".idx"
+
+def _compress(src: str, dst: str, idx: str):
+    """压缩为独立 gzip 成员并写入成员索引; 先写索引，读取方看到新的 .gz 时索引已就绪"""
+    points, raw = [], 0
+    with open(src, "rb") as f_in, open(dst + ".tmp", "wb") as f_out:
+        while data := f_in.read(MEMBER_SIZE):
+            points.append([raw, f_out.tell()])
+            f_out.write(gzip.compress(data, compresslevel=6))
+            raw += len(data)
+    with open(idx + ".tmp", "w") as f: json.dump({"size": raw, "members": points}, f)
+    os.replace(idx + ".tmp", idx)
+    os.replace(dst + ".tmp", dst)
+
+def _member_at(history_id: int, offset: int) -> tuple:
+    """返回 offset 所在 gzip 成员的 (原始偏移, 压缩偏移); 没有索引 (旧日志为单个 gzip 流) 时从头读取"""
+    try:
+        with open(index_path(history_id)) as f: points = json.load(f)["members"]
+    except (OSError, ValueError, KeyError): return 0, 0
+    i = bisect.bisect_right([p[0] for p in points], offset) - 1
+    return tuple(points[i]) if i >= 0 else (0, 0)
+
+
+class RunLog(io.TextIOBase):
+    """
+    线程安全的追加式日志，写入接口与原先的 io.StringIO 用法一致。
+    attach() 之前写入的内容暂存在内存，绑定历史记录后写入磁盘。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._file = None
+        self._head = []
+        self._head_len = 0
+        self._tail = collections.deque(maxlen=TAIL_LINES)
+        self._partial = ""
+        self._lines = 0
+        self._last_flush = time.monotonic()
+        self._offset = 0
+        self._unpublished = []
+        self._on_flush = None
+        self.history_id = None
+
+    def writable(self):
+        return True
+
+    def write(self, s: str) -> int:
+        if not s: return 0
+        with self._lock:
+            if self._head_len < HEAD_CHARS:
+                self._head.append(s[:HEAD_CHARS - self._head_len])
+                self._head_len += len(self._head[-1])
+            lines = (self._partial + s).split("\n")
+            self._partial = lines.pop()
+            self._tail.extend(lines)
+            self._lines += len(lines)
+            if self._file:
+                self._file.write(s)
+                if self._on_flush: self._unpublished.append(s)
+                if time.monotonic() - self._last_flush >= FLUSH_INTERVAL: self._flush_locked()
+            else:
+                self._pending.append(s)
+        return len(s)
+
+    def _flush_locked(self):
+        if self._file:
+            self._file.flush()
+            self._last_flush = time.monotonic()
+        if self._unpublished:
+            text = "".join(self._unpublished)
+            self._unpublished = []
+            start = self._offset
+            self._offset += len(text.encode("utf-8"))
+            try: self._on_flush(self.history_id, text, start, self._offset)
+            except Exception as e: print(f"Log publish error: {e}")
+
+    def flush(self):
+        with self._lock: self._flush_locked()
+
+    def attach(self, history_id: int, on_flush=None):
+        """on_flush(history_id, text, offset, next_offset): 每次刷盘后回调新增内容 (offset 为字节偏移)"""
+        os.makedirs(LOG_DIR, exist_ok=True)
+        with self._lock:
+            self.history_id = history_id
+            self._on_flush = on_flush
+            path = log_path(history_id)
+            self._offset = os.path.getsize(path) if os.path.exists(path) else 0
+            self._file = open(path, "a", encoding="utf-8")
+            for s in self._pending: self._file.write(s)
+            if on_flush: self._unpublished.extend(self._pending)
+            self._pending = []
+            self._flush_locked()
+
+    def tail(self) -> str:
+        """数据库 log_message 使用的有界摘要: 开头 (任务头信息) + 最近 TAIL_LINES 行"""
+        with self._lock:
+            self._flush_locked()
+            body = "\n".join(list(self._tail) + [self._partial])
+            # 行数未超出末尾窗口时摘要即完整日志
+            if self._lines <= TAIL_LINES: return body
+            head = "".join(self._head)
+            head = head[:head.rfind("\n") + 1]
+            return f"{head}......\n{body}"
+
+    def finish(self):
+        """关闭并压缩日志文件"""
+        with self._lock:
+            if not self._file: return
+            self._flush_locked()
+            self._file.close()
+            self._file = None
+        src = log_path(self.history_id)
+        try:
+            # 先生成完整的 .gz 再删除原文件，读取方任何时刻都能看到完整日志
+            _compress(src, log_path(self.history_id, True), index_path(self.history_id))
+            os.remove(src)
+        except OSError as e:
+            print(f"Log compress error: {e}")
+
+def close_orphan_log(history_id: int, message: str):
+    """进程重启后收尾未完成任务的日志: 追加说明并压缩"""
+    if not os.path.exists(log_path(history_id)): return
+    log = RunLog()
+    log.attach(history_id)
+    log.write(f"\n[ERROR] {message}\n")
+    log.finish()
+
+def read_log(history_id: int, offset: int = 0, limit: int = READ_LIMIT):
+    """
+    从字节偏移 offset 开始读取日志，只返回完整行。
+    返回 None 表示没有对应的日志文件 (旧版本记录)。
+    """
+    try:
+        f, finished, base = open(log_path(history_id), "rb"), False, 0
+    except FileNotFoundError:
+        try: f, finished = open(log_path(history_id, True), "rb"), True
+        except FileNotFoundError: return None
+        base, start = _member_at(history_id, offset)
+        f.seek(start)
+    with f, (gzip.GzipFile(fileobj=f) if finished else contextlib.nullcontext(f)) as reader:
+        reader.seek(offset - base)
+        data = reader.read(limit + 1)
+    more = len(data) > limit
+    data = data[:limit]
+    if more or not finished:
+        # 未读完时只返回完整行; 单行超过 limit 时整段返回
+        cut = data.rfind(b"\n")
+        if cut >= 0: data = data[:cut + 1]
+        elif not more: data = b""
+    return {
+        "text": data.decode("utf-8", errors="replace"),
+        "next_offset": offset + len(data),
+        "finished": finished and not more,
+    }
+
+def delete_logs(history_ids):
+    for hid in history_ids:
+        for p in (log_path(hid), log_path(hid, True), index_path(hid)):
+            if os.path.exists(p):
+                try: os.remove(p)
+                except OSError: pass
@@ -5,7 +5,9 @@ from .database import engine, Base, SessionLocal
 from .models import BackupProject, BackupSchedule, BackupHistory
 from .scheduler import start_scheduler, shutdown_scheduler
 from .schema_check import ensure_schema_updates
-from . import api
+from .logstore import close_orphan_log
+from . import api, notify, watcher
+from .dbwriter import writer
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -25,6 +27,7 @@ async def lifespan(app: FastAPI):
             for task in zombies:
                 task.status = "failed"
                 task.log_message = "系统重启，任务意外中断"
+                close_orphan_log(task.id, task.log_message)
             db.commit()
     except Exception as e:
         print(f"Error cleaning zombies: {e}")
@@ -33,9 +36,18 @@ async def lifespan(app: FastAPI):
 
     # Startup: 2. Start the scheduler
     start_scheduler()
+
+    # Startup: 3. Start source watchers (projects with watch_source)
+    db = SessionLocal()
+    try: watcher.service.start_all(db.query(BackupProject).filter(BackupProject.watch_source == True).all())
+    except Exception as e: print(f"Error starting source watchers: {e}")
+    finally: db.close()
     yield
     # Shutdown: Stop the scheduler
     shutdown_scheduler()
+    watcher.service.shutdown()
+    writer.shutdown()
+    notify.notifier.shutdown()
 
 app = FastAPI(title="Backup System API", version="1.0.0", lifespan=lifespan)
 
@@ -0,0 +1,26 @@
+import re
+import fnmatch
+
+GLOB_CHARS = set("*?[")
+
+
+class ExcludeMatcher:
+    """
+    将排除规则一次性编译为: 纯文本名称集合 + 一个合并的正则。
+    语义与逐条 fnmatch 相同: 规则命中文件/目录名，或命中相对路径，即视为排除。
+    """
+
+    def __init__(self, patterns: list):
+        self.patterns = [p for p in patterns if p]
+        self.literals = {p for p in self.patterns if not GLOB_CHARS & set(p)}
+        globs = [p for p in self.patterns if GLOB_CHARS & set(p)]
+        self.regex = re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in globs)) if globs else None
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def matches(self, name: str, rel_path: str) -> bool:
+        if name in self.literals or rel_path in self.literals: return True
+        if self.regex is None: return False
+        match = self.regex.match
+        return match(name) is not None or match(rel_path) is not None
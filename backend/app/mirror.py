@@ -0,0 +1,177 @@
+import os
+import shutil
+import hashlib
+import concurrent.futures
+
+from .file_index import state_of
+
+# 镜像同步: 对比源清单与目标端状态，只执行差异操作，不再清空目标目录后全量复制。
+#   - 目标端状态优先使用文件索引 (上次镜像完成时的状态)，深度校验或首次镜像时遍历目标目录
+#   - 新增/修改: 用 sync_threads 线程池复制
+#   - 重命名: 源端新增与目标端待删除的文件大小相同且内容哈希一致时，在目标端直接改名，不重新上传
+#   - 删除: 复制完成后再删除源端已不存在的文件，中途失败不会丢失数据
+CATEGORIES = (("added", "新增"), ("modified", "修改"), ("renamed", "重命名"), ("deleted", "删除"), ("unchanged", "未变化"))
+HASH_BUFFER = 1024 * 1024
+
+
+def scan_destination(dest: str) -> dict:
+    """遍历目标目录: 相对路径 -> (size, mtime_ns, None, None)"""
+    result, stack = {}, [""]
+    while stack:
+        rel_root = stack.pop()
+        try:
+            with os.scandir(os.path.join(dest, rel_root) if rel_root else dest) as it: entries = list(it)
+        except OSError: continue
+        for entry in entries:
+            rel_path = f"{rel_root}/{entry.name}" if rel_root else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False): stack.append(rel_path)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    result[rel_path] = (st.st_size, st.st_mtime_ns, None, None)
+            except OSError: continue
+    return result
+
+def file_hash(path: str, throttle=None) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while buf := f.read(HASH_BUFFER):
+            if throttle: throttle.on_read(len(buf))
+            h.update(buf)
+    return h.hexdigest()
+
+
+class MirrorPlan:
+    def __init__(self):
+        self.added, self.modified = [], []     # [(相对路径, 源 stat)]
+        self.renamed = []                      # [(旧路径, 新路径, 源 stat, hash)]
+        self.deleted = []                      # [(相对路径, 大小)]
+        self.unchanged = []                    # [源端状态]
+
+    def stats(self) -> dict:
+        return {
+            "added": [len(self.added), sum(s.st_size for _, s in self.added)],
+            "modified": [len(self.modified), sum(s.st_size for _, s in self.modified)],
+            "renamed": [len(self.renamed), sum(r[2].st_size for r in self.renamed)],
+            "deleted": [len(self.deleted), sum(size for _, size in self.deleted)],
+            "unchanged": [len(self.unchanged), sum(s[1] for s in self.unchanged)],
+        }
+
+
+def plan_mirror(source: str, dest: str, include_list: list, dest_state: dict, from_index: bool, throttle=None, check_stop=None) -> MirrorPlan:
+    """dest_state: 相对路径 -> (size, mtime_ns, inode, hash)，来自文件索引 (from_index) 或目标目录遍历"""
+    plan, added = MirrorPlan(), []
+    for rp in include_list:
+        if check_stop: check_stop()
+        try: st = os.stat(os.path.join(source, rp))
+        except OSError: continue
+        old = dest_state.get(rp)
+        if old is None: added.append((rp, st))
+        elif from_index and old[:3] == (st.st_size, st.st_mtime_ns, st.st_ino): plan.unchanged.append(state_of(rp, st, old[3]))
+        # 目标端遍历: 与增量模式相同，大小一致且目标端不旧于源端视为未变化
+        elif not from_index and old[0] == st.st_size and st.st_mtime_ns // 1_000_000_000 <= old[1] // 1_000_000_000: plan.unchanged.append(state_of(rp, st))
+        else: plan.modified.append((rp, st))
+    sources = set(include_list)
+    gone = {rp: v for rp, v in dest_state.items() if rp not in sources}
+    # 重命名检测: 按大小配对，哈希一致才认定为同一文件 (空文件不配对)
+    by_size = {}
+    for rp, v in gone.items():
+        if v[0]: by_size.setdefault(v[0], []).append(rp)
+    for rp, st in added:
+        candidates = by_size.get(st.st_size)
+        if not candidates:
+            plan.added.append((rp, st))
+            continue
+        if check_stop: check_stop()
+        src_hash = file_hash(os.path.join(source, rp), throttle)
+        match = None
+        for old in candidates:
+            old_hash = gone[old][3]
+            if old_hash is None:
+                try: old_hash = file_hash(os.path.join(dest, old), throttle)
+                except OSError: continue
+                gone[old] = gone[old][:3] + (old_hash,)
+            if old_hash == src_hash:
+                match = old
+                break
+        if match:
+            candidates.remove(match)
+            del gone[match]
+            plan.renamed.append((match, rp, st, src_hash))
+        else:
+            plan.added.append((rp, st))
+    plan.deleted = sorted((rp, v[0]) for rp, v in gone.items())
+    return plan
+
+
+def _ancestors(rel_path: str):
+    parent = os.path.dirname(rel_path)
+    while parent:
+        yield parent
+        parent = os.path.dirname(parent)
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path): shutil.rmtree(path)
+    else: os.remove(path)
+
+def apply_mirror(plan: MirrorPlan, source: str, dest: str, threads: int, throttle, log_buffer, done: list, totals: dict, on_file=None, check_stop=None):
+    """执行镜像计划; 已写入目标端的文件状态追加到 done，已完成的操作计入 totals (任务中断时也可用于更新索引与统计)"""
+    # 目标端同名文件挡住了新目录时先删除该文件
+    new_dirs = {d for rp, _ in plan.added + plan.modified for d in _ancestors(rp)} | {d for r in plan.renamed for d in _ancestors(r[1])}
+    blocking = [rp for rp, _ in plan.deleted if rp in new_dirs]
+    for rp in blocking:
+        os.remove(os.path.join(dest, rp))
+        totals["files_deleted"] += 1
+        log_buffer.write(f"[DEL]  {rp}\n")
+    for old, new, st, digest in plan.renamed:
+        if check_stop: check_stop()
+        dst = os.path.join(dest, new)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(os.path.join(dest, old), dst)
+        try: shutil.copystat(os.path.join(source, new), dst)
+        except OSError: pass
+        log_buffer.write(f"[MOVE] {old} -> {new}\n")
+        done.append(state_of(new, st, digest))
+        totals["files_renamed"] += 1
+        if on_file: on_file()
+
+    def copy(item):
+        rp, st = item
+        if check_stop: check_stop()
+        dst = os.path.join(dest, rp)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        # 目标端同名目录 (源端目录变为文件)
+        if os.path.isdir(dst) and not os.path.islink(dst): shutil.rmtree(dst)
+        throttle.copy_file(os.path.join(source, rp), dst, st.st_size)
+        log_buffer.write(f"[SYNC] {rp}\n")
+        return state_of(rp, st)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads or 2) as ex:
+        try:
+            for i, state in enumerate(ex.map(copy, plan.added + plan.modified)):
+                done.append(state)
+                totals["files_added" if i < len(plan.added) else "files_updated"] += 1
+                totals["bytes_copied"] += state[1]
+                if on_file: on_file()
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+
+    parents = set()
+    for rp, _ in plan.deleted:
+        if rp in blocking: continue
+        if check_stop: check_stop()
+        # 已随同名目录一起删除 (源端目录变为文件)
+        try: _remove(os.path.join(dest, rp))
+        except (FileNotFoundError, NotADirectoryError): pass
+        totals["files_deleted"] += 1
+        log_buffer.write(f"[DEL]  {rp}\n")
+        parents.update(_ancestors(rp))
+    # 清理删除后变空的目录 (由深到浅)
+    for d in sorted(parents, key=lambda p: p.count("/"), reverse=True):
+        try: os.rmdir(os.path.join(dest, d))
+        except OSError: pass
+
+
+def format_stats(stats: dict) -> str:
+    return "，".join(f"{label} {stats[key][0]} 个 ({stats[key][1]} bytes)" for key, label in CATEGORIES)
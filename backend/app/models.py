@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -17,15 +17,28 @@ class BackupProject(Base):
     
     # Settings
     encryption_password = Column(String, nullable=True) # Stored in plaintext for MVP, suggest OS keychain for prod
-    archive_format = Column(String, default="tgz") # 'tar', 'tgz', '7z'
+    archive_format = Column(String, default="tgz") # 'tar', 'tgz', '7z', 'sync', 'dedup', 'snapshot'
     use_compression = Column(Boolean, default=True) # Legacy, keeping for compatibility
     compression_level = Column(Integer, default=1) # 1-9
+    compress_threads = Column(Integer, default=2) # Parallel gzip workers for tgz
     exclude_patterns = Column(String, nullable=True) # e.g. "*.tmp, node_modules"
     sync_threads = Column(Integer, default=2)
-    sync_mode = Column(String, default="overwrite") # 'overwrite' or 'incremental'
+    volume_size_mb = Column(Integer, default=0) # Split archive into volumes of N MB, 0 = single file
+    upload_threads = Column(Integer, default=1) # Parallel segment writers for cloud upload
+    read_limit_mb = Column(Integer, default=0) # Read bandwidth limit MB/s, 0 = unlimited
+    write_limit_mb = Column(Integer, default=0) # Write bandwidth limit MB/s, 0 = unlimited
+    throttle_schedule = Column(Text, nullable=True) # JSON time-of-day windows overriding the limits
+    pipeline_mode = Column(String, default="staged") # 'staged' (cache -> encrypt -> move) or 'stream' (direct to destination)
+    sync_mode = Column(String, default="overwrite") # 'overwrite', 'mirror' or 'incremental'
+    sync_verify_days = Column(Integer, default=0) # Periodic deep verify against destination, 0 = off
+    watch_source = Column(Boolean, default=False) # Track source changes (inotify journal) so scans only revisit changed dirs
     
     # Retention Policy
-    keep_versions = Column(Integer, default=7) # Number of backups to keep
+    keep_versions = Column(Integer, default=7) # Number of most recent backups to keep
+    keep_hourly = Column(Integer, default=0) # GFS: keep the last backup of each of the N most recent hours, 0 = off
+    keep_daily = Column(Integer, default=0) # GFS: ... days
+    keep_weekly = Column(Integer, default=0) # GFS: ... weeks
+    keep_monthly = Column(Integer, default=0) # GFS: ... months
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -63,6 +76,7 @@ class BackupHistory(Base):
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     
+    task_type = Column(String, default="backup") # 'backup' or 'restore'
     status = Column(String, nullable=False) # 'success', 'failed', 'running'
     progress = Column(Integer, default=0)
     
@@ -71,12 +85,26 @@ class BackupHistory(Base):
     
     file_size_bytes = Column(Integer, default=0)
     file_name = Column(String, nullable=True) # The actual file created (zip/tar.gz)
+
+    # Sync transfer statistics (NULL for archive backups and restores)
+    bytes_copied = Column(Integer, nullable=True)
+    bytes_skipped = Column(Integer, nullable=True)
+    files_added = Column(Integer, nullable=True)
+    files_updated = Column(Integer, nullable=True)
+    files_renamed = Column(Integer, nullable=True)
+    files_deleted = Column(Integer, nullable=True)
+    files_skipped = Column(Integer, nullable=True)
     
     remark = Column(Text, nullable=True) # User provided note
     log_message = Column(Text, nullable=True) # Error details or success summary
     
     project = relationship("BackupProject", back_populates="history")
 
+    __table_args__ = (
+        Index("ix_history_project_start", "project_id", "start_time"), # 最近一次运行查询
+        Index("ix_history_project_status_start", "project_id", "status", "start_time"), # 保留策略 (retention.py)
+    )
+
 
 class SystemSetting(Base):
     __tablename__ = "settings"
@@ -0,0 +1,135 @@
+import time
+import queue
+import threading
+import requests
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+from .config_loader import load_settings, subscribe
+
+# 通知: 任务线程只把消息放入有界队列，由后台线程发送，不阻塞任务结束。
+#   - Telegram 客户端常驻 (保持连接)，代理只作用于该客户端的会话，不修改进程环境变量
+#   - 短时间内的多条消息合并为一条汇总: 收到消息后等待 QUIET_SECONDS 无新消息 (最长 MAX_DELAY) 再发送
+#   - 队列已满时丢弃新消息，并在下一条汇总中注明丢弃数量
+NOTIFY_KEYS = ("http_proxy", "telegram_bot_token", "telegram_chat_id", "proxy_enabled_for_telegram")
+QUEUE_SIZE = 200
+QUIET_SECONDS = 10
+MAX_DELAY = 60
+MESSAGE_LIMIT = 4000   # Telegram 单条消息上限 4096 字符
+SEND_RETRIES = 3
+
+
+class TelegramClient:
+    def __init__(self, token: str, chat_id: str, proxy: str = None):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.session = requests.Session()
+        self.session.trust_env = False
+        if proxy: self.session.proxies = {"http": proxy, "https": proxy}
+
+    @retry(stop=stop_after_attempt(SEND_RETRIES), wait=wait_exponential(multiplier=2, min=2, max=30),
+           retry=retry_if_exception_type(requests.RequestException), reraise=True)
+    def send(self, title: str, body: str):
+        text = f"{title}\n{body}" if body else title
+        r = self.session.post(self.url, json={"chat_id": self.chat_id, "text": text[:MESSAGE_LIMIT]}, timeout=(10, 30))
+        if r.status_code >= 500 or r.status_code == 429: raise requests.RequestException(f"Telegram 返回 {r.status_code}")
+        if not r.ok: raise Exception(f"Telegram 返回 {r.status_code}: {r.text[:200]}")
+
+    def close(self):
+        self.session.close()
+
+
+def build_digest(messages: list, dropped: int = 0) -> tuple:
+    """把多条 (标题, 正文) 合并为一条，按标题分组，组内每条正文压成一行"""
+    if len(messages) == 1 and not dropped: return messages[0]
+    groups = {}
+    for title, body in messages: groups.setdefault(title, []).append(body)
+    lines = []
+    for title, bodies in groups.items():
+        lines.append(f"{title} × {len(bodies)}" if len(bodies) > 1 else title)
+        lines += [f"  • {'，'.join(l for l in (b or '').splitlines() if l)}" for b in bodies]
+    if dropped: lines.append(f"(通知过多，另有 {dropped} 条未发送)")
+    body = "\n".join(lines)
+    if len(body) > MESSAGE_LIMIT: body = body[:MESSAGE_LIMIT - 20].rsplit("\n", 1)[0] + "\n..."
+    return f"📋 通知汇总 ({len(messages) + dropped} 条)", body
+
+
+class Notifier:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.client, self.client_stale = None, True
+        self.thread = None
+        self.dropped = 0
+        self.quiet = QUIET_SECONDS
+
+    def _client(self):
+        with self.lock:
+            if self.client_stale:
+                if self.client: self.client.close()
+                config = load_settings()
+                token, chat_id = config.get("telegram_bot_token"), config.get("telegram_chat_id")
+                proxy = config.get("http_proxy") if config.get("proxy_enabled_for_telegram") == 'true' else None
+                self.client = TelegramClient(token, chat_id, proxy) if token and chat_id else None
+                self.client_stale = False
+            return self.client
+
+    def invalidate(self, changed: dict = None):
+        with self.lock: self.client_stale = True
+
+    def _start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive(): return
+            self.thread = threading.Thread(target=self._loop, name="notifier", daemon=True)
+            self.thread.start()
+
+    def notify(self, title: str, body: str = ""):
+        """放入发送队列后立即返回"""
+        self._start()
+        try: self.queue.put_nowait((title, body))
+        except queue.Full:
+            with self.lock: self.dropped += 1
+
+    def send_now(self, title: str, body: str = ""):
+        """同步发送 (测试通知)，失败时抛出异常"""
+        client = self._client()
+        if not client: raise Exception("未配置 Telegram Bot Token 或 Chat ID")
+        client.send(title, body)
+
+    def _collect(self, first) -> list:
+        batch, started = [first], time.monotonic()
+        while True:
+            timeout = min(self.quiet, MAX_DELAY - (time.monotonic() - started))
+            if timeout <= 0: return batch
+            try: item = self.queue.get(timeout=timeout)
+            except queue.Empty: return batch
+            if item is None:
+                self.queue.put(None)  # 留给主循环退出
+                return batch
+            batch.append(item)
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None: return
+            batch = self._collect(item)
+            with self.lock: dropped, self.dropped = self.dropped, 0
+            try:
+                client = self._client()
+                if client: client.send(*build_digest(batch, dropped))
+            except Exception as e:
+                print(f"Notification Error: {e}")
+
+    def shutdown(self, timeout: float = 5):
+        """发送队列中剩余的消息后退出 (不再等待合并窗口)"""
+        if not (self.thread and self.thread.is_alive()): return
+        self.quiet = 0
+        try: self.queue.put(None, timeout=timeout)
+        except queue.Full: return
+        self.thread.join(timeout)
+
+
+notifier = Notifier()
+subscribe(notifier.invalidate, NOTIFY_KEYS)
+
+def notify(title: str, body: str = ""):
+    notifier.notify(title, body)
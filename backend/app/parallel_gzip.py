@@ -0,0 +1,101 @@
+import io
+import zlib
+import struct
+import time
+import collections
+import concurrent.futures
+
+# pigz 风格的多线程 gzip 压缩
+# 输入按固定大小分块，各块在线程池中独立 deflate (以上一块末尾 32 KB 作为预置字典)，
+# 块间以 Z_SYNC_FLUSH 对齐字节边界后按顺序拼接，最终得到一个标准的单成员 gzip 流，
+# tar xzf / tarfile "r:gz" 均可直接读取。zlib 压缩时会释放 GIL，线程即可并行。
+# restart_interval > 0 时每隔 N 块不使用预置字典 (重启点)，并记录重启点的 (原始偏移, 压缩偏移)，
+# 读取方可从任一重启点开始 raw inflate，实现按偏移随机读取。
+
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024
+
+
+def _compress_block(data: bytes, level: int, zdict: bytes, last: bool) -> bytes:
+    if zdict: c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else: c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """可写文件对象，输出标准 gzip 流到 fileobj"""
+
+    def __init__(self, fileobj, level: int = 6, threads: int = 2, block_size: int = BLOCK_SIZE, restart_interval: int = 0):
+        self.fileobj = fileobj
+        self.restart_interval = restart_interval
+        self.restart_points = []  # [(原始偏移, gzip 流内压缩偏移)]
+        self.block_count = 0
+        self.raw_offset = 0
+        self.out_offset = 0
+        self.level = level
+        self.block_size = block_size
+        self.threads = max(1, threads or 1)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.crc = 0
+        self.size = 0
+        self.prev_tail = b""
+        self._finished = False
+        self._write_header()
+
+    def _write_header(self):
+        # magic, CM=deflate, FLG=0, MTIME, XFL=0, OS=unix
+        self._out(b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time())) + b"\x00\x03")
+
+    def _out(self, data: bytes):
+        self.fileobj.write(data)
+        self.out_offset += len(data)
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        if self._finished: raise ValueError("write to closed ParallelGzipWriter")
+        data = bytes(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]), last=False)
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block: bytes, last: bool):
+        restart = self.restart_interval > 0 and self.block_count % self.restart_interval == 0
+        zdict = b"" if restart else self.prev_tail
+        self.pending.append((self.pool.submit(_compress_block, block, self.level, zdict, last), self.raw_offset if restart else None))
+        self.prev_tail = block[-DICT_SIZE:]
+        self.block_count += 1
+        self.raw_offset += len(block)
+        # 控制在途块数量，限制内存占用并保持输出顺序
+        while len(self.pending) > self.threads * 2:
+            self._write_next()
+
+    def _write_next(self):
+        fut, restart_at = self.pending.popleft()
+        data = fut.result()
+        if restart_at is not None: self.restart_points.append((restart_at, self.out_offset))
+        self._out(data)
+
+    def _drain(self):
+        while self.pending:
+            self._write_next()
+
+    def close(self):
+        if self._finished: return
+        try:
+            self._submit(bytes(self.buffer), last=True)
+            self.buffer = bytearray()
+            self._drain()
+            self._out(struct.pack("<II", self.crc & 0xFFFFFFFF, self.size & 0xFFFFFFFF))
+            self.fileobj.flush()
+        finally:
+            self._finished = True
+            self.pool.shutdown(wait=True)
+            super().close()
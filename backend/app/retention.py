@@ -0,0 +1,142 @@
+import os
+import time
+import shutil
+
+from sqlalchemy import select, func
+
+from .models import BackupProject, BackupHistory
+from .database import SessionLocal
+from .logstore import delete_logs
+from . import dedup, snapshot, archive_index, catalog, notify
+
+# 版本保留策略 (祖父-父-子):
+#   - keep_versions: 最近 N 份
+#   - keep_hourly / keep_daily / keep_weekly / keep_monthly: 最近 N 个小时/天/周/月，每个时间段保留最后一份
+#   任一规则命中即保留，全部为 0 时不清理。只统计成功的备份记录 (还原记录不算版本)。
+# 备份完成后由调度器排入低优先级的清理任务，按批删除，批次之间暂停，释放目标盘给其他任务。
+# 时间段键 (SQL 表达式); 周按 ISO 周划分，以该周周一的日期为键 (跨年的一周不会被 %W 拆成两段)
+GFS_BUCKETS = (
+    ("keep_hourly", lambda t: func.strftime("%Y-%m-%d %H", t)),
+    ("keep_daily", lambda t: func.date(t)),
+    ("keep_weekly", lambda t: func.date(t, "weekday 0", "-6 days")),
+    ("keep_monthly", lambda t: func.strftime("%Y-%m", t)),
+)
+PRUNE_BATCH = 20
+PRUNE_PAUSE = 0.5
+
+
+def enabled(project) -> bool:
+    return any((getattr(project, key, 0) or 0) > 0 for key in ("keep_versions",) + tuple(k for k, _ in GFS_BUCKETS))
+
+def describe(project) -> str:
+    labels = (("keep_versions", "最近 {} 份"), ("keep_hourly", "{} 小时"), ("keep_daily", "{} 天"), ("keep_weekly", "{} 周"), ("keep_monthly", "{} 个月"))
+    return ", ".join(fmt.format(getattr(project, key)) for key, fmt in labels if (getattr(project, key, 0) or 0) > 0)
+
+def _versions(project_id: int) -> tuple:
+    # 条件列与索引 ix_history_project_status_start (project_id, status, start_time) 对应
+    H = BackupHistory
+    return (H.project_id == project_id, H.status == "success", func.coalesce(H.task_type, "backup") == "backup")
+
+def keep_ids(db, project) -> set:
+    H = BackupHistory
+    where = _versions(project.id)
+    keep = set()
+    if (project.keep_versions or 0) > 0:
+        keep.update(db.scalars(select(H.id).where(*where).order_by(H.start_time.desc()).limit(project.keep_versions)))
+    for key, bucket in GFS_BUCKETS:
+        count = getattr(project, key, 0) or 0
+        if count <= 0: continue
+        # 每个时间段内最新的一份，取最近 count 个有备份的时间段
+        rn = func.row_number().over(partition_by=bucket(H.start_time), order_by=(H.start_time.desc(), H.id.desc())).label("rn")
+        sub = select(H.id, H.start_time, rn).where(*where).subquery()
+        keep.update(db.scalars(select(sub.c.id).where(sub.c.rn == 1).order_by(sub.c.start_time.desc()).limit(count)))
+    return keep
+
+def _tree_size(path: str, unique: bool = False) -> int:
+    """目录占用; unique 时只计链接数为 1 的文件 (删除硬链接快照实际释放的空间)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+                if not unique or st.st_nlink == 1: total += st.st_size
+            except OSError: pass
+    return total
+
+def delete_version(project, file_name: str) -> int:
+    """删除一个归档/分卷/硬链接快照，返回释放的字节数; 失败时抛出异常 (去重快照由调用方按批处理)"""
+    path = os.path.join(project.destination_path, file_name)
+    if file_name.endswith(snapshot.SNAP_EXT):
+        # 硬链接快照: 删除只减少链接计数，其他快照中的同一文件不受影响
+        freed = _tree_size(path, unique=True)
+        snapshot.delete_snapshot(path)
+        return freed
+    archive_index.remove_index(path)
+    if os.path.isdir(path):
+        freed = _tree_size(path)
+        shutil.rmtree(path)
+        return freed
+    if not os.path.exists(path): return 0
+    freed = os.path.getsize(path)
+    os.remove(path)
+    return freed
+
+def prune(db, project, check_stop=None, batch: int = PRUNE_BATCH, pause: float = PRUNE_PAUSE) -> dict:
+    """按保留策略分批删除旧版本; 删除失败的版本保留记录，下次清理时重试"""
+    result = {"deleted": 0, "failed": 0, "freed": 0}
+    if not enabled(project): return result
+    H = BackupHistory
+    skip = keep_ids(db, project)
+    while True:
+        if check_stop: check_stop()
+        rows = db.execute(select(H.id, H.file_name).where(*_versions(project.id), H.id.notin_(skip)).order_by(H.start_time).limit(batch)).all()
+        if not rows: break
+        done, snapshots = [], []
+        for hid, file_name in rows:
+            if file_name and file_name.endswith(dedup.SNAPSHOT_EXT):
+                snapshots.append((hid, file_name))
+                continue
+            try:
+                if file_name: result["freed"] += delete_version(project, file_name)
+                done.append(hid)
+            except OSError as e:
+                print(f"[ERROR] 项目 {project.name} 清理 {file_name} 失败: {e}")
+                skip.add(hid)
+                result["failed"] += 1
+        if snapshots:
+            # 去重仓库: 删除一批快照索引后统一回收无引用的数据块
+            try:
+                result["freed"] += dedup.delete_snapshots(dedup.repo_path_for(project), [n for _, n in snapshots], project.encryption_password)[1]
+                done += [hid for hid, _ in snapshots]
+            except Exception as e:
+                print(f"[ERROR] 项目 {project.name} 去重仓库清理失败: {e}")
+                skip.update(hid for hid, _ in snapshots)
+                result["failed"] += len(snapshots)
+        if done:
+            db.query(H).filter(H.id.in_(done)).delete(synchronize_session=False)
+            db.commit()
+            delete_logs(done)
+            try: catalog.delete_versions(project.id, done)
+            except Exception as e: print(f"[WARN] 项目 {project.name} 文件目录清理失败: {e}")
+            result["deleted"] += len(done)
+        if len(rows) < batch: break
+        time.sleep(pause)
+    return result
+
+def run_prune_task(project_id: int):
+    """调度器任务入口"""
+    from .engine import check_stop, stop_signals
+    db = SessionLocal()
+    try:
+        project = db.query(BackupProject).filter(BackupProject.id == project_id).first()
+        if not project: return
+        started = time.monotonic()
+        result = prune(db, project, lambda: check_stop(project_id))
+        if not result["deleted"] and not result["failed"]: return
+        summary = f"删除 {result['deleted']} 个旧版本，释放 {result['freed']} bytes"
+        if result["failed"]: summary += f"，{result['failed']} 个删除失败 (下次清理时重试)"
+        print(f"[INFO] 项目 {project.name} 清理完成 ({time.monotonic() - started:.1f}s): {summary}")
+        notify.notify("🧹 清理旧版本" if not result["failed"] else "⚠️ 清理旧版本", f"项目: {project.name}\n保留策略: {describe(project)}\n{summary}")
+    finally:
+        stop_signals.pop(project_id, None)
+        db.close()
@@ -1,15 +1,18 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
-from .database import SQLALCHEMY_DATABASE_URL
+from .database import engine
+from .dispatcher import dispatcher, run_scheduled_backup, DEFAULT_LIMITS
+from .config_loader import subscribe
 
-# Configure job store to use our existing SQLite database
+# Configure job store to use our existing SQLite database (共用引擎: 同一连接池与 WAL/busy_timeout 设置)
 jobstores = {
-    'default': SQLAlchemyJobStore(url=SQLALCHEMY_DATABASE_URL)
+    'default': SQLAlchemyJobStore(engine=engine)
 }
 
+# 定时任务只负责把备份放入调度队列 (dispatcher)，实际执行与并发控制由调度队列负责
 executors = {
-    'default': ThreadPoolExecutor(20)
+    'default': ThreadPoolExecutor(4)
 }
 
 job_defaults = {
@@ -19,12 +22,27 @@ job_defaults = {
 
 scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors, job_defaults=job_defaults)
 
+def migrate_legacy_jobs():
+    """旧版本保存的定时任务直接调用 engine.run_backup_task，改为经由调度队列执行"""
+    for job in scheduler.get_jobs():
+        if getattr(job.func, "__name__", None) == "run_backup_task":
+            scheduler.modify_job(job.id, func=run_scheduled_backup)
+
+def _on_settings(changed: dict):
+    dispatcher.wake()
+
 def start_scheduler():
+    subscribe(_on_settings, [f"dispatch_{key}" for key in DEFAULT_LIMITS])
+    dispatcher.start()
     if not scheduler.running:
-        scheduler.start()
+        scheduler.start(paused=True)
+        try: migrate_legacy_jobs()
+        except Exception as e: print(f"Job migration error: {e}")
+        scheduler.resume()
         print("APScheduler started.")
 
 def shutdown_scheduler():
     if scheduler.running:
         scheduler.shutdown()
         print("APScheduler shut down.")
+    dispatcher.shutdown()
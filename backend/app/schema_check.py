@@ -9,31 +9,63 @@ elif os.path.exists("/data/backup_system.db"):
 else:
     DB_PATH = "backup_system.db"
 
+# 新增字段: table -> [(column, DDL)]，启动时自动补齐
+COLUMN_MIGRATIONS = {
+    "projects": [
+        ("sync_mode", "TEXT DEFAULT 'overwrite'"),
+        ("sync_verify_days", "INTEGER DEFAULT 0"),
+        ("compress_threads", "INTEGER DEFAULT 2"),
+        ("pipeline_mode", "TEXT DEFAULT 'staged'"),
+        ("upload_threads", "INTEGER DEFAULT 1"),
+        ("volume_size_mb", "INTEGER DEFAULT 0"),
+        ("read_limit_mb", "INTEGER DEFAULT 0"),
+        ("write_limit_mb", "INTEGER DEFAULT 0"),
+        ("throttle_schedule", "TEXT"),
+        ("watch_source", "BOOLEAN DEFAULT 0"),
+        ("keep_hourly", "INTEGER DEFAULT 0"),
+        ("keep_daily", "INTEGER DEFAULT 0"),
+        ("keep_weekly", "INTEGER DEFAULT 0"),
+        ("keep_monthly", "INTEGER DEFAULT 0"),
+    ],
+    "history": [
+        ("progress", "INTEGER DEFAULT 0"),
+        ("remark", "TEXT"),
+        ("task_type", "TEXT DEFAULT 'backup'"),
+        ("bytes_copied", "INTEGER"),
+        ("bytes_skipped", "INTEGER"),
+        ("files_added", "INTEGER"),
+        ("files_updated", "INTEGER"),
+        ("files_renamed", "INTEGER"),
+        ("files_deleted", "INTEGER"),
+        ("files_skipped", "INTEGER"),
+    ],
+}
+
+# 新增索引: 已存在的表不会被 create_all 补建
+INDEX_MIGRATIONS = [
+    "CREATE INDEX IF NOT EXISTS ix_history_project_start ON history (project_id, start_time)",
+    "CREATE INDEX IF NOT EXISTS ix_history_project_status_start ON history (project_id, status, start_time)",
+]
+
 def ensure_schema_updates():
     if not os.path.exists(DB_PATH):
         return
 
     print(f"Checking database schema at {DB_PATH}...")
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
         cursor = conn.cursor()
-        
-        # 1. Check 'projects' table for 'sync_mode'
-        cursor.execute("PRAGMA table_info(projects)")
-        project_cols = [info[1] for info in cursor.fetchall()]
-        if "sync_mode" not in project_cols:
-            print("Auto-migrating: Adding 'sync_mode' to projects table.")
-            cursor.execute("ALTER TABLE projects ADD COLUMN sync_mode TEXT DEFAULT 'overwrite'")
-        
-        # 2. Check 'history' table for 'progress' and 'remark'
-        cursor.execute("PRAGMA table_info(history)")
-        history_cols = [info[1] for info in cursor.fetchall()]
-        if "progress" not in history_cols:
-            print("Auto-migrating: Adding 'progress' to history table.")
-            cursor.execute("ALTER TABLE history ADD COLUMN progress INTEGER DEFAULT 0")
-        if "remark" not in history_cols:
-            print("Auto-migrating: Adding 'remark' to history table.")
-            cursor.execute("ALTER TABLE history ADD COLUMN remark TEXT")
+
+        for table, columns in COLUMN_MIGRATIONS.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            existing = [info[1] for info in cursor.fetchall()]
+            for name, ddl in columns:
+                if name not in existing:
+                    print(f"Auto-migrating: Adding '{name}' to {table} table.")
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+        for ddl in INDEX_MIGRATIONS:
+            cursor.execute(ddl)
 
         conn.commit()
         conn.close()
@@ -5,11 +5,19 @@ from datetime import datetime
 # --- History Schemas ---
 class HistoryBase(BaseModel):
     status: str
+    task_type: Optional[str] = "backup"
     log_message: Optional[str] = None
     file_size_bytes: int = 0
     file_name: Optional[str] = None
     progress: int = 0
     remark: Optional[str] = None
+    bytes_copied: Optional[int] = None
+    bytes_skipped: Optional[int] = None
+    files_added: Optional[int] = None
+    files_updated: Optional[int] = None
+    files_renamed: Optional[int] = None
+    files_deleted: Optional[int] = None
+    files_skipped: Optional[int] = None
 
 class RunRequest(BaseModel):
     remark: Optional[str] = None
@@ -45,6 +53,7 @@ class Schedule(ScheduleBase):
 class RestoreRequest(BaseModel):
     file_name: str
     restore_mode: str = 'overwrite' # 'overwrite' or 'clean'
+    paths: Optional[List[str]] = None # 仅还原指定文件或目录 (相对路径)
 
 # --- Project Schemas ---
 class ProjectBase(BaseModel):
@@ -57,10 +66,23 @@ class ProjectBase(BaseModel):
     archive_format: str = "tgz"
     use_compression: bool = True
     compression_level: int = 1
+    compress_threads: int = 2
     exclude_patterns: Optional[str] = None
     sync_threads: int = 2
-    sync_mode: str = "overwrite" # 'overwrite' or 'incremental'
+    volume_size_mb: int = 0
+    upload_threads: int = 1
+    read_limit_mb: int = 0
+    write_limit_mb: int = 0
+    throttle_schedule: Optional[str] = None
+    pipeline_mode: str = "staged" # 'staged' or 'stream'
+    sync_mode: str = "overwrite" # 'overwrite', 'mirror' or 'incremental'
+    sync_verify_days: int = 0
+    watch_source: bool = False
     keep_versions: int = 7
+    keep_hourly: int = 0
+    keep_daily: int = 0
+    keep_weekly: int = 0
+    keep_monthly: int = 0
 
 class ProjectCreate(ProjectBase):
     pass
@@ -75,6 +97,36 @@ class Project(ProjectBase):
     class Config:
         from_attributes = True
 
+# --- Summary Schemas (仪表盘轻量列表) ---
+class HistorySummary(BaseModel):
+    id: int
+    task_type: Optional[str] = "backup"
+    status: str
+    progress: int = 0
+    start_time: datetime
+    end_time: Optional[datetime] = None
+    file_size_bytes: int = 0
+    bytes_copied: Optional[int] = None
+    bytes_skipped: Optional[int] = None
+    files_added: Optional[int] = None
+    files_updated: Optional[int] = None
+    files_renamed: Optional[int] = None
+    files_deleted: Optional[int] = None
+    files_skipped: Optional[int] = None
+
+class ProjectSummary(BaseModel):
+    id: int
+    name: str
+    archive_format: str
+    destination_type: str
+    latest_history: Optional[HistorySummary] = None
+    schedule_active: bool = False
+    next_run_time: Optional[datetime] = None
+
+class BrowseStatRequest(BaseModel):
+    path: str
+    names: List[str]
+
 class Setting(BaseModel):
     key: str
     value: Optional[str] = None
@@ -0,0 +1,170 @@
+import os
+import re
+import errno
+import fcntl
+import shutil
+import concurrent.futures
+
+from .archive_index import path_filter
+
+# 硬链接快照 (archive_format == "snapshot"，仅本地目标，类似 rsnapshot / rsync --link-dest):
+#   - 每次备份生成目录 <项目名>_<时间>.snap，写入期间名为 .snap.part，完成后改名
+#   - 与上一个快照中大小、修改时间 (ns) 都相同的文件直接硬链接，其余文件从源目录复制
+#   - 无法硬链接 (超出链接数上限、文件系统不支持) 时尝试 reflink (btrfs/xfs 的 FICLONE)，仍失败则复制
+#   - 每个快照都是完整的目录树，可直接浏览；还原时复制文件，不会与快照共享 inode
+#   - 删除快照只减少链接计数，先改名为 .deleting 再删除，删除中断不会留下残缺的快照
+SNAP_EXT = ".snap"
+PART_EXT = ".part"
+TRASH_EXT = ".deleting"
+FICLONE = 0x40049409
+UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS}
+
+
+def prefix_for(project) -> str:
+    return project.name.replace(' ', '_') + "_"
+
+def snapshot_name(project, timestamp: str) -> str:
+    return f"{prefix_for(project)}{timestamp}{SNAP_EXT}"
+
+def _matching(dest_dir: str, prefix: str, suffix: str = "") -> list:
+    # 名称需精确匹配 <前缀><时间>，避免项目 A 误认项目 A_B 的快照
+    pattern = re.compile(re.escape(prefix) + r"\d{8}_\d{6}" + re.escape(SNAP_EXT + suffix) + "$")
+    try: return [e for e in os.scandir(dest_dir) if pattern.match(e.name) and e.is_dir(follow_symlinks=False)]
+    except FileNotFoundError: return []
+
+def list_snapshots(dest_dir: str, prefix: str) -> list:
+    """已完成的快照名称，按时间升序"""
+    return sorted(e.name for e in _matching(dest_dir, prefix))
+
+def cleanup(dest_dir: str, prefix: str):
+    """清理中断的写入 (.snap.part) 与删除 (.snap.deleting)"""
+    for entry in _matching(dest_dir, prefix, PART_EXT) + _matching(dest_dir, prefix, TRASH_EXT): shutil.rmtree(entry.path, ignore_errors=True)
+
+def delete_snapshot(path: str):
+    if os.path.islink(path) or not os.path.isdir(path): return
+    trash = path + TRASH_EXT
+    os.replace(path, trash)
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def _reflink(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+class Linker:
+    """硬链接优先，其次 reflink; 某种方式在该文件系统上不可用后不再尝试"""
+
+    def __init__(self):
+        self.hardlink, self.reflink = True, True
+
+    def link(self, old: str, dst: str) -> bool:
+        if self.hardlink:
+            try:
+                os.link(old, dst)
+                return True
+            except OSError as e:
+                if e.errno in UNSUPPORTED: self.hardlink = False
+                elif e.errno != errno.EMLINK: raise
+        if self.reflink:
+            try:
+                _reflink(old, dst)
+                return True
+            except OSError as e:
+                try: os.remove(dst)
+                except OSError: pass
+                if e.errno in UNSUPPORTED: self.reflink = False
+                else: raise
+        return False
+
+
+def create_snapshot(source: str, dest_dir: str, prefix: str, name: str, include_list: list, threads: int, throttle, log_buffer, totals: dict, on_file=None, check_stop=None) -> dict:
+    """生成快照，返回 相对路径 -> (size, mtime_ns); totals 按同步任务的统计字段累加 (硬链接计入 skipped)"""
+    cleanup(dest_dir, prefix)
+    previous = list_snapshots(dest_dir, prefix)
+    prev_path = os.path.join(dest_dir, previous[-1]) if previous else None
+    log_buffer.write(f"[INFO] 基准快照: {previous[-1] if previous else '无 (首次备份，全部复制)'}\n")
+    work = os.path.join(dest_dir, name + PART_EXT)
+    os.makedirs(work)
+    linker = Linker()
+
+    def one(rp):
+        if check_stop: check_stop()
+        src, dst = os.path.join(source, rp), os.path.join(work, rp)
+        st = os.stat(src)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        kind = "added"
+        if prev_path:
+            old = os.path.join(prev_path, rp)
+            try: old_st = os.stat(old)
+            except OSError: old_st = None
+            if old_st:
+                if old_st.st_size == st.st_size and old_st.st_mtime_ns == st.st_mtime_ns and linker.link(old, dst): return rp, st, "skipped"
+                kind = "updated"
+        throttle.copy_file(src, dst, st.st_size)
+        log_buffer.write(f"[SYNC] {rp}\n")
+        return rp, st, kind
+
+    states = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads or 2) as ex:
+            try:
+                for rp, st, kind in ex.map(one, include_list):
+                    states[rp] = (st.st_size, st.st_mtime_ns)
+                    totals[f"files_{kind}"] += 1
+                    totals["bytes_skipped" if kind == "skipped" else "bytes_copied"] += st.st_size
+                    if on_file: on_file()
+            except BaseException:
+                ex.shutdown(cancel_futures=True)
+                raise
+        if prev_path and not linker.hardlink: log_buffer.write("[WARN] 目标文件系统不支持硬链接，未变化的文件已改为 reflink 或复制\n")
+        os.replace(work, os.path.join(dest_dir, name))
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    return states
+
+
+def iter_files(snapshot_path: str, prefix: str = ""):
+    """遍历快照中的文件: (相对路径, stat)"""
+    prefix = prefix.strip("/")
+    start = os.path.join(snapshot_path, prefix) if prefix else snapshot_path
+    if os.path.isfile(start):
+        yield prefix, os.stat(start)
+        return
+    stack = [prefix]
+    while stack:
+        rel_root = stack.pop()
+        try:
+            with os.scandir(os.path.join(snapshot_path, rel_root) if rel_root else snapshot_path) as it: entries = list(it)
+        except OSError: continue
+        for entry in entries:
+            rel_path = f"{rel_root}/{entry.name}" if rel_root else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False): stack.append(rel_path)
+                else: yield rel_path, entry.stat()
+            except OSError: continue
+
+def restore_snapshot(snapshot_path: str, target: str, threads: int, throttle, on_progress=None, check_stop=None, paths: list = None) -> int:
+    """复制 (不链接) 快照中的文件到 target，paths 为空时还原全部"""
+    selected = path_filter(paths)
+    files = [(rp, st.st_size) for rp, st in iter_files(snapshot_path) if selected is None or selected(rp)]
+
+    def one(item):
+        rp, size = item
+        if check_stop: check_stop()
+        dst = os.path.join(target, rp)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.isdir(dst) and not os.path.islink(dst): shutil.rmtree(dst)
+        throttle.copy_file(os.path.join(snapshot_path, rp), dst, size)
+        return rp
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads or 2) as ex:
+        try:
+            for count, rp in enumerate(ex.map(one, files), 1):
+                if on_progress: on_progress(count, len(files), rp)
+        except BaseException:
+            ex.shutdown(cancel_futures=True)
+            raise
+    return len(files)
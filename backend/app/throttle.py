@@ -0,0 +1,258 @@
+import io
+import os
+import json
+import time
+import shutil
+import threading
+import collections
+from datetime import datetime
+
+from .config_loader import get_setting_value, subscribe
+
+# 带宽限制: 令牌桶限制读取 (源文件/备份文件) 与写入 (目标端/还原目录) 速度，单位 MB/s，0 表示不限制。
+#   - 全局限制: 设置项 throttle_read_mb / throttle_write_mb，所有运行中的任务共享
+#   - 项目限制: 项目的 read_limit_mb / write_limit_mb，只作用于该项目的任务
+#   - 时段计划: throttle_schedule 为 JSON 列表，如 [{"start": "08:00", "end": "23:00", "read_mb": 20, "write_mb": 5}]，
+#     当前时间落在某个时段内时使用该时段的限制 (可跨零点，可用 "days": [0-6] 限定星期，0 为周一)
+# 限制每秒重新计算一次，修改设置或项目配置后运行中的任务立即生效，无需重启任务。
+MB = 1024 * 1024
+REFRESH_INTERVAL = 1.0
+MAX_SLEEP = 0.25
+RATE_WINDOW = 5.0
+
+
+def parse_schedule(raw) -> list:
+    if not raw: return []
+    try: windows = json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError: return []
+    return [w for w in windows if isinstance(w, dict) and w.get("start") and w.get("end")] if isinstance(windows, list) else []
+
+def _minutes(hhmm: str) -> int:
+    h, _, m = str(hhmm).partition(":")
+    return int(h) * 60 + int(m or 0)
+
+def scheduled_limits(read_mb, write_mb, schedule: list, now: datetime = None) -> tuple:
+    """返回当前时间生效的 (读取, 写入) 限制 (MB/s)"""
+    now = now or datetime.now()
+    current = now.hour * 60 + now.minute
+    for w in schedule:
+        try: start, end = _minutes(w["start"]), _minutes(w["end"])
+        except (TypeError, ValueError): continue
+        if "days" in w and now.weekday() not in w["days"]: continue
+        inside = start <= current < end if start <= end else (current >= start or current < end)
+        if inside: return w.get("read_mb", read_mb), w.get("write_mb", write_mb)
+    return read_mb, write_mb
+
+def _rate(mb) -> float:
+    try: return max(0.0, float(mb or 0)) * MB
+    except (TypeError, ValueError): return 0.0
+
+
+class TokenBucket:
+    """允许透支的令牌桶: 先记账再按欠额休眠，限速变化时在下一个休眠片段生效"""
+
+    def __init__(self, rate: float = 0):
+        self.lock = threading.Lock()
+        self.rate, self.tokens, self.last = 0.0, 0.0, time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            self.burst = max(256 * 1024, rate * 0.5)
+            self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0: self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, n: int, check_stop=None):
+        with self.lock:
+            if self.rate <= 0: return
+            self._refill()
+            self.tokens -= n
+        while True:
+            with self.lock:
+                self._refill()
+                if self.rate <= 0 or self.tokens >= 0: return
+                wait = -self.tokens / self.rate
+            time.sleep(min(wait, MAX_SLEEP))
+            if check_stop: check_stop()
+
+
+global_read, global_write = TokenBucket(), TokenBucket()
+_global_lock = threading.Lock()
+_global_checked = 0.0
+
+def refresh_global():
+    global _global_checked
+    with _global_lock:
+        if time.monotonic() - _global_checked < REFRESH_INTERVAL: return
+        _global_checked = time.monotonic()
+    read_mb, write_mb = scheduled_limits(get_setting_value("throttle_read_mb", 0), get_setting_value("throttle_write_mb", 0),
+                                         parse_schedule(get_setting_value("throttle_schedule")))
+    global_read.set_rate(_rate(read_mb))
+    global_write.set_rate(_rate(write_mb))
+
+def _on_settings(changed: dict):
+    # 全局限速修改后下一次读写立即重新计算，不等刷新间隔
+    global _global_checked
+    with _global_lock: _global_checked = 0.0
+
+subscribe(_on_settings, ("throttle_read_mb", "throttle_write_mb", "throttle_schedule"))
+
+
+class JobThrottle:
+    """单个任务的限速与吞吐统计"""
+
+    def __init__(self, project, kind: str = "backup", check_stop=None):
+        self.project_id, self.project_name, self.kind = project.id, project.name, kind
+        self.check_stop = check_stop
+        self.read_bucket, self.write_bucket = TokenBucket(), TokenBucket()
+        self.read_bytes = self.write_bytes = 0
+        self.started = time.monotonic()
+        self.samples = collections.deque([(self.started, 0, 0)])
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.configure(project)
+
+    def configure(self, project):
+        self.base = (project.read_limit_mb or 0, project.write_limit_mb or 0, parse_schedule(project.throttle_schedule))
+        self.limits = scheduled_limits(*self.base)
+        self.checked = 0.0
+
+    def _tick(self):
+        now = time.monotonic()
+        if now - self.checked < REFRESH_INTERVAL: return
+        self.checked = now
+        read_mb, write_mb = scheduled_limits(*self.base)
+        self.limits = (read_mb, write_mb)
+        self.read_bucket.set_rate(_rate(read_mb))
+        self.write_bucket.set_rate(_rate(write_mb))
+        refresh_global()
+        with self.lock:
+            self.samples.append((now, self.read_bytes, self.write_bytes))
+            while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW: self.samples.popleft()
+
+    def on_read(self, n: int):
+        if not n: return
+        self._tick()
+        with self.lock: self.read_bytes += n
+        self.read_bucket.consume(n, self.check_stop)
+        global_read.consume(n, self.check_stop)
+
+    def on_write(self, n: int):
+        if not n: return
+        self._tick()
+        with self.lock: self.write_bytes += n
+        self.write_bucket.consume(n, self.check_stop)
+        global_write.consume(n, self.check_stop)
+
+    def reader(self, raw):
+        return ThrottledReader(raw, self)
+
+    def writer(self, raw):
+        return ThrottledWriter(raw, self)
+
+    def limited(self) -> bool:
+        self._tick()
+        return any(b.rate > 0 for b in (self.read_bucket, self.write_bucket, global_read, global_write))
+
+    def copy_file(self, src: str, dst: str, size: int = None, bufsize: int = MB):
+        """与 shutil.copy2 相同; 有限速时按块复制，否则使用 copy2 (可走内核零拷贝) 后只记录字节数。
+        size 为调用方已 stat 得到的源文件大小，省去复制后的再次 stat"""
+        if not self.limited():
+            shutil.copy2(src, dst)
+            if size is None: size = os.path.getsize(src)
+            with self.lock: self.read_bytes, self.write_bytes = self.read_bytes + size, self.write_bytes + size
+            return
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            while buf := fsrc.read(bufsize):
+                self.on_read(len(buf))
+                self.on_write(len(buf))
+                fdst.write(buf)
+        shutil.copystat(src, dst)
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            t0, r0, w0 = self.samples[0]
+            span = max(now - t0, 1e-6)
+            elapsed = max(now - self.started, 1e-6)
+            return {
+                "project_id": self.project_id, "project_name": self.project_name, "kind": self.kind,
+                "read_bytes": self.read_bytes, "write_bytes": self.write_bytes,
+                "read_bps": int((self.read_bytes - r0) / span), "write_bps": int((self.write_bytes - w0) / span),
+                "avg_read_bps": int(self.read_bytes / elapsed), "avg_write_bps": int(self.write_bytes / elapsed),
+                "limits_mb": {"read": self.limits[0], "write": self.limits[1]},
+            }
+
+    def summary(self) -> str:
+        s = self.stats()
+        return f"[INFO] 平均读取 {s['avg_read_bps'] / MB:.1f} MB/s，平均写入 {s['avg_write_bps'] / MB:.1f} MB/s\n"
+
+
+class ThrottledReader(io.RawIOBase):
+    def __init__(self, raw, throttle: JobThrottle):
+        self.raw = raw
+        self.throttle = throttle
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        n = self.raw.readinto(b)
+        self.throttle.on_read(n or 0)
+        return n
+
+    def close(self):
+        try: self.raw.close()
+        finally: super().close()
+
+
+class ThrottledWriter(io.RawIOBase):
+    """限速写入; 关闭时不关闭下层文件 (由创建者负责)"""
+
+    def __init__(self, raw, throttle: JobThrottle):
+        self.raw = raw
+        self.throttle = throttle
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self.throttle.on_write(len(data))
+        self.raw.write(data)
+        return len(data)
+
+    def flush(self):
+        if not self.closed: self.raw.flush()
+
+
+# 运行中任务的限速器: project_id -> JobThrottle
+_active = {}
+_active_lock = threading.Lock()
+
+def start_job(project, kind: str = "backup", check_stop=None) -> JobThrottle:
+    t = JobThrottle(project, kind, check_stop)
+    with _active_lock: _active[project.id] = t
+    return t
+
+def end_job(t: JobThrottle):
+    with _active_lock:
+        if _active.get(t.project_id) is t: del _active[t.project_id]
+
+def reconfigure(project):
+    """项目限速配置修改后作用于该项目正在运行的任务"""
+    with _active_lock: t = _active.get(project.id)
+    if t: t.configure(project)
+
+def job_stats(project_id: int):
+    with _active_lock: t = _active.get(project_id)
+    return t.stats() if t else None
+
+def all_stats() -> list:
+    with _active_lock: jobs = list(_active.values())
+    return [t.stats() for t in jobs]
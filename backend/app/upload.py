@@ -0,0 +1,190 @@
+import os
+import json
+import glob
+import hashlib
+import threading
+import concurrent.futures
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+# 分段上传: 按段复制到 <目标>.part，每完成一段写入断点文件 (<源文件>.upload.json)，
+# 挂载点中断时只重试当前段; 任务失败后保留缓存文件与断点，下次运行时从断点续传。
+# 全部完成后回读目标文件逐段校验哈希，再原子重命名为最终文件名。
+SEGMENT_SIZE = int(os.getenv("UPLOAD_SEGMENT_MB", "64")) * 1024 * 1024
+COPY_BUFFER = 4 * 1024 * 1024
+SEGMENT_RETRIES = 6
+VERIFY_ROUNDS = 2
+CHECKPOINT_EXT = ".upload.json"
+PART_EXT = ".part"
+
+
+def checkpoint_path(source: str) -> str:
+    return source + CHECKPOINT_EXT
+
+def _save_checkpoint(path: str, ck: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(ck, f)
+    os.replace(tmp, path)
+
+def _load_checkpoint(path: str):
+    try:
+        with open(path) as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _hash_range(path: str, start: int, length: int) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            buf = f.read(min(COPY_BUFFER, length))
+            if not buf: break
+            h.update(buf)
+            length -= len(buf)
+    return h.hexdigest()
+
+
+class SegmentedUpload:
+    def __init__(self, source: str, dest: str, threads: int = 1, log_buffer=None, check_stop=None, extra: dict = None, throttle=None):
+        self.source, self.dest = source, dest
+        self.throttle = throttle
+        self.part = dest + PART_EXT
+        self.threads = max(1, threads or 1)
+        self.log_buffer = log_buffer
+        self.check_stop = check_stop
+        self.ck_path = checkpoint_path(source)
+        self.lock = threading.Lock()
+        st = os.stat(source)
+        self.size = st.st_size
+        ck = _load_checkpoint(self.ck_path)
+        # 断点只对同一源文件、同一目标、相同分段大小有效
+        key = {"source": source, "dest": dest, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "segment_size": SEGMENT_SIZE}
+        if not ck or any(ck.get(k) != v for k, v in key.items()) or not self._part_ok():
+            ck = dict(key, segments={})
+        ck.update(extra or {})
+        self.ck = ck
+        self.count = max(1, -(-self.size // SEGMENT_SIZE))
+
+    def _log(self, msg: str):
+        if self.log_buffer: self.log_buffer.write(msg)
+
+    def _part_ok(self) -> bool:
+        try: return os.path.getsize(self.part) == self.size
+        except OSError: return False
+
+    def _range(self, idx: int):
+        start = idx * SEGMENT_SIZE
+        return start, min(SEGMENT_SIZE, self.size - start)
+
+    def _copy_segment(self, idx: int) -> str:
+        start, length = self._range(idx)
+        h = hashlib.sha256()
+        fd = os.open(self.part, os.O_WRONLY)
+        try:
+            with open(self.source, "rb") as src:
+                src.seek(start)
+                pos = start
+                while length > 0:
+                    buf = src.read(min(COPY_BUFFER, length))
+                    if not buf: raise IOError("源文件长度不足")
+                    if self.throttle:
+                        self.throttle.on_read(len(buf))
+                        self.throttle.on_write(len(buf))
+                    h.update(buf)
+                    view = memoryview(buf)
+                    while view:
+                        n = os.pwrite(fd, view, pos)
+                        view, pos = view[n:], pos + n
+                    length -= len(buf)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return h.hexdigest()
+
+    def _upload_segment(self, idx: int):
+        if self.check_stop: self.check_stop()
+
+        def on_retry(state):
+            self._log(f"[WARN] 分段 {idx + 1}/{self.count} 写入失败 ({state.outcome.exception()})，{int(state.next_action.sleep)} 秒后重试...\n")
+
+        copy = retry(stop=stop_after_attempt(SEGMENT_RETRIES), wait=wait_exponential(multiplier=2, min=2, max=60),
+                     retry=retry_if_exception_type(IOError), before_sleep=on_retry, reraise=True)(self._copy_segment)
+        digest = copy(idx)
+        with self.lock:
+            self.ck["segments"][str(idx)] = digest
+            _save_checkpoint(self.ck_path, self.ck)
+            done = len(self.ck["segments"])
+        if done == self.count or done % max(1, self.count // 20) == 0:
+            self._log(f"[UPLOAD] {done}/{self.count} 段 ({done * 100 // self.count}%)\n")
+
+    def _run_segments(self, todo: list):
+        if not todo: return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as ex:
+            futures = [ex.submit(self._upload_segment, i) for i in todo]
+            try:
+                for fut in concurrent.futures.as_completed(futures): fut.result()
+            except BaseException:
+                for fut in futures: fut.cancel()
+                raise
+
+    def _verify(self) -> list:
+        """回读目标文件，返回哈希不一致的分段"""
+        def check(idx):
+            start, length = self._range(idx)
+            return idx if _hash_range(self.part, start, length) != self.ck["segments"].get(str(idx)) else None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as ex:
+            return [i for i in ex.map(check, range(self.count)) if i is not None]
+
+    def run(self) -> str:
+        """执行上传，返回文件摘要 (各分段 sha256 依次拼接后的 sha256)"""
+        if not self._part_ok():
+            os.makedirs(os.path.dirname(self.dest) or ".", exist_ok=True)
+            with open(self.part, "wb") as f: f.truncate(self.size)
+            self.ck["segments"] = {}
+        _save_checkpoint(self.ck_path, self.ck)
+        done = len(self.ck["segments"])
+        if done: self._log(f"[INFO] 从断点续传: 已完成 {done}/{self.count} 段\n")
+        else: self._log(f"[INFO] 分段上传: {self.count} 段 x {SEGMENT_SIZE // 1024 // 1024} MB, {self.threads} 线程\n")
+
+        for _ in range(VERIFY_ROUNDS):
+            self._run_segments([i for i in range(self.count) if str(i) not in self.ck["segments"]])
+            if self.check_stop: self.check_stop()
+            bad = self._verify()
+            if not bad: break
+            self._log(f"[WARN] 校验发现 {len(bad)} 个分段不一致，重新上传...\n")
+            with self.lock:
+                for i in bad: self.ck["segments"].pop(str(i), None)
+                _save_checkpoint(self.ck_path, self.ck)
+        else:
+            raise IOError("上传校验失败: 目标文件与源文件不一致")
+
+        digest = hashlib.sha256("".join(self.ck["segments"][str(i)] for i in range(self.count)).encode()).hexdigest()
+        os.replace(self.part, self.dest)
+        self._log(f"[INFO] 上传校验通过 (sha256 分段摘要: {digest[:16]}...)\n")
+        return digest
+
+    def discard(self):
+        """放弃上传: 删除目标端临时文件与断点"""
+        for p in (self.part, self.ck_path):
+            try: os.remove(p)
+            except OSError: pass
+
+
+def upload_file(source: str, dest: str, threads: int = 1, log_buffer=None, check_stop=None, extra: dict = None, throttle=None) -> str:
+    """分段上传并在成功后删除源文件 (与原 shutil.move 语义一致)"""
+    digest = SegmentedUpload(source, dest, threads, log_buffer, check_stop, extra, throttle).run()
+    os.remove(checkpoint_path(source))
+    os.remove(source)
+    return digest
+
+def pending_uploads(cache_dir: str, project_id: int) -> list:
+    """缓存目录中属于该项目的未完成上传: [(源文件, 断点内容)]"""
+    result = []
+    for ck_path in glob.glob(os.path.join(glob.escape(cache_dir), "*" + CHECKPOINT_EXT)):
+        ck = _load_checkpoint(ck_path)
+        if not ck or ck.get("project_id") != project_id: continue
+        source = ck_path[:-len(CHECKPOINT_EXT)]
+        if os.path.exists(source): result.append((source, ck))
+        else:
+            try: os.remove(ck_path)
+            except OSError: pass
+    return result
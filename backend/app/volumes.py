@@ -0,0 +1,168 @@
+import os
+import re
+import io
+import shutil
+import concurrent.futures
+
+from . import upload
+
+# 分卷备份: 一次备份是一个目录 (目录名即单文件模式下的文件名，如 xxx.tar.gz.enc)，
+# 其中依次存放 xxx.tar.gz.enc.001, .002 ... 分卷按顺序拼接即为完整的归档数据流。
+# 云端目标: 分卷先写入缓存目录，写满即交给后台上传，缓存中同时最多保留 MAX_CACHED_VOLUMES 个分卷。
+MAX_CACHED_VOLUMES = 2
+# 7z 分卷模式下扫描暂存目录查找已写完分卷的最小间隔 (秒)
+SCAN_INTERVAL = 1.0
+
+
+def volume_name(base: str, index: int) -> str:
+    return f"{base}.{index:03d}"
+
+def list_volumes(directory: str, base: str) -> list:
+    """按序号返回目录中属于 base 的分卷路径"""
+    pattern = re.compile(re.escape(base) + r"\.(\d{3,})$")
+    found = []
+    try:
+        for entry in os.scandir(directory):
+            m = pattern.match(entry.name)
+            if m: found.append((int(m.group(1)), entry.path))
+    except FileNotFoundError:
+        pass
+    return [p for _, p in sorted(found)]
+
+def set_volumes(set_path: str) -> list:
+    return list_volumes(set_path, os.path.basename(set_path))
+
+def set_size(set_path: str) -> int:
+    return sum(os.path.getsize(p) for p in set_volumes(set_path))
+
+
+class VolumeReader(io.RawIOBase):
+    """将分卷按顺序拼接为一个只读数据流"""
+
+    def __init__(self, paths: list):
+        self.paths = list(paths)
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        while True:
+            if self.current is None:
+                if not self.paths: return 0
+                self.current = open(self.paths.pop(0), "rb")
+            n = self.current.readinto(b)
+            if n: return n
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current: self.current.close()
+        self.current = None
+        super().close()
+
+
+class VolumeUploader:
+    """后台按顺序上传已写完的分卷，上传成功后删除缓存文件"""
+
+    def __init__(self, dest_dir: str, threads: int = 1, log_buffer=None, check_stop=None, limit: int = MAX_CACHED_VOLUMES, throttle=None):
+        self.dest_dir = dest_dir
+        self.throttle = throttle
+        self.threads = threads
+        self.log_buffer = log_buffer
+        self.check_stop = check_stop
+        self.limit = max(1, limit)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+        self.cached = []
+
+    def _upload(self, path: str):
+        name = os.path.basename(path)
+        if self.log_buffer: self.log_buffer.write(f"[UPLOAD] 上传分卷 {name}\n")
+        upload.upload_file(path, os.path.join(self.dest_dir, name), self.threads, self.log_buffer, self.check_stop, throttle=self.throttle)
+
+    def _raise_failed(self):
+        for fut in self.futures:
+            if fut.done() and fut.exception(): raise fut.exception()
+
+    def submit(self, path: str):
+        """提交已写完的分卷; 缓存中的分卷达到上限时阻塞，直到前面的分卷上传完成"""
+        self._raise_failed()
+        self.cached.append(path)
+        self.futures.append(self.pool.submit(self._upload, path))
+        pending = [f for f in self.futures if not f.done()]
+        # 下一个分卷即将开始写入，也占用一个缓存名额
+        while len(pending) > self.limit - 1:
+            concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            self._raise_failed()
+            pending = [f for f in self.futures if not f.done()]
+
+    def finish(self):
+        for fut in self.futures: fut.result()
+        self.pool.shutdown()
+
+    def abort(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        for p in self.cached:
+            for f in (p, upload.checkpoint_path(p)):
+                if os.path.exists(f):
+                    try: os.remove(f)
+                    except OSError: pass
+
+
+class VolumeWriter(io.RawIOBase):
+    """按固定大小切分输出流，每写满一个分卷回调 on_volume(path)"""
+
+    def __init__(self, directory: str, base: str, volume_size: int, on_volume=None):
+        self.directory, self.base = directory, base
+        self.volume_size = volume_size
+        self.on_volume = on_volume
+        self.index = 0
+        self.file = None
+        self.written = 0
+        self.paths = []
+
+    def writable(self):
+        return True
+
+    def _next_volume(self):
+        self.index += 1
+        path = os.path.join(self.directory, volume_name(self.base, self.index))
+        self.file = open(path, "wb")
+        self.paths.append(path)
+        self.written = 0
+
+    def _finish_volume(self):
+        self.file.close()
+        self.file = None
+        if self.on_volume: self.on_volume(self.paths[-1])
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        total = len(view)
+        while view:
+            if self.file is None: self._next_volume()
+            n = min(len(view), self.volume_size - self.written)
+            self.file.write(view[:n])
+            self.written += n
+            view = view[n:]
+            if self.written >= self.volume_size: self._finish_volume()
+        return total
+
+    def close(self):
+        if self.closed: return
+        try:
+            if self.file is None and not self.paths: self._next_volume()  # 空归档也至少产生一个分卷
+            if self.file is not None: self._finish_volume()
+        finally:
+            super().close()
+
+
+def remove_cached(directory: str, base: str):
+    for p in list_volumes(directory, base):
+        for f in (p, upload.checkpoint_path(p)):
+            try: os.remove(f)
+            except OSError: pass
+
+def remove_set(path: str):
+    if os.path.isdir(path): shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,396 @@
+import os
+import time
+import uuid
+import errno
+import select
+import struct
+import sqlite3
+import threading
+import ctypes
+import ctypes.util
+
+from .file_index import INDEX_DIR
+from .matcher import ExcludeMatcher
+
+# 源目录变更日志 (项目开启 watch_source 时):
+#   - 后台线程用 inotify 监控源目录 (排除规则命中的目录不监控)，把条目增删、改名所在的目录记为"脏目录"，写入持久化日志
+#   - 日志中同时保存上次扫描得到的目录树; 生成清单时复用目录树，只重新列出脏目录 (新出现的子目录整体扫描)
+#   - 清单只包含路径，文件内容修改不影响清单，因此只关心 IN_CREATE/IN_DELETE/IN_MOVED_*
+#   - 每次 (重新) 建立监控生成新的会话号; 监控重启、事件队列溢出后会话号变化，下次备份执行完整扫描
+#   - 不支持 inotify 的环境 (或 WATCH_BACKEND=poll) 改为定时比较目录 mtime
+#   - 生成清单前调用 flush(): 监控线程立即读完已到达的事件 (轮询模式立即比较一次 mtime) 并写入日志，
+#     确认超时则完整扫描，任务开始前已存在的文件不会漏掉
+WATCH_BACKEND = os.getenv("WATCH_BACKEND", "inotify")
+POLL_INTERVAL = 30      # 轮询模式的目录检查间隔
+FLUSH_SECONDS = 1       # 脏目录写入日志的最小间隔
+WAKE_SECONDS = 0.2      # 每次等待事件的最长时间 (也是响应 flush 请求的延迟)
+FLUSH_TIMEOUT = 10      # 等待监控线程确认 flush 的时间
+DRAIN_READS = 64
+RETRY_SECONDS = 300     # 监控建立失败 (源目录不存在、超出 inotify 监控数量上限) 后的重试间隔
+
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED = 0x400, 0x800, 0x4000, 0x8000
+IN_ONLYDIR, IN_DONT_FOLLOW, IN_EXCL_UNLINK, IN_ISDIR = 0x01000000, 0x02000000, 0x04000000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Overflow(Exception):
+    """事件丢失 (队列溢出、源目录被删除或移动)，已记录的脏目录不再完整"""
+
+
+def join(rel_root: str, name: str) -> str:
+    return f"{rel_root}/{name}" if rel_root else name
+
+def _under(path: str, rel: str) -> bool:
+    return not rel or path == rel or path.startswith(rel + "/")
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+_libc = _load_libc()
+
+
+class InotifyBackend:
+    def __init__(self, root: str, matcher: ExcludeMatcher):
+        self.root, self.matcher = root, matcher
+        self.wds, self.paths = {}, {}   # wd -> 相对路径, 相对路径 -> wd
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def _add(self, rel: str) -> bool:
+        wd = _libc.inotify_add_watch(self.fd, os.path.join(self.root, rel).encode(), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC: raise OSError(err, "超出 inotify 监控数量上限 (fs.inotify.max_user_watches)")
+            return False   # 目录已被删除或无权限
+        # 同一 inode 再次添加返回原 wd (目录被移动后重新加入)
+        old = self.wds.get(wd)
+        if old is not None and self.paths.get(old) == wd: del self.paths[old]
+        self.wds[wd], self.paths[rel] = rel, wd
+        return True
+
+    def add_tree(self, rel: str) -> list:
+        """监控 rel 及其未被排除的子目录，返回已加入监控的目录"""
+        added, stack = [], [rel]
+        while stack:
+            current = stack.pop()
+            if not self._add(current): continue
+            added.append(current)
+            try:
+                with os.scandir(os.path.join(self.root, current) if current else self.root) as it: entries = list(it)
+            except OSError: continue
+            for entry in entries:
+                sub = join(current, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=False) and not self.matcher.matches(entry.name, sub): stack.append(sub)
+                except OSError: continue
+        return added
+
+    def remove_tree(self, rel: str):
+        for path in [p for p in self.paths if _under(p, rel)]:
+            wd = self.paths.pop(path)
+            self.wds.pop(wd, None)
+            _libc.inotify_rm_watch(self.fd, wd)
+
+    def changes(self, timeout: float) -> set:
+        if not self.poller.poll(timeout * 1000): return set()
+        return self._read()
+
+    def drain(self) -> set:
+        """读完队列中已到达的事件"""
+        dirty = set()
+        for _ in range(DRAIN_READS):
+            if not self.poller.poll(0): break
+            dirty |= self._read()
+        return dirty
+
+    def _read(self) -> set:
+        try: data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError: return set()
+        dirty, offset, new_dirs = set(), 0, []
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW: raise Overflow("inotify 事件队列溢出")
+            rel = self.wds.get(wd)
+            if rel is None: continue
+            if mask & IN_IGNORED:
+                if self.paths.get(rel) == wd: del self.paths[rel]
+                del self.wds[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if not rel: raise Overflow("源目录已被删除或移动")
+                continue
+            dirty.add(rel)
+            if not mask & IN_ISDIR: continue
+            sub = join(rel, name)
+            if mask & (IN_DELETE | IN_MOVED_FROM): self.remove_tree(sub)
+            elif not self.matcher.matches(name, sub): new_dirs.append(sub)
+        # 新目录在加入监控前可能已有内容变化，加入后标记为脏目录
+        for sub in new_dirs: dirty.update(self.add_tree(sub))
+        return dirty
+
+    def close(self):
+        try: os.close(self.fd)
+        except OSError: pass
+
+
+class PollingBackend:
+    """定时比较目录 mtime (条目增删、改名都会更新所在目录的 mtime)"""
+
+    def __init__(self, root: str, matcher: ExcludeMatcher, interval: float = POLL_INTERVAL):
+        self.root, self.matcher, self.interval = root, matcher, interval
+        self.dirs, self.last = {}, time.monotonic()   # 相对路径 -> mtime_ns
+
+    def _full(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def add_tree(self, rel: str) -> list:
+        added, stack = [], [rel]
+        while stack:
+            current = stack.pop()
+            try:
+                self.dirs[current] = os.stat(self._full(current)).st_mtime_ns
+                with os.scandir(self._full(current)) as it: entries = list(it)
+            except OSError: continue
+            added.append(current)
+            for entry in entries:
+                sub = join(current, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=False) and not self.matcher.matches(entry.name, sub) and sub not in self.dirs: stack.append(sub)
+                except OSError: continue
+        return added
+
+    def changes(self, timeout: float) -> set:
+        wait = self.interval - (time.monotonic() - self.last)
+        if wait > 0:
+            time.sleep(min(timeout, wait))
+            return set()
+        return self.drain()
+
+    def drain(self) -> set:
+        """立即比较一次全部目录的 mtime"""
+        self.last = time.monotonic()
+        dirty = set()
+        for rel, mtime_ns in list(self.dirs.items()):
+            if rel not in self.dirs: continue
+            try: current = os.stat(self._full(rel)).st_mtime_ns
+            except OSError:
+                if not rel: raise Overflow("源目录已被删除或移动")
+                for path in [p for p in self.dirs if _under(p, rel)]: del self.dirs[path]
+                dirty.add(os.path.dirname(rel))
+                continue
+            if current != mtime_ns:
+                dirty.add(rel)
+                dirty.update(self.add_tree(rel))
+        return dirty
+
+    def close(self):
+        pass
+
+
+class Journal:
+    """变更日志与上次的目录树 (INDEX_DIR/journal_<id>.db)"""
+
+    def __init__(self, project_id: int):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(INDEX_DIR, f"journal_{project_id}.db"), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dirty (path TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS tree (parent TEXT NOT NULL, name TEXT NOT NULL, is_dir INTEGER NOT NULL, PRIMARY KEY (parent, name)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.conn.commit()
+
+    def _meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def add_dirty(self, paths):
+        self.conn.executemany("INSERT OR IGNORE INTO dirty (path) VALUES (?)", ((p,) for p in paths))
+        self.conn.commit()
+
+    def clear_dirty(self):
+        self.conn.execute("DELETE FROM dirty")
+        self.conn.commit()
+
+    def begin(self, session: str, key: str):
+        """取出并清空脏目录; 目录树属于当前会话与过滤规则时返回脏目录列表，否则返回 None (需完整扫描)。
+        扫描完成前目录树标记为无效，任务中断后下次会完整扫描"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            valid = self._meta("session") == session and self._meta("key") == key
+            dirty = [r[0] for r in self.conn.execute("SELECT path FROM dirty")]
+            self.conn.execute("DELETE FROM dirty")
+            self._set_meta("session", "")
+        return dirty if valid else None
+
+    def finish(self, session: str, key: str):
+        with self.conn:
+            self._set_meta("session", session)
+            self._set_meta("key", key)
+
+    def is_dir(self, rel: str) -> bool:
+        parent, name = os.path.split(rel)
+        row = self.conn.execute("SELECT is_dir FROM tree WHERE parent = ? AND name = ?", (parent, name)).fetchone()
+        return bool(row and row[0])
+
+    def children(self, rel: str) -> dict:
+        return {r[0]: r[1] for r in self.conn.execute("SELECT name, is_dir FROM tree WHERE parent = ?", (rel,))}
+
+    def remove_tree(self, rel: str):
+        """删除 rel 下的全部条目 (不含 rel 本身)"""
+        self.conn.execute("DELETE FROM tree WHERE parent = ? OR (parent >= ? AND parent < ?)", (rel, rel + "/", rel + "0"))
+
+    def remove_entry(self, rel: str):
+        self.conn.execute("DELETE FROM tree WHERE parent = ? AND name = ?", os.path.split(rel))
+
+    def replace_children(self, rel: str, rows: list):
+        """rows: [(parent, name, is_dir)]，可包含 rel 下新扫描的子目录内容"""
+        self.conn.execute("DELETE FROM tree WHERE parent = ?", (rel,))
+        self.conn.executemany("INSERT OR REPLACE INTO tree (parent, name, is_dir) VALUES (?, ?, ?)", rows)
+
+    def replace_all(self, rows: list):
+        self.conn.execute("DELETE FROM tree")
+        self.conn.executemany("INSERT INTO tree (parent, name, is_dir) VALUES (?, ?, ?)", rows)
+
+    def files(self) -> list:
+        return [r[0] for r in self.conn.execute("SELECT CASE parent WHEN '' THEN name ELSE parent || '/' || name END FROM tree WHERE is_dir = 0")]
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
+
+
+class ProjectWatcher:
+    def __init__(self, project_id: int, source_path: str, patterns: list):
+        self.project_id, self.source_path, self.patterns = project_id, source_path, patterns
+        self.session = None   # 监控建立后才有值
+        self.stop_event = threading.Event()
+        self.cond = threading.Condition()
+        self.requested = self.flushed = 0   # flush 请求序号与已完成的序号
+        self.thread = threading.Thread(target=self._loop, name=f"watch-{project_id}", daemon=True)
+        self.thread.start()
+
+    def _backend(self, matcher: ExcludeMatcher):
+        if WATCH_BACKEND != "poll" and _libc is not None: return InotifyBackend(self.source_path, matcher)
+        return PollingBackend(self.source_path, matcher)
+
+    def _loop(self):
+        matcher = ExcludeMatcher(self.patterns)
+        journal = Journal(self.project_id)
+        try:
+            while not self.stop_event.is_set():
+                self.session, backend = None, None
+                try:
+                    backend = self._backend(matcher)
+                    if not backend.add_tree(""): raise OSError(errno.ENOENT, "源目录不存在")
+                    # 新会话: 之前的目录树失效，下次备份完整扫描
+                    journal.clear_dirty()
+                    self.session = uuid.uuid4().hex
+                    print(f"[INFO] 项目 {self.project_id} 源目录监控已启动")
+                    pending, flushed = set(), time.monotonic()
+                    while not self.stop_event.is_set():
+                        with self.cond: requested = self.requested
+                        if requested > self.flushed:
+                            journal.add_dirty(pending | backend.drain())
+                            pending, flushed = set(), time.monotonic()
+                            with self.cond:
+                                self.flushed = requested
+                                self.cond.notify_all()
+                        pending |= backend.changes(WAKE_SECONDS)
+                        if pending and time.monotonic() - flushed >= FLUSH_SECONDS:
+                            journal.add_dirty(pending)
+                            pending, flushed = set(), time.monotonic()
+                    if pending: journal.add_dirty(pending)
+                    return
+                except Overflow as e:
+                    print(f"[WARN] 项目 {self.project_id} 源目录监控: {e}，重新建立监控")
+                    self._lost()
+                    self.stop_event.wait(FLUSH_SECONDS)
+                except Exception as e:
+                    print(f"[WARN] 项目 {self.project_id} 源目录监控失败: {e}")
+                    self._lost()
+                    self.stop_event.wait(RETRY_SECONDS)
+                finally:
+                    if backend: backend.close()
+        finally:
+            self._lost()
+            journal.close()
+
+    def _lost(self):
+        """会话失效: 等待中的 flush 立即返回失败"""
+        with self.cond:
+            self.session = None
+            self.cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """请求监控线程把已发生的变更写入日志并等待确认; 返回 False 时变更日志可能不完整"""
+        timeout = FLUSH_TIMEOUT if timeout is None else timeout
+        with self.cond:
+            if not self.session: return False
+            self.requested += 1
+            ticket = self.requested
+            self.cond.wait_for(lambda: self.flushed >= ticket or not self.session, timeout)
+            return self.flushed >= ticket
+
+    def stop(self, timeout: float = 5):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+
+def _patterns(project) -> list:
+    return [p.strip() for p in (project.exclude_patterns or "").split(',') if p.strip()]
+
+
+class WatchService:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watchers = {}
+
+    def configure(self, project):
+        """按项目设置启动、重启或停止监控"""
+        with self.lock:
+            current = self.watchers.get(project.id)
+            wanted = (project.source_path, _patterns(project)) if project.watch_source else None
+            if current and wanted == (current.source_path, current.patterns): return
+            if current: self.watchers.pop(project.id).stop()
+            if wanted: self.watchers[project.id] = ProjectWatcher(project.id, *wanted)
+
+    def remove(self, project_id: int):
+        with self.lock: watcher = self.watchers.pop(project_id, None)
+        if watcher: watcher.stop()
+
+    def start_all(self, projects):
+        for project in projects:
+            if project.watch_source: self.configure(project)
+
+    def session(self, project_id: int):
+        watcher = self.watchers.get(project_id)
+        return watcher.session if watcher else None
+
+    def flush(self, project_id: int) -> bool:
+        watcher = self.watchers.get(project_id)
+        return bool(watcher and watcher.flush())
+
+    def shutdown(self):
+        with self.lock: watchers, self.watchers = list(self.watchers.values()), {}
+        for watcher in watchers: watcher.stop_event.set()
+        for watcher in watchers: watcher.thread.join(5)
+
+
+service = WatchService()
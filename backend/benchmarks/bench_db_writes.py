@@ -0,0 +1,115 @@
+"""
+任务进度写入并发基准
+
+模拟多个任务线程高频更新进度，同时有一个线程持续执行仪表盘查询。对比:
+  - 旧方式: 默认日志模式 (DELETE)，每次进度变化由任务线程各自提交
+  - 当前实现: WAL + busy_timeout，进度交给批量写线程，每个周期一个事务
+输出写入事务数、"database is locked" 错误数与查询延迟。
+
+用法 (在 backend 目录下):
+    python benchmarks/bench_db_writes.py [--jobs 20] [--updates 200] [--rate 20]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp.name}/bench.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import create_engine, select, func, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.models import BackupProject, BackupHistory  # noqa: E402
+from app.dbwriter import writer  # noqa: E402
+
+LOG_TAIL = "x" * 4000
+
+
+def run(make_session, on_progress, jobs: int, updates: int, rate: float) -> dict:
+    stats = {"errors": 0, "reads": []}
+    stop = threading.Event()
+
+    def job(i):
+        db = make_session()
+        h = BackupHistory(project_id=i + 1, task_type="backup", status="running", start_time=datetime.now(), progress=0)
+        db.add(h)
+        db.commit()
+        for n in range(1, updates + 1):
+            try: on_progress(db, h, n * 100 // updates)
+            except OperationalError:
+                db.rollback()
+                stats["errors"] += 1
+            time.sleep(1 / rate)
+        db.close()
+
+    def reader():
+        db = make_session()
+        H = BackupHistory
+        rn = func.row_number().over(partition_by=H.project_id, order_by=H.start_time.desc()).label("rn")
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                sub = select(H.id, H.progress, rn).subquery()
+                db.execute(select(sub).where(sub.c.rn == 1)).all()
+                db.commit()
+                stats["reads"].append(time.perf_counter() - start)
+            except OperationalError:
+                db.rollback()
+                stats["errors"] += 1
+            time.sleep(0.01)
+        db.close()
+
+    r = threading.Thread(target=reader)
+    r.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(jobs)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    stats["elapsed"] = time.perf_counter() - start
+    stop.set()
+    r.join()
+    return stats
+
+def report(label: str, stats: dict, commits: int):
+    reads = sorted(stats["reads"]) or [0]
+    p99 = reads[min(len(reads) - 1, int(len(reads) * 0.99))]
+    print(f"{label}: 写入事务 {commits}, 锁错误 {stats['errors']}, 查询 {len(reads)} 次 (p99 {p99 * 1000:.1f}ms, 最大 {reads[-1] * 1000:.1f}ms), 耗时 {stats['elapsed']:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="每个任务每秒的进度更新次数")
+    args = parser.parse_args()
+
+    # 旧方式: 独立的数据库文件，默认日志模式与默认 5 秒锁等待
+    legacy = create_engine(f"sqlite:///{_tmp.name}/legacy.db", connect_args={"check_same_thread": False}, pool_size=args.jobs + 5)
+    for eng in (legacy, engine):
+        Base.metadata.create_all(bind=eng)
+        with eng.begin() as conn:
+            for i in range(args.jobs): conn.execute(BackupProject.__table__.insert().values(id=i + 1, name=f"p{i}", source_path="/", destination_path="/"))
+
+    def legacy_progress(db, h, pct):
+        h.progress, h.log_message = pct, LOG_TAIL
+        db.commit()
+    stats = run(sessionmaker(bind=legacy, autoflush=False), legacy_progress, args.jobs, args.updates, args.rate)
+    report("旧方式 (逐次提交)", stats, args.jobs * args.updates - stats["errors"])
+
+    batches = {"n": 0}
+    write = writer._write
+    def counting_write(batch):
+        if batch: batches["n"] += 1
+        write(batch)
+    writer._write = counting_write
+    report("WAL + 批量写入", run(SessionLocal, lambda db, h, pct: writer.update(h, progress=pct, log_message=LOG_TAIL), args.jobs, args.updates, args.rate), batches["n"])
+    writer.shutdown()
+    with SessionLocal() as db:
+        print("journal_mode:", db.execute(text("PRAGMA journal_mode")).scalar(), "| 最终进度:", sorted({h.progress for h in db.query(BackupHistory)}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+变更日志 (watch_source) 清单生成基准
+
+在临时目录生成合成目录树并开启源目录监控，修改少量目录后对比完整扫描与
+复用目录树 + 重新扫描脏目录的耗时，并校验两者结果一致。
+不支持 inotify 的环境自动使用轮询后端 (也可用 --poll 指定)。
+临时目录的目录列表几乎没有开销，--latency-ms 为每次列目录增加延迟，模拟机械硬盘冷缓存或网络存储。
+
+用法 (在 backend 目录下):
+    python benchmarks/bench_journal.py [--dirs 2000] [--files 50] [--changes 20] [--latency-ms 1]
+"""
+import os
+import io
+import sys
+import time
+import types
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_index_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault("INDEX_DIR", _index_dir.name)
+from app import watcher, engine  # noqa: E402
+from app.engine import generate_manifest  # noqa: E402
+from bench_manifest import build_tree, timed, RECOMMENDED, PROJECT_RULES  # noqa: E402
+
+PROJECT_ID = 1
+
+def wait_session():
+    while not watcher.service.session(PROJECT_ID): time.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirs", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--changes", type=int, default=20)
+    parser.add_argument("--poll", action="store_true")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    patterns = RECOMMENDED + PROJECT_RULES
+    if args.poll: watcher.WATCH_BACKEND = "poll"
+    watcher.PollingBackend.__init__.__defaults__ = (0.5,)
+
+    with tempfile.TemporaryDirectory() as root:
+        build_tree(root, args.dirs, args.files)
+        project = types.SimpleNamespace(id=PROJECT_ID, source_path=root, exclude_patterns=",".join(patterns), watch_source=True)
+        watcher.service.configure(project)
+        wait_session()
+        generate_manifest(root, patterns, io.StringIO(), PROJECT_ID)   # 建立目录树
+        dirs = sorted(d for d, _, _ in os.walk(root))
+        for i in range(args.changes):
+            target = dirs[(i * 7919) % len(dirs)]
+            open(os.path.join(target, f"changed_{i}.txt"), "w").close()
+        time.sleep(watcher.FLUSH_SECONDS + 1.5)
+        if args.latency_ms:
+            scandir = os.scandir
+            def slow_scandir(path):
+                time.sleep(args.latency_ms / 1000)
+                return scandir(path)
+            engine.os.scandir = slow_scandir
+        t_full, full = timed(generate_manifest, root, patterns, io.StringIO())
+        t_journal, journal = timed(generate_manifest, root, patterns, io.StringIO(), PROJECT_ID)
+        watcher.service.shutdown()
+        assert sorted(full) == sorted(journal), "结果不一致"
+        print(f"合成目录树: {args.dirs} 个目录 x {args.files} 个文件, 修改 {args.changes} 个目录, 列目录延迟 {args.latency_ms}ms")
+        print(f"完整扫描:          {t_full:.3f}s")
+        print(f"变更日志 + 脏目录: {t_journal:.3f}s")
+        print(f"加速比: {t_full / t_journal:.1f}x  (包含 {len(full)} 个文件)")
+
+if __name__ == "__main__":
+    main()
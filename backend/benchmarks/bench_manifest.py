@@ -0,0 +1,80 @@
+"""
+generate_manifest 扫描性能基准
+
+在临时目录生成合成目录树，对比旧版 (os.walk + 逐条 fnmatch) 与当前实现
+(预编译匹配器 + os.scandir) 的耗时，并校验两者结果一致。
+
+用法 (在 backend 目录下):
+    python benchmarks/bench_manifest.py [--dirs 2000] [--files 50]
+"""
+import os
+import io
+import sys
+import time
+import fnmatch
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.engine import generate_manifest  # noqa: E402
+
+RECOMMENDED = ["__pycache__", "*.pyc", ".git", "node_modules", "target", ".vscode", ".idea", "dist", "build", "*.log", ".DS_Store"]
+PROJECT_RULES = ["*.tmp", "cache/*", "data/temp"]
+
+def legacy_manifest(source_path, patterns, log_buffer):
+    include_list = []
+    for root, dirs, files in os.walk(source_path):
+        rel_root = os.path.relpath(root, source_path)
+        if rel_root == ".": rel_root = ""
+        if rel_root and any(fnmatch.fnmatch(rel_root, p) or any(fnmatch.fnmatch(part, p) for part in rel_root.split('/')) for p in patterns):
+            log_buffer.write(f"[SKIP] 排除目录: {rel_root}\n")
+            dirs[:] = []
+            continue
+        for name in files:
+            rel_path = os.path.join(rel_root, name) if rel_root else name
+            if any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p) for p in patterns):
+                log_buffer.write(f"[SKIP] 排除文件: {rel_path}\n")
+            else:
+                include_list.append(rel_path)
+                log_buffer.write(f"[ADD]  包含文件: {rel_path}\n")
+    return include_list
+
+def build_tree(root, n_dirs, n_files):
+    exts = [".txt", ".jpg", ".nfo", ".log", ".pyc", ".tmp", ".json"]
+    specials = ["node_modules", ".git", "__pycache__", "src", "media"]
+    for d in range(n_dirs):
+        depth = d % 5
+        parts = [f"d{d // 50}", f"s{d % 50}"] + [specials[(d + i) % len(specials)] for i in range(depth)]
+        path = os.path.join(root, *parts)
+        os.makedirs(path, exist_ok=True)
+        for f in range(n_files):
+            open(os.path.join(path, f"f{f}{exts[f % len(exts)]}"), "w").close()
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirs", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    patterns = RECOMMENDED + PROJECT_RULES
+
+    with tempfile.TemporaryDirectory() as root:
+        build_tree(root, args.dirs, args.files)
+        print(f"合成目录树: {args.dirs} 个目录 x {args.files} 个文件, {len(patterns)} 条规则")
+        legacy_best, current_best = float("inf"), float("inf")
+        for _ in range(args.rounds):
+            t_old, old = timed(legacy_manifest, root, patterns, io.StringIO())
+            t_new, new = timed(generate_manifest, root, patterns, io.StringIO())
+            legacy_best, current_best = min(legacy_best, t_old), min(current_best, t_new)
+        assert sorted(old) == sorted(new), "结果不一致"
+        print(f"旧实现 (os.walk + fnmatch): {legacy_best:.3f}s")
+        print(f"新实现 (scandir + 预编译):  {current_best:.3f}s")
+        print(f"加速比: {legacy_best / current_best:.1f}x  (包含 {len(new)} 个文件)")
+
+if __name__ == "__main__":
+    main()
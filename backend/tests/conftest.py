@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 应用模块在导入时读取这些路径，必须在导入 app 之前设置
+_data = tempfile.mkdtemp(prefix="stagebackup-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_data}/test.db"
+os.environ["LOG_DIR"] = os.path.join(_data, "logs")
+os.environ["INDEX_DIR"] = os.path.join(_data, "index")
+os.environ["SETTINGS_FILE"] = os.path.join(_data, "settings.json")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app import models  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def make_project(tmp_path):
+    """创建项目: 源目录 tmp_path/src，本地目标 tmp_path/dst，返回项目 id"""
+    created = []
+
+    def make(**kw):
+        kw.setdefault("name", f"p{len(created)}_{os.path.basename(tmp_path)}")
+        kw.setdefault("source_path", str(tmp_path / "src"))
+        kw.setdefault("destination_path", str(tmp_path / "dst"))
+        kw.setdefault("destination_type", "local")
+        kw.setdefault("cache_dir", str(tmp_path / "cache"))
+        for key in ("source_path", "destination_path", "cache_dir"): os.makedirs(kw[key], exist_ok=True)
+        with SessionLocal() as db:
+            project = models.BackupProject(**kw)
+            db.add(project)
+            db.commit()
+            created.append(project.id)
+            return project.id
+
+    yield make
+    with SessionLocal() as db:
+        db.query(models.BackupHistory).filter(models.BackupHistory.project_id.in_(created)).delete(synchronize_session=False)
+        db.query(models.BackupProject).filter(models.BackupProject.id.in_(created)).delete(synchronize_session=False)
+        db.commit()
+
+
+def history(project_id: int, task_type: str = "backup") -> list:
+    with SessionLocal() as db:
+        return db.query(models.BackupHistory).filter_by(project_id=project_id, task_type=task_type).order_by(models.BackupHistory.id).all()
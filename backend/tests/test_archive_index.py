@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import threading
+
+import pytest
+
+from app import archive_index, engine
+from conftest import history
+
+
+@pytest.fixture
+def linked_backup(tmp_path, make_project):
+    """tgz 备份: a.bin 与 sub/b.bin 为同一文件的硬链接"""
+    def make(**kw):
+        pid = make_project(archive_format="tgz", **kw)
+        src = tmp_path / "src"
+        (src / "sub").mkdir()
+        (src / "a.bin").write_bytes(os.urandom(300_000))
+        os.link(src / "a.bin", src / "sub" / "b.bin")
+        for i in range(20): (src / "sub" / f"f{i}.txt").write_text(f"file {i}" * 100)
+        engine.run_backup_task(pid)
+        backup = history(pid)[-1]
+        assert backup.status == "success", backup.log_message
+        assert os.path.exists(archive_index.index_path_for(os.path.join(tmp_path / "dst", backup.file_name)))
+        content = (src / "a.bin").read_bytes()
+        shutil.rmtree(src)
+        src.mkdir()
+        return pid, backup.file_name, src, content
+    return make
+
+def restore(pid: int, file_name: str, paths: list):
+    engine.run_restore_task(pid, file_name, "overwrite", paths=paths)
+    record = history(pid, "restore")[-1]
+    assert record.status == "success", record.log_message
+    assert "归档索引: 匹配" in record.log_message and "[WARN]" not in record.log_message
+    return record
+
+
+@pytest.mark.parametrize("password", [None, "secret"])
+def test_partial_restore_of_link_without_its_target(linked_backup, password):
+    pid, file_name, src, content = linked_backup(encryption_password=password)
+    restore(pid, file_name, ["sub/b.bin"])
+    assert (src / "sub" / "b.bin").read_bytes() == content
+    assert not (src / "a.bin").exists()
+
+def test_partial_restore_links_to_restored_target(linked_backup):
+    pid, file_name, src, content = linked_backup()
+    restore(pid, file_name, ["a.bin", "sub"])
+    assert (src / "sub" / "b.bin").read_bytes() == content
+    assert os.stat(src / "a.bin").st_ino == os.stat(src / "sub" / "b.bin").st_ino
+    assert (src / "sub" / "f3.txt").read_text() == "file 3" * 100
+
+def test_unresolvable_members_are_logged(tmp_path):
+    log = io.StringIO()
+    members = [["dangling", "1", 0, 0, 0o644, None, "missing"], ["fifo", "6", 0, 0, 0o644, None, None]]
+    archive_index.restore_members(None, members, str(tmp_path), all_members=members, log_buffer=log)
+    assert "[WARN] 硬链接目标 missing 不在归档索引中，已跳过: dangling" in log.getvalue()
+    assert "不支持的成员类型 (6)，已跳过: fifo" in log.getvalue()
+    assert os.listdir(tmp_path) == []
+
+def test_truncated_archive_fails_instead_of_hanging(linked_backup, tmp_path):
+    pid, file_name, src, content = linked_backup()
+    archive = tmp_path / "dst" / file_name
+    archive.write_bytes(archive.read_bytes()[:archive.stat().st_size // 3])
+    # 旧实现在跳读截断的数据时死循环; 在线程中运行以免拖住测试
+    worker = threading.Thread(target=engine.run_restore_task, args=(pid, file_name, "overwrite"), kwargs={"paths": ["sub/f19.txt"]}, daemon=True)
+    worker.start()
+    worker.join(30)
+    assert not worker.is_alive()
+    record = history(pid, "restore")[-1]
+    assert record.status == "failed" and "归档数据不完整" in record.log_message
@@ -0,0 +1,32 @@
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app import api, browse
+
+
+def cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def test_pages_follow_cursor(tmp_path):
+    for i in range(5): (tmp_path / f"f{i}.txt").write_text("x")
+    (tmp_path / "dir").mkdir()
+    names, next_cursor = [], None
+    while True:
+        page = browse.browse(str(tmp_path), next_cursor, limit=2, refresh=True)
+        names += [item["name"] for item in page["items"]]
+        next_cursor = page["next_cursor"]
+        if not next_cursor: break
+    assert names == ["dir"] + [f"f{i}.txt" for i in range(5)]
+
+@pytest.mark.parametrize("bad", [
+    "not base64 !", cursor({"a": 1}), cursor("abcd"), cursor([True, True, "a"]),
+    cursor([True, True, 1, "a"]), cursor([None, True, "a", "a"]), cursor([True, True, ["a"], "a"]),
+])
+def test_invalid_cursor_is_a_bad_request(tmp_path, bad):
+    (tmp_path / "a.txt").write_text("x")
+    with pytest.raises(HTTPException) as e: api.browse_filesystem(str(tmp_path), bad)
+    assert e.value.status_code == 400
@@ -0,0 +1,86 @@
+import io
+import os
+import random
+
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app import crypto
+
+CHUNK = 4096
+
+
+def encrypt(data: bytes, password: str = "pw", threads: int = 1, write_size: int = 1000) -> bytes:
+    out = io.BytesIO()
+    w = crypto.EncryptingWriter(out, password, threads=threads, chunk_size=CHUNK)
+    for i in range(0, len(data), write_size): w.write(data[i:i + write_size])
+    w.close()
+    return out.getvalue()
+
+def decrypt(blob: bytes, password: str = "pw", threads: int = 1) -> bytes:
+    with crypto.DecryptingReader(io.BytesIO(blob), password, threads=threads) as r: return io.BufferedReader(r).read()
+
+def read_at(reader, offset: int, n: int) -> bytes:
+    reader.seek(offset)
+    buf = bytearray()
+    while len(buf) < n and (data := reader.read(n - len(buf))): buf += data
+    return bytes(buf)
+
+def legacy_encrypt(data: bytes, password: str) -> bytes:
+    salt, iv = os.urandom(16), os.urandom(12)
+    return salt + iv + AESGCM(crypto.derive_key(password, salt)).encrypt(iv, data, None)
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK, 10 * CHUNK + 77])
+def test_round_trip(size, threads):
+    data = random.Random(size).randbytes(size)
+    blob = encrypt(data, threads=threads, write_size=CHUNK + 123)
+    # 末块总是存在 (空明文时为空块)，明文恰好为块大小整数倍时最后一个整块即末块
+    assert len(blob) == crypto.HEADER_SIZE + size + max(1, -(-size // CHUNK)) * crypto.TAG_SIZE
+    assert decrypt(blob, threads=threads) == data
+
+def test_random_access():
+    data = random.Random(1).randbytes(5 * CHUNK + 300)
+    reader = crypto.open_seekable(io.BytesIO(encrypt(data)), "pw")
+    assert isinstance(reader, crypto.ChunkedSeekReader) and reader.length == len(data)
+    for offset, n in [(0, 10), (CHUNK - 5, 10), (3 * CHUNK, CHUNK), (CHUNK + 1, 3 * CHUNK), (5 * CHUNK + 290, 100), (len(data), 5)]:
+        assert read_at(reader, offset, n) == data[offset:offset + n]
+    reader.seek(-300, io.SEEK_END)
+    assert reader.read(1000) == data[-300:][:CHUNK]
+
+def test_legacy_format_is_readable():
+    data = random.Random(2).randbytes(3 * 1024 * 1024 + 5)
+    blob = legacy_encrypt(data, "pw")
+    assert decrypt(blob) == data
+    reader = crypto.open_seekable(io.BytesIO(blob), "pw")
+    assert isinstance(reader, crypto.CtrReader)
+    assert read_at(reader, 1234567, 100) == data[1234567:1234667]
+
+
+def test_wrong_password():
+    blob = encrypt(b"secret data" * 1000)
+    with pytest.raises(Exception, match="密码错误或文件已损坏 \\(数据块 0\\)"): decrypt(blob, "wrong")
+    with pytest.raises(Exception, match="解密校验失败"): decrypt(legacy_encrypt(b"old", "pw"), "wrong")
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_corrupted_chunk_is_detected(threads):
+    blob = bytearray(encrypt(random.Random(3).randbytes(6 * CHUNK), threads=threads))
+    blob[crypto.HEADER_SIZE + 2 * (CHUNK + crypto.TAG_SIZE) + 10] ^= 1
+    with pytest.raises(Exception, match="数据块 2"): decrypt(bytes(blob), threads=threads)
+    reader = crypto.open_seekable(io.BytesIO(bytes(blob)), "pw")
+    assert reader.read(100)  # 其他块仍可随机读取
+    reader.seek(2 * CHUNK)
+    with pytest.raises(Exception, match="数据块 2"): reader.read(100)
+
+def test_truncation_and_reordering_are_detected():
+    data = random.Random(4).randbytes(4 * CHUNK + 10)
+    blob = encrypt(data)
+    stride = CHUNK + crypto.TAG_SIZE
+    # 在块边界处截断: 剩余的最后一块没有末块标志
+    with pytest.raises(Exception, match="解密校验失败"): decrypt(blob[:crypto.HEADER_SIZE + 2 * stride])
+    with pytest.raises(Exception, match="加密文件不完整"): decrypt(blob[:crypto.HEADER_SIZE + 4 * stride + 5])
+    chunks = [blob[crypto.HEADER_SIZE + i * stride:crypto.HEADER_SIZE + (i + 1) * stride] for i in range(5)]
+    swapped = blob[:crypto.HEADER_SIZE] + chunks[1] + chunks[0] + b"".join(chunks[2:])
+    with pytest.raises(Exception, match="数据块 0"): decrypt(swapped)
+    with pytest.raises(Exception, match="不支持的加密格式版本"): decrypt(blob[:5] + b"\x09" + blob[6:])
@@ -0,0 +1,96 @@
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import dbwriter, engine
+from app.database import SessionLocal
+from app.models import BackupHistory
+from conftest import history
+
+
+@pytest.fixture
+def job(make_project, monkeypatch):
+    """运行中的任务记录 (任务自己的 Session) 与独立的写线程; 记录推送的状态事件"""
+    published = []
+    monkeypatch.setattr(dbwriter.bus, "publish_state", published.append)
+    w = dbwriter.HistoryWriter(interval=0.02)
+    db = SessionLocal()
+    record = BackupHistory(project_id=make_project(), task_type="backup", status="running", start_time=datetime.now(), progress=0)
+    db.add(record)
+    db.commit()
+    yield w, db, record, published
+    w.shutdown()
+    db.close()
+
+def stored(record_id: int) -> BackupHistory:
+    with SessionLocal() as db: return db.get(BackupHistory, record_id)
+
+def locked(*a, **kw):
+    raise OperationalError("UPDATE history", {}, Exception("database is locked"))
+
+
+def test_updates_are_batched(job):
+    w, db, record, published = job
+    for pct in range(1, 51): w.update(record, progress=pct, log_message=f"line {pct}")
+    time.sleep(0.2)
+    assert stored(record.id).progress == 50 and stored(record.id).log_message == "line 50"
+    assert 1 <= len(published) < 50 and published[-1]["progress"] == 50
+
+def test_final_commit_is_not_overwritten(job):
+    w, db, record, published = job
+    w.update(record, progress=40)
+    w.finish(record.id)
+    del published[:]
+    assert stored(record.id).progress == 40
+    record.status, record.progress = "success", 100
+    db.commit()
+    # 任务的工作线程在 finish() 之后仍可能报告进度
+    w.update(record, progress=99, log_message="late")
+    time.sleep(0.2)
+    final = stored(record.id)
+    assert (final.status, final.progress) == ("success", 100) and final.log_message != "late"
+    assert [s["status"] for s in published] == ["success"]
+    w.release(record.id)
+    assert w.closed == set()
+
+def test_finish_gives_up_after_bounded_retries(job):
+    w, db, record, published = job
+    commit = w._commit
+    w._commit = locked
+    w.update(record, progress=30)
+    w.finish(record.id)  # 不抛出，不放回队列
+    assert w.pending == {}
+    w._commit = commit
+    del published[:]
+    record.status, record.progress = "failed", 30
+    db.commit()
+    time.sleep(0.2)
+    assert stored(record.id).status == "failed" and [s["status"] for s in published] == ["failed"]
+
+def test_background_failures_are_retried_then_dropped(job, monkeypatch):
+    w, db, record, published = job
+    calls = []
+    commit = w._commit
+    def flaky(batch):
+        calls.append(dict(batch))
+        if len(calls) == 1: locked()
+        commit(batch)
+    monkeypatch.setattr(w, "_commit", flaky)
+    w.update(record, progress=10)
+    time.sleep(0.2)
+    assert len(calls) == 2 and stored(record.id).progress == 10
+
+    calls.clear()
+    monkeypatch.setattr(w, "_commit", lambda batch: (calls.append(1), locked()))
+    w.update(record, progress=20)
+    time.sleep(0.3)
+    assert len(calls) == dbwriter.WRITE_ATTEMPTS and w.pending == {}
+
+def test_finished_tasks_do_not_accumulate(make_project, tmp_path):
+    pid = make_project(archive_format="tgz")
+    (tmp_path / "src" / "a.txt").write_text("a")
+    for _ in range(3): engine.run_backup_task(pid)
+    assert [h.status for h in history(pid)] == ["success"] * 3
+    assert dbwriter.writer.closed == set()
@@ -0,0 +1,67 @@
+import io
+import random
+
+import pytest
+
+from app import dedup
+
+
+def chunk_sizes(data: bytes) -> list:
+    return [len(c) for c in dedup.iter_chunks(io.BytesIO(data))]
+
+
+def test_vectorized_boundaries_match_reference(monkeypatch):
+    data = random.Random(1).randbytes(12 * 1024 * 1024)
+    fast = chunk_sizes(data)
+    monkeypatch.setattr(dedup, "np", None)
+    assert chunk_sizes(data) == fast
+
+def test_chunks_reassemble_within_bounds(monkeypatch):
+    monkeypatch.setattr(dedup, "READ_SIZE", 1000 * 1000)  # 读取块与切分点不对齐
+    data = random.Random(2).randbytes(10 * 1024 * 1024 + 123)
+    chunks = list(dedup.iter_chunks(io.BytesIO(data)))
+    assert b"".join(chunks) == data
+    assert all(dedup.MIN_CHUNK <= len(c) <= dedup.MAX_CHUNK for c in chunks[:-1])
+    assert chunk_sizes(b"") == []
+    assert chunk_sizes(bytes(9 * 1024 * 1024)) == [dedup.MAX_CHUNK, dedup.MAX_CHUNK, 1024 * 1024]
+
+def test_insert_only_changes_nearby_chunks():
+    data = random.Random(3).randbytes(12 * 1024 * 1024)
+    edited = data[:100] + b"inserted bytes" + data[100:]
+    before = set(dedup.iter_chunks(io.BytesIO(data)))
+    after = list(dedup.iter_chunks(io.BytesIO(edited)))
+    assert sum(c not in before for c in after) == 1
+
+
+@pytest.mark.parametrize("password", [None, "secret"])
+def test_repository_round_trip(tmp_path, password):
+    src, out = tmp_path / "src", tmp_path / "out"
+    (src / "sub").mkdir(parents=True)
+    rnd = random.Random(4)
+    (src / "big.bin").write_bytes(rnd.randbytes(3 * 1024 * 1024))
+    (src / "sub" / "small.txt").write_text("hello")
+    (src / "empty").write_bytes(b"")
+    files = ["big.bin", "sub/small.txt", "empty"]
+    repo_path = str(tmp_path / "p.repo")
+
+    repo = dedup.Repository(repo_path, password)
+    first = dedup.backup_to_repository(repo, str(src), files, "p_1.snapshot", io.StringIO())
+    assert first["new_chunks"] >= 2
+
+    # 修改大文件末尾: 只新增末尾附近的块
+    with open(src / "big.bin", "ab") as f: f.write(b"tail")
+    second = dedup.backup_to_repository(dedup.Repository(repo_path, password), str(src), files, "p_2.snapshot", io.StringIO())
+    assert second["reused_files"] == 2 and second["new_chunks"] <= 2
+
+    dedup.restore_from_repository(dedup.Repository(repo_path, password), "p_2.snapshot", str(out), io.StringIO())
+    for rp in files: assert (out / rp).read_bytes() == (src / rp).read_bytes()
+
+    removed, freed = dedup.delete_snapshots(repo_path, ["p_1.snapshot"], password)
+    assert removed >= 1 and freed > 0
+    out2 = tmp_path / "out2"
+    dedup.restore_from_repository(dedup.Repository(repo_path, password), "p_2.snapshot", str(out2), io.StringIO())
+    assert (out2 / "big.bin").read_bytes() == (src / "big.bin").read_bytes()
+
+def test_wrong_password_rejected(tmp_path):
+    dedup.Repository(str(tmp_path / "r.repo"), "right")
+    with pytest.raises(Exception, match="密码错误"): dedup.Repository(str(tmp_path / "r.repo"), "wrong")
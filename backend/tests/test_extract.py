@@ -0,0 +1,99 @@
+import io
+import os
+import time
+import tarfile
+
+from app import extract, engine
+from conftest import history
+
+
+class NoSeek(io.RawIOBase):
+    """只能顺序读取的数据流 (与从目标端流式读取一致)"""
+
+    def __init__(self, data: bytes):
+        self.buf = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self.buf.readinto(b)
+
+
+def make_tar(src: str, names: list) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name in names: tar.add(os.path.join(src, name), arcname=name)
+    return buf.getvalue()
+
+def stream_extract(data: bytes, target: str, selected=None) -> extract.ParallelExtractor:
+    with tarfile.open(fileobj=io.BufferedReader(NoSeek(data)), mode="r|*") as tar:
+        ex = extract.ParallelExtractor(tar, target)
+        for m in tar:
+            if selected is None or selected(m.name): ex.extract(m)
+        ex.finish()
+    return ex
+
+
+def test_hardlink_waits_for_pending_write(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "d").mkdir(parents=True)
+    (src / "a.bin").write_bytes(os.urandom(100_000))
+    os.link(src / "a.bin", src / "d" / "b.bin")
+    data = make_tar(str(src), ["a.bin", "d/b.bin"])
+    assert [m.type for m in tarfile.open(fileobj=io.BytesIO(data))] == [tarfile.REGTYPE, tarfile.LNKTYPE]
+
+    # 写入线程变慢，链接成员到达时目标文件还没有落盘
+    write = extract.ParallelExtractor._write
+    monkeypatch.setattr(extract.ParallelExtractor, "_write", lambda self, *a: (time.sleep(0.2), write(self, *a)))
+    out = tmp_path / "out"
+    ex = stream_extract(data, str(out))
+    assert ex.missing_links == []
+    assert (out / "d" / "b.bin").read_bytes() == (src / "a.bin").read_bytes()
+    assert os.stat(out / "a.bin").st_ino == os.stat(out / "d" / "b.bin").st_ino
+
+def test_hardlink_falls_back_to_copy(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("hello")
+    os.link(src / "a.txt", src / "b.txt")
+    data = make_tar(str(src), ["a.txt", "b.txt"])
+
+    def no_link(*a): raise OSError(18, "cross-device")
+    monkeypatch.setattr(extract.os, "link", no_link)
+    out = tmp_path / "out"
+    stream_extract(data, str(out))
+    assert (out / "b.txt").read_text() == "hello"
+    assert os.stat(out / "a.txt").st_ino != os.stat(out / "b.txt").st_ino
+
+def test_hardlink_without_target_is_reported(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("hello")
+    os.link(src / "a.txt", src / "b.txt")
+    data = make_tar(str(src), ["a.txt", "b.txt"])
+    out = tmp_path / "out"
+    ex = stream_extract(data, str(out), selected=lambda name: name == "b.txt")
+    assert ex.missing_links == ["b.txt"]
+    assert not (out / "b.txt").exists()
+
+
+def test_clean_restore_of_backup_with_hardlinks(tmp_path, make_project):
+    pid = make_project(archive_format="tgz")
+    src = tmp_path / "src"
+    (src / "sub").mkdir()
+    for i in range(50): (src / "sub" / f"f{i}.bin").write_bytes(os.urandom(2000 + i))
+    os.link(src / "sub" / "f0.bin", src / "linked.bin")
+    os.link(src / "sub" / "f1.bin", src / "sub" / "zz_linked.bin")
+    expected = {p.relative_to(src).as_posix(): p.read_bytes() for p in src.rglob("*") if p.is_file()}
+
+    engine.run_backup_task(pid)
+    backup = history(pid)[-1]
+    assert backup.status == "success", backup.log_message
+
+    (src / "stray.txt").write_text("removed by clean restore")
+    engine.run_restore_task(pid, backup.file_name, "clean")
+    restore = history(pid, "restore")[-1]
+    assert restore.status == "success", restore.log_message
+    restored = {p.relative_to(src).as_posix(): p.read_bytes() for p in src.rglob("*") if p.is_file()}
+    assert restored == expected
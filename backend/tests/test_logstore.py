@@ -0,0 +1,74 @@
+import gzip
+import io
+import json
+import os
+
+from app import logstore
+
+
+def finished_log(history_id: int, lines: int) -> bytes:
+    log = logstore.RunLog()
+    log.attach(history_id)
+    for i in range(lines): log.write(f"[SYNC] 文件 {i:06d} {'x' * (i % 50)}\n")
+    log.finish()
+    with gzip.open(logstore.log_path(history_id, True), "rb") as f: return f.read()
+
+def read_all(history_id: int, limit: int) -> tuple:
+    text, offset, pages = "", 0, 0
+    while True:
+        page = logstore.read_log(history_id, offset, limit)
+        text, offset, pages = text + page["text"], page["next_offset"], pages + 1
+        if page["finished"]: return text, pages
+
+
+def test_finished_log_is_split_into_indexed_members(monkeypatch):
+    monkeypatch.setattr(logstore, "MEMBER_SIZE", 64 * 1024)
+    data = finished_log(9001, 20000)
+    assert not os.path.exists(logstore.log_path(9001))
+    with open(logstore.index_path(9001)) as f: index = json.load(f)
+    assert index["size"] == len(data) and len(index["members"]) == -(-len(data) // (64 * 1024))
+    # 每个成员可以单独解压
+    blob = open(logstore.log_path(9001, True), "rb").read()
+    raw, comp = index["members"][3]
+    assert gzip.GzipFile(fileobj=io.BytesIO(blob[comp:])).read(100) == data[raw:raw + 100]
+
+    text, pages = read_all(9001, 10000)
+    assert text.encode() == data and pages > len(index["members"])
+
+def test_paged_reads_start_at_nearest_member(monkeypatch):
+    monkeypatch.setattr(logstore, "MEMBER_SIZE", 64 * 1024)
+    data = finished_log(9002, 20000)
+    reads = []
+    GzipFile = gzip.GzipFile
+    class Counting(GzipFile):
+        def read(self, size=-1):
+            out = super().read(size)
+            reads.append(self.tell())  # 本次读取结束时相对该成员起点的解压位置
+            return out
+    monkeypatch.setattr(logstore.gzip, "GzipFile", Counting)
+    offset = len(data) - 5000
+    offset = data.rfind(b"\n", 0, offset) + 1
+    page = logstore.read_log(9002, offset, 1000)
+    assert page["text"].encode() == data[offset:page["next_offset"]] and page["text"].endswith("\n")
+    assert reads and max(reads) < 2 * 64 * 1024
+
+def test_single_stream_logs_remain_readable():
+    data = b"".join(f"line {i}\n".encode() for i in range(5000))
+    os.makedirs(logstore.LOG_DIR, exist_ok=True)
+    with gzip.open(logstore.log_path(9003, True), "wb") as f: f.write(data)
+    text, _ = read_all(9003, 777)
+    assert text.encode() == data
+    logstore.delete_logs([9003, 9001, 9002])
+    assert not any(os.path.exists(p) for hid in (9001, 9002, 9003) for p in (logstore.log_path(hid, True), logstore.index_path(hid)))
+
+def test_running_log_returns_complete_lines():
+    log = logstore.RunLog()
+    log.attach(9004)
+    log.write("first\nsecond\npart")
+    log.flush()
+    page = logstore.read_log(9004)
+    assert page == {"text": "first\nsecond\n", "next_offset": 13, "finished": False}
+    log.write("ial\n")
+    log.finish()
+    assert logstore.read_log(9004, 13) == {"text": "partial\n", "next_offset": 21, "finished": True}
+    logstore.delete_logs([9004])
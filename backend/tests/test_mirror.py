@@ -0,0 +1,116 @@
+import io
+import os
+import random
+import types
+
+import pytest
+
+from app import engine, mirror, throttle
+from conftest import history
+
+
+def tree(root) -> dict:
+    return {p.relative_to(root).as_posix(): p.read_bytes() for p in sorted(root.rglob("*")) if p.is_file()}
+
+def files(root) -> list:
+    return [p.relative_to(root).as_posix() for p in sorted(root.rglob("*")) if p.is_file()]
+
+def job_throttle():
+    project = types.SimpleNamespace(id=0, name="t", read_limit_mb=0, write_limit_mb=0, throttle_schedule=None)
+    return throttle.JobThrottle(project)
+
+def write(path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    src, dst = tmp_path / "s", tmp_path / "d"
+    rnd = random.Random(0)
+    for rp in ("a.txt", "docs/big.bin", "docs/same1.bin", "old/x.txt"): write(src / rp, rnd.randbytes(5000))
+    write(src / "empty", b"")
+    dst.mkdir()
+    for rp, data in tree(src).items(): write(dst / rp, data)
+    for rp in files(src): os.utime(dst / rp, ns=((src / rp).stat().st_mtime_ns,) * 2)
+    return src, dst
+
+def plan_for(src, dst) -> mirror.MirrorPlan:
+    return mirror.plan_mirror(str(src), str(dst), files(src), mirror.scan_destination(str(dst)), False)
+
+
+def test_plan_classifies_changes(dirs):
+    src, dst = dirs
+    (src / "docs" / "big.bin").rename(src / "moved.bin")                   # 重命名
+    (src / "old" / "x.txt").write_bytes(os.urandom(5000))                  # 修改 (同大小、更新)
+    mtime = (dst / "old" / "x.txt").stat().st_mtime_ns + 2_000_000_000
+    os.utime(src / "old" / "x.txt", ns=(mtime, mtime))
+    (src / "docs" / "same1.bin").rename(src / "same2.bin")
+    (src / "same2.bin").write_bytes(os.urandom(5000))                      # 同大小但内容不同: 不能当作重命名
+    write(src / "new" / "n.txt", b"new")
+    os.remove(src / "a.txt")
+    plan = plan_for(src, dst)
+    assert [(o, n) for o, n, _, _ in plan.renamed] == [("docs/big.bin", "moved.bin")]
+    assert sorted(rp for rp, _ in plan.added) == ["new/n.txt", "same2.bin"]
+    assert [rp for rp, _ in plan.modified] == ["old/x.txt"]
+    assert plan.deleted == [("a.txt", 5000), ("docs/same1.bin", 5000)]
+    assert sorted(s[0] for s in plan.unchanged) == ["empty"]
+    assert plan.stats()["renamed"] == [1, 5000]
+
+def test_apply_makes_destination_match(dirs):
+    src, dst = dirs
+    (src / "docs" / "big.bin").rename(src / "moved.bin")
+    (src / "docs" / "same1.bin").unlink()
+    os.remove(src / "old" / "x.txt")
+    (src / "old").rmdir()
+    write(src / "old", b"directory became a file")
+    (src / "empty").unlink()
+    write(src / "empty" / "inner.txt", b"file became a directory")
+    plan = plan_for(src, dst)
+    done, totals, log = [], dict.fromkeys(engine.SYNC_TOTAL_FIELDS, 0), io.StringIO()
+    mirror.apply_mirror(plan, str(src), str(dst), 2, job_throttle(), log, done, totals)
+    assert tree(dst) == tree(src)
+    assert not (dst / "docs").exists()  # 删除后变空的目录被清理
+    assert "[MOVE] docs/big.bin -> moved.bin" in log.getvalue()
+    assert (totals["files_renamed"], totals["files_added"], totals["files_deleted"]) == (1, 2, 3)
+
+def test_interrupted_apply_keeps_deletions_for_later(dirs):
+    src, dst = dirs
+    write(src / "n1.txt", b"1")
+    write(src / "n2.txt", b"2")
+    os.remove(src / "a.txt")
+    plan = plan_for(src, dst)
+    calls = []
+    def check_stop():
+        calls.append(1)
+        if len(calls) == 2: raise Exception("用户强制终止")
+    done, totals = [], dict.fromkeys(engine.SYNC_TOTAL_FIELDS, 0)
+    with pytest.raises(Exception, match="强制终止"):
+        mirror.apply_mirror(plan, str(src), str(dst), 1, job_throttle(), io.StringIO(), done, totals, check_stop=check_stop)
+    # 复制未完成时不删除目标端文件; 已复制的文件状态用于更新索引
+    assert (dst / "a.txt").exists() and totals["files_deleted"] == 0
+    assert [s[0] for s in done] == ["n1.txt"] and totals["files_added"] == 1
+
+
+def test_mirror_task_uses_index_after_first_run(tmp_path, make_project):
+    pid = make_project(archive_format="sync", sync_mode="mirror")
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    rnd = random.Random(1)
+    for i in range(10): write(src / "sub" / f"f{i}.bin", rnd.randbytes(3000 + i))
+    write(dst / "stray.txt", b"not in source")
+
+    def run():
+        engine.run_backup_task(pid)
+        record = history(pid)[-1]
+        assert record.status == "success", record.log_message
+        return record.log_message
+
+    log = run()
+    assert "正在扫描目标目录" in log and tree(dst) == tree(src)
+    (src / "sub" / "f1.bin").rename(src / "f1_moved.bin")
+    (src / "sub" / "f2.bin").unlink()
+    write(src / "sub" / "f3.bin", b"changed")
+    log = run()
+    assert "已加载文件索引: 10 条记录" in log and "[MOVE] sub/f1.bin -> f1_moved.bin" in log
+    assert "差异: 新增 0 个 (0 bytes)，修改 1 个 (7 bytes)，重命名 1 个 (3001 bytes)，删除 1 个 (3002 bytes)" in log
+    assert tree(dst) == tree(src)
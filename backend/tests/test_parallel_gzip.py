@@ -0,0 +1,92 @@
+import gzip
+import io
+import os
+import random
+import tarfile
+import zlib
+
+import pytest
+
+from app import archive_index, crypto, volumes
+from app.parallel_gzip import ParallelGzipWriter
+
+BLOCK = 64 * 1024
+
+
+def sample(size: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    words = [rnd.randbytes(rnd.randint(2, 12)).hex().encode() for _ in range(500)]
+    out = bytearray()
+    while len(out) < size: out += rnd.choice(words) + b" "
+    return bytes(out[:size])
+
+def compress(data: bytes, threads: int = 4, restart_interval: int = 2, write_size: int = 50_000, fileobj=None):
+    out = fileobj or io.BytesIO()
+    gz = ParallelGzipWriter(out, 6, threads, block_size=BLOCK, restart_interval=restart_interval)
+    for i in range(0, len(data), write_size): gz.write(data[i:i + write_size])
+    gz.close()
+    return out, gz.restart_points
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+@pytest.mark.parametrize("size", [0, 1, BLOCK, 10 * BLOCK + 5])
+def test_output_is_a_standard_gzip_stream(size, threads):
+    data = sample(size)
+    out, _ = compress(data, threads)
+    assert gzip.decompress(out.getvalue()) == data
+    assert len(out.getvalue()) < len(data) or size < 1000
+
+def test_restart_points_inflate_independently():
+    data = sample(20 * BLOCK + 100, 1)
+    out, points = compress(data)
+    stream = out.getvalue()
+    assert [raw for raw, _ in points] == list(range(0, len(data), 2 * BLOCK))
+    for raw, comp in points:
+        # 从重启点 raw inflate，不需要之前的数据作为字典
+        assert zlib.decompressobj(-zlib.MAX_WBITS).decompress(stream[comp:])[:3 * BLOCK] == data[raw:raw + 3 * BLOCK]
+    assert compress(data, restart_interval=0)[1] == []
+
+def test_tar_written_through_writer_is_readable():
+    buf = io.BytesIO()
+    gz = ParallelGzipWriter(buf, 6, 3, block_size=BLOCK)
+    with tarfile.open(fileobj=gz, mode="w|") as tar:
+        for i in range(3):
+            data = sample(100_000 + i, i)
+            info = tarfile.TarInfo(f"f{i}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    gz.close()
+    with tarfile.open(fileobj=io.BytesIO(buf.getvalue()), mode="r:gz") as tar:
+        assert [m.name for m in tar] == ["f0", "f1", "f2"]
+        assert tar.extractfile("f2").read() == sample(100_002, 2)
+
+
+def read(archive, offset: int, size: int) -> bytes:
+    return b"".join(archive.read_range(offset, size))
+
+@pytest.mark.parametrize("layout", ["plain", "encrypted", "volumes"])
+def test_indexed_archive_random_reads(tmp_path, layout):
+    data = sample(30 * BLOCK + 333, 2)
+    password = "pw" if layout == "encrypted" else None
+    path = str(tmp_path / "a.tar.gz")
+    with open(path, "wb") as f:
+        if password:
+            with crypto.EncryptingWriter(f, password, chunk_size=50_000) as enc: _, points = compress(data, fileobj=enc)
+        else:
+            _, points = compress(data, fileobj=f)
+    if layout == "volumes":
+        blob = open(path, "rb").read()
+        os.remove(path)
+        os.makedirs(path)
+        for i in range(0, len(blob), 70_000):
+            with open(os.path.join(path, volumes.volume_name("a.tar.gz", i // 70_000 + 1)), "wb") as f: f.write(blob[i:i + 70_000])
+    index = {"encrypted": bool(password), "restart_points": [list(p) for p in points]}
+    archive = archive_index.IndexedArchive(path, index, password)
+    try:
+        # 顺序、向前小跳 (继续解压)、向后与远跳 (从重启点重新定位)
+        for offset, size in [(0, 10), (100, 5000), (7 * BLOCK - 3, 2 * BLOCK), (9 * BLOCK, 10), (2 * BLOCK + 1, 3),
+                             (25 * BLOCK, BLOCK), (len(data) - 50, 50), (BLOCK, 0)]:
+            assert read(archive, offset, size) == data[offset:offset + size]
+        with pytest.raises(Exception, match="归档数据不完整"): read(archive, len(data) - 10, 20)
+    finally:
+        archive.close()
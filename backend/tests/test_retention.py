@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import pytest
+
+from app import retention
+from app.database import SessionLocal
+from app.models import BackupHistory, BackupProject
+
+
+@pytest.fixture
+def versions(tmp_path, make_project):
+    """为项目写入成功的备份记录与对应的归档文件，返回 (项目 id, {文件名: 记录 id})"""
+    def make(times: list, **kw):
+        kw.setdefault("keep_versions", 0)  # 模型默认保留最近 7 份
+        pid = make_project(**kw)
+        ids = {}
+        with SessionLocal() as db:
+            for t in times:
+                name = f"v_{t:%Y%m%d_%H%M}.tar.gz"
+                (tmp_path / "dst" / name).write_bytes(b"x" * 100)
+                record = BackupHistory(project_id=pid, task_type="backup", status="success", start_time=t, file_name=name)
+                db.add(record)
+                db.flush()
+                ids[name] = record.id
+            db.add(BackupHistory(project_id=pid, task_type="restore", status="success", start_time=times[0]))
+            db.commit()
+        return pid, ids
+    return make
+
+def kept(pid: int) -> set:
+    with SessionLocal() as db:
+        return set(db.scalars(BackupHistory.__table__.select().with_only_columns(BackupHistory.file_name)
+                              .where(BackupHistory.project_id == pid, BackupHistory.task_type == "backup")))
+
+def run_prune(pid: int, **kw) -> dict:
+    with SessionLocal() as db: return retention.prune(db, db.get(BackupProject, pid), pause=0, **kw)
+
+
+def test_weekly_bucket_spans_new_year(versions):
+    # 2025-12-29 (周一) 至 2026-01-04 (周日) 是同一个 ISO 周
+    times = [datetime(2025, 12, 22, 9), datetime(2025, 12, 29, 9), datetime(2026, 1, 1, 9), datetime(2026, 1, 4, 23, 30)]
+    pid, ids = versions(times, keep_weekly=2)
+    with SessionLocal() as db:
+        assert retention.keep_ids(db, db.get(BackupProject, pid)) == {ids["v_20260104_2330.tar.gz"], ids["v_20251222_0900.tar.gz"]}
+
+def test_gfs_rules_are_combined(versions):
+    times = [datetime(2026, 3, d, h) for d in (1, 2, 3) for h in (8, 20)]
+    pid, ids = versions(times, keep_versions=1, keep_daily=2, keep_monthly=1)
+    with SessionLocal() as db: keep = retention.keep_ids(db, db.get(BackupProject, pid))
+    assert keep == {ids["v_20260303_2000.tar.gz"], ids["v_20260302_2000.tar.gz"]}
+
+def test_prune_deletes_in_batches_and_keeps_failures(tmp_path, versions, monkeypatch):
+    times = [datetime(2026, 5, d, 12) for d in range(1, 8)]
+    pid, ids = versions(times, keep_versions=2)
+    delete = retention.delete_version
+    def flaky(project, file_name):
+        if file_name == "v_20260503_1200.tar.gz": raise PermissionError(13, "Permission denied")
+        return delete(project, file_name)
+    monkeypatch.setattr(retention, "delete_version", flaky)
+
+    result = run_prune(pid, batch=2)
+    assert result == {"deleted": 4, "failed": 1, "freed": 400}
+    assert kept(pid) == {"v_20260503_1200.tar.gz", "v_20260506_1200.tar.gz", "v_20260507_1200.tar.gz"}
+    assert sorted(p.name for p in (tmp_path / "dst").iterdir()) == sorted(kept(pid))
+
+    # 失败的版本保留记录，下次清理时重试
+    monkeypatch.setattr(retention, "delete_version", delete)
+    assert run_prune(pid) == {"deleted": 1, "failed": 0, "freed": 100}
+    assert kept(pid) == {"v_20260506_1200.tar.gz", "v_20260507_1200.tar.gz"}
+
+def test_prune_disabled_without_rules(versions):
+    pid, ids = versions([datetime(2026, 1, d) for d in range(1, 4)])
+    assert run_prune(pid) == {"deleted": 0, "failed": 0, "freed": 0}
+    assert len(kept(pid)) == 3
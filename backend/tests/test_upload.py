@@ -0,0 +1,128 @@
+import io
+import json
+import os
+import random
+
+import pytest
+import tenacity
+
+from app import upload
+
+SEGMENT = 1000
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, "SEGMENT_SIZE", SEGMENT)
+    monkeypatch.setattr(upload, "wait_exponential", lambda **kw: tenacity.wait_none())
+    src = tmp_path / "cache" / "a.tar.gz"
+    src.parent.mkdir()
+    data = random.Random(0).randbytes(10 * SEGMENT + 17)
+    src.write_bytes(data)
+    return str(src), str(tmp_path / "dst" / "a.tar.gz"), data
+
+def stop_once(at: int):
+    """第 at 次调用时中断一次 (模拟任务被终止)"""
+    stopped = []
+    def fail(idx, n):
+        if n == at and not stopped:
+            stopped.append(idx)
+            raise Stop()
+    return fail
+
+def counting(monkeypatch, fail=lambda idx, n: None) -> list:
+    """记录 _copy_segment 的调用; fail(分段, 第几次调用) 可抛出异常"""
+    calls = []
+    copy = upload.SegmentedUpload._copy_segment
+    def wrapped(self, idx):
+        calls.append(idx)
+        fail(idx, len(calls))
+        return copy(self, idx)
+    monkeypatch.setattr(upload.SegmentedUpload, "_copy_segment", wrapped)
+    return calls
+
+
+def test_upload_moves_file_and_cleans_up(files, monkeypatch):
+    src, dst, data = files
+    calls = counting(monkeypatch)
+    log = io.StringIO()
+    digest = upload.upload_file(src, dst, threads=3, log_buffer=log)
+    assert open(dst, "rb").read() == data and sorted(calls) == list(range(11))
+    assert not os.path.exists(src) and not os.path.exists(upload.checkpoint_path(src)) and not os.path.exists(dst + upload.PART_EXT)
+    assert len(digest) == 64 and "上传校验通过" in log.getvalue()
+
+def test_resume_after_interruption(files, monkeypatch):
+    src, dst, data = files
+    calls = counting(monkeypatch, stop_once(5))
+    with pytest.raises(Stop): upload.upload_file(src, dst, extra={"project_id": 7})
+    # 已开始的下一段可能在中断后仍写完
+    done = sorted(map(int, json.load(open(upload.checkpoint_path(src)))["segments"]))
+    assert os.path.exists(src) and done[:4] == [0, 1, 2, 3] and 4 not in done
+    assert [s for s, _ in upload.pending_uploads(os.path.dirname(src), 7)] == [src]
+    assert upload.pending_uploads(os.path.dirname(src), 8) == []
+
+    calls.clear()
+    log = io.StringIO()
+    upload.upload_file(src, dst, log_buffer=log)
+    assert calls == [i for i in range(11) if i not in done]
+    assert f"从断点续传: 已完成 {len(done)}/11 段" in log.getvalue()
+    assert open(dst, "rb").read() == data
+
+def test_checkpoint_ignored_when_source_changed(files, monkeypatch):
+    src, dst, data = files
+    calls = counting(monkeypatch, stop_once(3))
+    with pytest.raises(Stop): upload.upload_file(src, dst)
+    with open(src, "r+b") as f: f.write(b"changed")
+    calls.clear()
+    upload.upload_file(src, dst)
+    assert sorted(calls) == list(range(11))
+    assert open(dst, "rb").read() == b"changed" + data[7:]
+
+def test_io_errors_retry_only_the_failed_segment(files, monkeypatch):
+    src, dst, data = files
+    def flaky(idx, n):
+        if idx == 6 and n < 9: raise IOError("transport endpoint is not connected")
+    calls = counting(monkeypatch, flaky)
+    log = io.StringIO()
+    upload.upload_file(src, dst, log_buffer=log)
+    assert calls.count(6) == 3 and len(calls) == 13
+    assert log.getvalue().count("[WARN] 分段 7/11 写入失败") == 2
+    assert open(dst, "rb").read() == data
+
+def test_retries_exhausted_keep_checkpoint(files, monkeypatch):
+    src, dst, data = files
+    def broken(idx, n):
+        if idx == 2: raise IOError("read-only file system")
+    calls = counting(monkeypatch, broken)
+    with pytest.raises(IOError, match="read-only"): upload.upload_file(src, dst)
+    assert calls.count(2) == upload.SEGMENT_RETRIES
+    assert "2" not in json.load(open(upload.checkpoint_path(src)))["segments"] and not os.path.exists(dst)
+
+def test_verify_reuploads_mismatched_segments(files, monkeypatch):
+    src, dst, data = files
+    copy = upload.SegmentedUpload._copy_segment
+    corrupted = []
+    def silently_corrupt(self, idx):
+        digest = copy(self, idx)
+        if idx == 3 and not corrupted:
+            corrupted.append(idx)
+            with open(self.part, "r+b") as f:
+                f.seek(3 * SEGMENT + 10)
+                f.write(b"\0\0\0")
+        return digest
+    monkeypatch.setattr(upload.SegmentedUpload, "_copy_segment", silently_corrupt)
+    log = io.StringIO()
+    upload.upload_file(src, dst, log_buffer=log)
+    assert "校验发现 1 个分段不一致" in log.getvalue()
+    assert open(dst, "rb").read() == data
+
+def test_discard_removes_partial_upload(files, monkeypatch):
+    src, dst, _ = files
+    counting(monkeypatch, stop_once(2))
+    with pytest.raises(Stop): upload.upload_file(src, dst)
+    upload.SegmentedUpload(src, dst).discard()
+    assert not os.path.exists(dst + upload.PART_EXT) and not os.path.exists(upload.checkpoint_path(src)) and os.path.exists(src)
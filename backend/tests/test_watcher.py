@@ -0,0 +1,58 @@
+import io
+import os
+import time
+import types
+
+import pytest
+
+from app import engine, watcher
+
+
+@pytest.fixture(params=["inotify", "poll"])
+def watched(request, tmp_path, monkeypatch):
+    """开启源目录监控的项目 (轮询间隔保持默认 30 秒); 返回 (源目录, 生成清单的函数)"""
+    monkeypatch.setattr(watcher, "WATCH_BACKEND", request.param)
+    src = tmp_path / "src"
+    (src / "a").mkdir(parents=True)
+    (src / "a" / "one.txt").write_text("1")
+    project_id = 7000 + len(request.param)
+    service = watcher.WatchService()
+    monkeypatch.setattr(watcher, "service", service)
+    service.configure(types.SimpleNamespace(id=project_id, source_path=str(src), exclude_patterns="", watch_source=True))
+    deadline = time.monotonic() + 5
+    while not service.session(project_id) and time.monotonic() < deadline: time.sleep(0.02)
+    assert service.session(project_id)
+
+    def manifest():
+        log = io.StringIO()
+        return sorted(engine.generate_manifest(str(src), [], log, project_id)), log.getvalue()
+    yield src, manifest
+    service.shutdown()
+
+def test_files_created_just_before_a_run_are_included(watched):
+    src, manifest = watched
+    files, log = manifest()
+    assert files == ["a/one.txt"] and "完整扫描" in log
+    (src / "a" / "two.txt").write_text("2")
+    (src / "b" / "c").mkdir(parents=True)
+    (src / "b" / "c" / "three.txt").write_text("3")
+    files, log = manifest()
+    assert files == ["a/one.txt", "a/two.txt", "b/c/three.txt"]
+    assert "复用上次的目录树" in log
+    os.remove(src / "a" / "one.txt")
+    assert manifest()[0] == ["a/two.txt", "b/c/three.txt"]
+
+def test_unconfirmed_flush_falls_back_to_full_scan(watched, monkeypatch):
+    src, manifest = watched
+    manifest()
+    monkeypatch.setattr(watcher, "FLUSH_TIMEOUT", 0.3)
+    stalled = []
+    def stall(self):
+        stalled.append(1)
+        time.sleep(1)
+        return set()
+    monkeypatch.setattr(watcher.PollingBackend, "drain", stall)
+    monkeypatch.setattr(watcher.InotifyBackend, "drain", stall)
+    (src / "late.txt").write_text("x")
+    files, log = manifest()
+    assert "late.txt" in files and "未确认写入最新变更，执行完整扫描" in log and stalled
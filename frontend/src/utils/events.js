@@ -0,0 +1,10 @@
+// Server-Sent Events 订阅，浏览器断线后自动重连
+// handlers: { <事件类型>: fn(data) }，可选 open: fn() 在每次(重新)连接成功时调用，用于补齐断线期间的变化
+export const openEventStream = (url, handlers) => {
+  const es = new EventSource(url)
+  for (const [type, fn] of Object.entries(handlers)) {
+    if (type === 'open') es.addEventListener('open', () => fn())
+    else es.addEventListener(type, (e) => fn(JSON.parse(e.data)))
+  }
+  return () => es.close()
+}
@@ -0,0 +1,68 @@
+import axios from 'axios'
+import { ref } from 'vue'
+
+// 分页查看一次任务的日志: open() 只拉取第一页，滚动到底部 (或调用 more()) 时再拉取下一页，
+// 不一次性把整个日志读入浏览器。没有日志文件的旧记录显示 fallback。
+export const createLogPager = () => {
+  const text = ref(''), done = ref(true), loading = ref(false)
+  let historyId = null, offset = 0, token = 0
+  const more = async () => {
+    if (done.value || loading.value || !historyId) return
+    const current = token
+    loading.value = true
+    try {
+      const res = await axios.get(`/api/history/${historyId}/log`, { params: { offset } })
+      if (current !== token) return
+      text.value += res.data.text
+      done.value = res.data.finished || res.data.next_offset === offset
+      offset = res.data.next_offset
+    } catch (e) {
+      console.error('Fetch log failed', e)
+      if (current === token) done.value = true
+    } finally {
+      if (current === token) loading.value = false
+    }
+  }
+  return {
+    text, done, loading, more,
+    async open (id, fallback = '') {
+      token++
+      historyId = id
+      offset = 0
+      text.value = ''
+      done.value = !id
+      loading.value = false
+      await more()
+      if (!text.value) text.value = fallback
+    },
+    onScroll (e) {
+      const el = e.target
+      if (el.scrollTop + el.clientHeight >= el.scrollHeight - 200) more()
+    }
+  }
+}
+
+// 增量跟踪运行中的日志: poll() 只拉取新增的行，push() 接收 SSE 推送的日志增量。
+// 调用按顺序串行执行，推送的 offset 不连续时自动通过日志接口回补。
+export const createLogTailer = () => {
+  let historyId = null, offset = 0, chain = Promise.resolve('')
+  const fetchMore = async () => {
+    if (!historyId) return ''
+    const res = await axios.get(`/api/history/${historyId}/log`, { params: { offset } })
+    offset = res.data.next_offset
+    return res.data.text
+  }
+  const enqueue = (fn) => (chain = chain.then(fn, fn))
+  return {
+    reset (id) { historyId = id; offset = 0 },
+    get historyId () { return historyId },
+    poll () { return enqueue(fetchMore) },
+    push (ev) {
+      return enqueue(async () => {
+        if (ev.history_id !== historyId || ev.next_offset <= offset) return ''
+        if (ev.offset === offset) { offset = ev.next_offset; return ev.text }
+        return fetchMore()
+      })
+    }
+  }
+}